@@ -0,0 +1,125 @@
+"""
+Added variable and partial residuals for all covariates at once.
+
+statsmodels computes the added variable plot for a covariate x_j by
+refitting the model without x_j (for the outcome residuals) and by
+regressing x_j on the other covariates (for the covariate residuals),
+so a plot for each of p covariates costs 2p extra fits.
+
+For a linear model both sets of residuals follow from the full fit.
+With M = (X'X)^{-1}, the residual of x_j after regressing it on the
+other columns of X is
+
+    e_j = X M[:, j] / M[j, j],
+
+and by the Frisch-Waugh-Lovell theorem the residual of the model
+without x_j is r_j = r + b_j e_j, where r and b are the residuals and
+coefficients of the full model.  `added_variable_resids` evaluates
+these for every covariate with a single n x p by p x p product, using
+the normalized covariance matrix that the fit already holds.
+
+This is exact for OLS and for Gaussian GLMs with the identity link
+and no weights, which are the models used in the workshop.  A GLM
+offset is subtracted from the outcome first, as it is a part of the
+reduced model too.  (An exposure requires the log link.)  For
+other GLMs the reduced model really has to be refit, and statsmodels'
+own `added_variable_resids` should be used.
+"""
+
+import numpy as np
+import pandas as pd
+from statsmodels.genmod import families
+from statsmodels.genmod.generalized_linear_model import GLM
+from statsmodels.regression.linear_model import OLS
+
+
+def _check_model(model):
+    if isinstance(model, OLS):
+        return
+    if isinstance(model, GLM):
+        gaussian = isinstance(model.family, families.Gaussian)
+        identity = isinstance(model.family.link, families.links.Identity)
+        weighted = not (np.all(model.freq_weights == 1) and np.all(model.var_weights == 1))
+        if gaussian and identity and not weighted:
+            return
+    raise ValueError("added variable residuals without refitting require OLS or an "
+                     "unweighted Gaussian GLM with identity link")
+
+
+def _endog(model):
+    # The outcome less the offset, which the reduced models also use.
+    offset = getattr(model, "offset", None)
+    if offset is None:
+        return model.endog
+    return model.endog - offset
+
+
+def _covariates(model, focus_exog):
+    names = list(model.exog_names)
+    if focus_exog is None:
+        # Skip the intercept (a constant column).
+        const = np.ptp(model.exog, axis=0) == 0
+        return [j for j in range(len(names)) if not const[j]]
+    if isinstance(focus_exog, (str, int)):
+        focus_exog = [focus_exog]
+    return [names.index(f) if isinstance(f, str) else f for f in focus_exog]
+
+
+def added_variable_resids(results, focus_exog=None):
+    """
+    Return the added variable residuals for several covariates.
+
+    Parameters
+    ----------
+    results : statsmodels results
+        A fit of OLS, or of a Gaussian GLM with identity link.
+    focus_exog : str, int, or list, optional
+        The covariates, as names or column positions.  By default all
+        non-constant columns are used.
+
+    Returns
+    -------
+    endog_resid : DataFrame
+        For each covariate, the residuals of the outcome from the model
+        that omits that covariate.
+    focus_exog_resid : DataFrame
+        For each covariate, its residuals after regression on the
+        other covariates.
+    """
+    model = results.model
+    _check_model(model)
+    jj = _covariates(model, focus_exog)
+    names = [model.exog_names[j] for j in jj]
+
+    M = np.asarray(results.normalized_cov_params)[:, jj]
+    d = M[jj, np.arange(len(jj))]
+    if np.any(d <= 0):
+        raise ValueError("the design matrix is singular")
+    E = model.exog @ (M / d)
+
+    params = np.asarray(results.params)[jj]
+    resid = _endog(model) - model.exog @ np.asarray(results.params)
+    R = resid[:, None] + E * params
+
+    index = getattr(model.data, "row_labels", None)
+    return (pd.DataFrame(R, index=index, columns=names),
+            pd.DataFrame(E, index=index, columns=names))
+
+
+def partial_resids(results, focus_exog=None):
+    """
+    Return the component plus residual values for several covariates.
+
+    For covariate x_j these are r + b_j x_j, as shown in a CCPR or
+    partial residual plot.  See `added_variable_resids` for the
+    arguments.
+    """
+    model = results.model
+    _check_model(model)
+    jj = _covariates(model, focus_exog)
+    names = [model.exog_names[j] for j in jj]
+    params = np.asarray(results.params)
+    resid = _endog(model) - model.exog @ params
+    P = resid[:, None] + model.exog[:, jj] * params[jj]
+    index = getattr(model.data, "row_labels", None)
+    return pd.DataFrame(P, index=index, columns=names)
@@ -0,0 +1,171 @@
+"""
+Batched version of statsmodels' `predict_functional`.
+
+The workshop calls `predict_functional` once per curve, e.g. once for
+females and once for males, and every call builds its own synthetic
+data frame, runs it through the model formula, and computes its
+confidence band separately.  `predict_functional_batch` evaluates
+several scenarios (settings of the non-focus variables) over a common
+grid of focus variable values at once: the scenarios are stacked into
+one frame that goes through the formula a single time, and the
+standard errors and simultaneous band constants are computed for all
+curves together from one covariance matrix and one Cholesky factor.
+
+The results agree with `predict_functional(result, focus_var,
+values=values, ci_method=...)` for each scenario.
+"""
+
+import numpy as np
+import pandas as pd
+import patsy
+from scipy import stats
+
+
+def _scenario_frame(data, focus_var, fvals, scenarios, summaries):
+    m, s = len(fvals), len(scenarios)
+    names = set()
+    for v in scenarios:
+        names.update(v)
+    names.discard(focus_var)
+    if summaries is not None:
+        names -= set(summaries)
+
+    cols = {focus_var: np.tile(np.asarray(fvals), s)}
+    for name in names:
+        missing = [j for j, v in enumerate(scenarios) if name not in v]
+        if missing:
+            raise ValueError("'%s' is not set in scenario(s) %s" %
+                             (name, ", ".join(str(j) for j in missing)))
+        cols[name] = np.repeat(np.asarray([v[name] for v in scenarios], dtype=object), m)
+        if name in data.columns and isinstance(data[name].dtype, pd.CategoricalDtype):
+            cat = pd.Categorical(cols[name], dtype=data[name].dtype)
+            if (cat.codes < 0).any():
+                raise ValueError("'%s' is set to a value that is not one of its categories"
+                                 % name)
+            cols[name] = cat
+        elif name in data.columns and np.issubdtype(data[name].dtype, np.integer):
+            # Keep floats if the values do not fit the integer column,
+            # e.g. a variable that is not in the formula set to NaN.
+            x = cols[name].astype(np.float64)
+            fits = np.isfinite(x).all() and (x == np.round(x)).all()
+            cols[name] = x.astype(data[name].dtype) if fits else x
+        elif name in data.columns and data[name].dtype != np.dtype("O"):
+            cols[name] = cols[name].astype(data[name].dtype)
+    if summaries is not None:
+        for name, f in summaries.items():
+            cols[name] = np.repeat(f(data[name]), m * s)
+
+    return pd.DataFrame(cols)
+
+
+def _scr_constants(kappa0, alpha, tol=1e-12):
+    """
+    Solve kappa0 exp(-c^2/2) / pi + 2(1 - Phi(c)) = alpha for every kappa0.
+
+    The left side is decreasing in c, so the roots are found by
+    bisection on [1, 10], vectorized over kappa0.
+    """
+    lo = np.ones_like(kappa0)
+    hi = np.full_like(kappa0, 10.)
+
+    def f(c):
+        return kappa0 * np.exp(-c**2 / 2) / np.pi + 2 * stats.norm.sf(c) - alpha
+
+    if np.any(f(lo) < 0) or np.any(f(hi) > 0):
+        raise ValueError("Root finding error in basic SCR")
+    while np.max(hi - lo) > tol:
+        mid = (lo + hi) / 2
+        pos = f(mid) > 0
+        lo = np.where(pos, mid, lo)
+        hi = np.where(pos, hi, mid)
+    return (lo + hi) / 2
+
+
+def predict_functional_batch(result, focus_var, scenarios, summaries=None, alpha=0.05,
+                             ci_method="simultaneous", num_points=10, fvals=None,
+                             linear=True):
+    """
+    Predicted means and confidence bands for several scenarios at once.
+
+    Parameters
+    ----------
+    result : statsmodels results
+        A model fit with a formula, e.g. by `sm.OLS.from_formula`.
+    focus_var : str
+        The variable that varies along each curve.
+    scenarios : list of dict
+        Each dict maps non-focus variables to the values at which they
+        are held fixed, as the `values` argument of
+        `predict_functional`.
+    summaries : dict, optional
+        Variables that are held fixed at a summary (e.g. `np.mean`) of
+        the data used to fit the model, in every scenario.
+    alpha : float
+        `1 - alpha` is the coverage probability.
+    ci_method : str
+        'pointwise' or 'simultaneous'.
+    num_points : int
+        The number of equally spaced quantiles of `focus_var` at which
+        predictions are made; ignored if `fvals` is given.
+    fvals : array_like, optional
+        The values of the focus variable at which predictions are made.
+    linear : bool
+        If False, predictions and bands of a GLM are transformed to the
+        mean scale with the inverse link.
+
+    Returns
+    -------
+    pred : ndarray
+        The predicted values, one row per scenario.
+    cb : ndarray
+        The confidence bands, with shape (scenarios, points, 2).
+    fvals : ndarray
+        The values of the focus variable.
+    """
+    if ci_method not in ("pointwise", "simultaneous"):
+        raise ValueError("ci_method must be 'pointwise' or 'simultaneous'")
+    model = result.model
+    design_info = getattr(model.data, "design_info", None)
+    if design_info is None:
+        raise ValueError("the model must be fit with a formula")
+    data = model.data.frame
+    if data[focus_var].dtype is np.dtype("O"):
+        raise ValueError("focus variable may not have object type")
+
+    if fvals is None:
+        fvals = np.percentile(data[focus_var], np.linspace(0, 100, num_points))
+    fvals = np.asarray(fvals)
+    m, s = len(fvals), len(scenarios)
+
+    fexog = _scenario_frame(data, focus_var, fvals, scenarios, summaries)
+    dexog = np.asarray(patsy.dmatrix(design_info, fexog, NA_action="raise"))
+
+    params = np.asarray(result.params)
+    cov = np.asarray(result.cov_params())
+    pred = dexog @ params
+    sigma = np.sqrt(((dexog @ cov) * dexog).sum(1))
+
+    if ci_method == "pointwise":
+        if result.use_t:
+            q = stats.t.ppf(1 - alpha / 2, result.df_resid)
+        else:
+            q = stats.norm.ppf(1 - alpha / 2)
+        width = q * sigma
+    else:
+        # The basic simultaneous confidence region of Sun et al. (2000),
+        # as in statsmodels' `_glm_basic_scr`, for all curves at once.
+        n = model.exog.shape[0]
+        B = np.linalg.cholesky(np.linalg.inv(cov) / n)
+        bz = np.linalg.solve(B, dexog.T).T / (np.sqrt(n) * sigma[:, None])
+        bz = bz.reshape(s, m, -1)
+        kappa0 = np.sqrt((np.diff(bz, axis=1)**2).sum(2)).sum(1)
+        c = _scr_constants(kappa0, alpha)
+        width = np.repeat(c, m) * sigma
+
+    cb = np.column_stack((pred - width, pred + width))
+    if not linear:
+        link = result.family.link
+        pred = link.inverse(pred)
+        cb = link.inverse(cb)
+
+    return pred.reshape(s, m), cb.reshape(s, m, 2), fvals
@@ -0,0 +1,140 @@
+"""
+Fit one right hand side to many outcomes and many subgroups.
+
+Fitting, say, `RIDAGEYR + BMXBMI + RIAGENDRx` to several blood
+pressure and exam measures, separately within each level of
+`RIDRETH1`, takes one `from_formula` and one `fit` call per
+combination.  Since all outcomes share the design matrix of a
+stratum, `fit_outcomes` builds and factors that matrix once per
+stratum (a singular value decomposition, as used by `OLS.fit`), and
+solves for all outcomes together as a matrix right hand side.
+Strata are processed in parallel.
+
+The result is a tidy data frame with one row per stratum, outcome and
+coefficient.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import patsy
+from scipy import stats
+
+from suffstats import exog_k_constant
+
+
+def _fit_design(X, Y):
+    """
+    OLS of every column of Y on X, through the pseudo-inverse of X.
+    """
+    U, s, Vt = np.linalg.svd(X, full_matrices=False)
+    tol = s.max() * max(X.shape) * np.finfo(np.float64).eps
+    keep = s > tol
+    rank = int(keep.sum())
+    U, s, Vt = U[:, keep], s[keep], Vt[keep, :]
+
+    params = Vt.T @ ((U.T @ Y) / s[:, None])
+    ncp = (Vt.T / s**2) @ Vt
+    resid = Y - X @ params
+    nobs = X.shape[0]
+    df_resid = nobs - rank
+    ssr = (resid**2).sum(0)
+    scale = ssr / df_resid
+    bse = np.sqrt(np.outer(np.diag(ncp), scale))
+
+    if exog_k_constant(X):
+        tss = ((Y - Y.mean(0))**2).sum(0)
+    else:
+        tss = (Y**2).sum(0)
+
+    return dict(params=params, bse=bse, df_resid=df_resid, nobs=nobs,
+                rsquared=1 - ssr / tss)
+
+
+def _fit_stratum(args):
+    rhs, outcomes, data, key = args
+    # Rows are matched by position, since the index of stacked data
+    # (e.g. several cycles joined with pd.concat) may have duplicates.
+    data = data.reset_index(drop=True)
+    X = patsy.dmatrix(rhs, data, return_type="dataframe")
+    Y = data.loc[X.index, outcomes]
+
+    # Outcomes with the same pattern of missing values share a fit.
+    na = Y.isna()
+    patterns = {}
+    for k in outcomes:
+        patterns.setdefault(tuple(na[k].values), []).append(k)
+
+    rows = []
+    for pattern, ks in patterns.items():
+        ii = ~np.asarray(pattern, dtype=bool)
+        # Too few rows for residual degrees of freedom.
+        if ii.sum() <= X.shape[1]:
+            continue
+        r = _fit_design(X.values[ii, :], Y[ks].values[ii, :])
+        tvalues = r["params"] / r["bse"]
+        pvalues = 2 * stats.t.sf(np.abs(tvalues), r["df_resid"])
+        for j, k in enumerate(ks):
+            for i, term in enumerate(X.columns):
+                rows.append(key + (k, term, r["params"][i, j], r["bse"][i, j],
+                                   tvalues[i, j], pvalues[i, j], r["nobs"],
+                                   r["rsquared"][j]))
+    return rows
+
+
+def fit_outcomes(rhs, outcomes, data, by=None, n_workers=1):
+    """
+    Fit the same OLS right hand side to several outcomes and strata.
+
+    Parameters
+    ----------
+    rhs : str
+        The right hand side of a patsy formula,
+        e.g. "RIDAGEYR + BMXBMI + RIAGENDRx".
+    outcomes : list of str
+        The outcome variables.
+    data : DataFrame
+        The data.
+    by : str or list of str, optional
+        Variables defining strata; a separate model is fit within
+        each stratum.
+    n_workers : int
+        The number of processes used for the strata; None uses all
+        available cores.
+
+    Returns
+    -------
+    A DataFrame with columns for the `by` variables, then 'outcome',
+    'term', 'coef', 'bse', 'tvalue', 'pvalue', 'nobs' and 'rsquared'.
+    For each outcome, rows with a missing value in the outcome or in
+    the variables of `rhs` are dropped, as in `from_formula`.
+    Data dependent transforms in `rhs` (e.g. the knots of `bs()`) are
+    computed once per stratum, before outcome-specific rows are
+    dropped.  Unobserved levels of categorical `by` variables are
+    skipped, as are outcomes in a stratum with no more rows than
+    design matrix columns.
+    """
+    outcomes = list(outcomes)
+    if by is None:
+        by = []
+    elif isinstance(by, str):
+        by = [by]
+
+    if by:
+        tasks = [(rhs, outcomes, g, key if isinstance(key, tuple) else (key,))
+                 for key, g in data.groupby(by, observed=True)]
+    else:
+        tasks = [(rhs, outcomes, data, ())]
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if n_workers == 1 or len(tasks) == 1:
+        rows = [_fit_stratum(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(n_workers) as ex:
+            rows = list(ex.map(_fit_stratum, tasks))
+
+    columns = by + ["outcome", "term", "coef", "bse", "tvalue", "pvalue", "nobs", "rsquared"]
+    return pd.DataFrame([r for rr in rows for r in rr], columns=columns)
@@ -0,0 +1,59 @@
+"""
+Bootstrap replicates per second: a loop of statsmodels fits versus
+the batched engine in bootstrap.py, with one and several workers.
+
+    python bench_bootstrap.py --rows 5000 --nrep 2000 --workers 4
+"""
+
+import argparse
+import time
+
+import numpy as np
+import statsmodels.api as sm
+
+from bootstrap import bootstrap_formula
+from nhanes_data import NHANES_VARS, synthetic_nhanes
+
+FORMULA = "BPXSY1 ~ bs(RIDAGEYR, 5) + BMXBMI + RIAGENDRx"
+
+
+def naive(da, nrep, seed):
+    rng = np.random.default_rng(seed)
+    reps = []
+    for _ in range(nrep):
+        ii = rng.integers(0, da.shape[0], da.shape[0])
+        dx = da.iloc[ii].reset_index(drop=True)
+        reps.append(sm.OLS.from_formula(FORMULA, dx).fit().params)
+    return np.asarray(reps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--nrep", type=int, default=1000)
+    parser.add_argument("--naive-nrep", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    da = synthetic_nhanes(args.rows)[NHANES_VARS].dropna()
+    da["RIAGENDRx"] = da.RIAGENDR.replace({1: "Male", 2: "Female"})
+
+    t0 = time.perf_counter()
+    naive(da, args.naive_nrep, 0)
+    rate = args.naive_nrep / (time.perf_counter() - t0)
+    print("%-20s %10.1f replicates/s" % ("naive loop", rate))
+
+    results = {}
+    for w in sorted({1, args.workers}):
+        t0 = time.perf_counter()
+        results[w] = bootstrap_formula(FORMULA, da, nrep=args.nrep, seed=0, n_workers=w)
+        rate = args.nrep / (time.perf_counter() - t0)
+        print("%-20s %10.1f replicates/s" % ("batched, %d worker(s)" % w, rate))
+
+    reps = [r.replicates.values for r in results.values()]
+    if not all(np.array_equal(reps[0], r, equal_nan=True) for r in reps[1:]):
+        print("WARNING: replicates depend on the number of workers")
+
+
+if __name__ == "__main__":
+    main()
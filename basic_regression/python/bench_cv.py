@@ -0,0 +1,89 @@
+"""
+Cross validation of an OLS model: refitting from the formula versus
+the closed-form and downdating engine in cv_ols.py.
+
+Leave-one-out refits are timed on a subset of the rows and
+extrapolated to all of them.
+
+    python bench_cv.py --rows 20000 --k 10 --workers 4
+"""
+
+import argparse
+import time
+
+import numpy as np
+import statsmodels.api as sm
+
+from cv_ols import kfold_formula, loocv_formula
+from nhanes_data import NHANES_VARS, synthetic_nhanes
+
+FORMULA = "BPXSY1 ~ bs(RIDAGEYR, 5) + BMXBMI + RIAGENDRx"
+
+
+def naive_kfold(da, folds):
+    # The spline knots are placed from the full data, as in cv_ols, so
+    # that the two give the same fits.
+    X = sm.OLS.from_formula(FORMULA, da).exog
+    y = da.BPXSY1.values
+    resid = np.empty(len(y))
+    for f in np.unique(folds):
+        ii = folds == f
+        fit = sm.OLS(y[~ii], X[~ii]).fit()
+        resid[ii] = y[ii] - fit.predict(X[ii])
+    return resid
+
+
+def naive_loocv(da, rows):
+    X = sm.OLS.from_formula(FORMULA, da).exog
+    y = da.BPXSY1.values
+    resid = np.empty(len(rows))
+    keep = np.ones(len(y), dtype=bool)
+    for j, i in enumerate(rows):
+        keep[i] = False
+        fit = sm.OLS(y[keep], X[keep]).fit()
+        resid[j] = y[i] - fit.predict(X[i:i + 1])[0]
+        keep[i] = True
+    return resid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--loo-rows", type=int, default=200,
+                        help="rows refit by the naive leave-one-out loop")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    da = synthetic_nhanes(args.rows)[NHANES_VARS].dropna().reset_index(drop=True)
+    da["RIAGENDRx"] = da.RIAGENDR.replace({1: "Male", 2: "Female"})
+    n = da.shape[0]
+    print("%d rows, %d folds" % (n, args.k))
+
+    t0 = time.perf_counter()
+    loo = loocv_formula(FORMULA, da)
+    t_loo = time.perf_counter() - t0
+    rows = np.random.default_rng(0).choice(n, min(args.loo_rows, n), replace=False)
+    t0 = time.perf_counter()
+    ref = naive_loocv(da, rows)
+    t_naive = (time.perf_counter() - t0) * n / len(rows)
+    print("%-32s %9.3f s" % ("leave-one-out, refits (est.)", t_naive))
+    print("%-32s %9.3f s   max abs diff %.2g" % ("leave-one-out, PRESS", t_loo,
+                                                 np.abs(loo.resid[rows] - ref).max()))
+
+    for w in sorted({1, args.workers}):
+        t0 = time.perf_counter()
+        cv = kfold_formula(FORMULA, da, k=args.k, seed=0, n_workers=w)
+        t = time.perf_counter() - t0
+        if w == 1:
+            t0 = time.perf_counter()
+            ref = naive_kfold(da, cv.folds)
+            print("%-32s %9.3f s" % ("k-fold, refits", time.perf_counter() - t0))
+        print("%-32s %9.3f s   max abs diff %.2g" % ("k-fold, downdating, %d worker(s)" % w,
+                                                     t, np.abs(cv.resid - ref).max()))
+
+    print("cv mse %.3f, loo mse %.3f, cv R^2 %.4f" % (cv.mse, loo.mse, cv.rsquared))
+
+
+if __name__ == "__main__":
+    main()
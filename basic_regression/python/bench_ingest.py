@@ -0,0 +1,90 @@
+"""
+Compare peak memory of the eager and chunked NHANES loaders.
+
+A synthetic NHANES-shaped CSV file is written to a temporary
+directory (optionally repeated to mimic several stacked survey
+cycles), then each loader is run in a fresh process and its peak
+resident set size is reported.
+
+    python bench_ingest.py --rows 200000 --extra 60 --cycles 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from nhanes_data import NHANES_VARS, load_nhanes_chunked, synthetic_nhanes
+
+
+def _peak_rss_mb():
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return r / 2**20 if sys.platform == "darwin" else r / 2**10
+
+
+def eager(files):
+    da = pd.concat([pd.read_csv(f) for f in files])
+    return da[NHANES_VARS].dropna()
+
+
+def chunked(files, chunksize):
+    return load_nhanes_chunked(files, NHANES_VARS, chunksize=chunksize)
+
+
+def _run(args):
+    method, files, chunksize = args
+    t0 = time.perf_counter()
+    if method == "eager":
+        da = eager(files)
+    else:
+        da = chunked(files, chunksize)
+    elapsed = time.perf_counter() - t0
+    return da.shape[0], float(da.BPXSY1.sum()), elapsed, _peak_rss_mb()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000, help="rows per cycle")
+    parser.add_argument("--extra", type=int, default=40, help="unused columns per file")
+    parser.add_argument("--cycles", type=int, default=2, help="number of stacked files")
+    parser.add_argument("--chunksize", type=int, default=50000)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        files = []
+        for j in range(args.cycles):
+            fname = os.path.join(tmp, "cycle%d.csv" % j)
+            synthetic_nhanes(args.rows, seed=j, extra=args.extra).to_csv(fname, index=False)
+            files.append(fname)
+        size = sum(os.path.getsize(f) for f in files) / 2**20
+        print("%d file(s), %.1f MB of CSV" % (len(files), size))
+
+        # The baseline is the RSS of a child that only imports the
+        # modules, so the reported increments reflect the data.
+        results = {}
+        for method in "baseline", "eager", "chunked":
+            with ctx.Pool(1) as pool:
+                if method == "baseline":
+                    results[method] = pool.apply(_peak_rss_mb)
+                else:
+                    results[method] = pool.apply(_run, ((method, files, args.chunksize),))
+
+    base = results["baseline"]
+    print("%-8s %10s %10s %14s" % ("method", "rows", "seconds", "peak RSS (MB)"))
+    for method in "eager", "chunked":
+        nrow, _, elapsed, rss = results[method]
+        print("%-8s %10d %10.2f %8.1f (+%.1f)" % (method, nrow, elapsed, rss, rss - base))
+
+    if results["eager"][0:2] != results["chunked"][0:2]:
+        print("WARNING: eager and chunked loaders returned different data")
+
+
+if __name__ == "__main__":
+    main()
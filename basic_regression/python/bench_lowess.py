@@ -0,0 +1,45 @@
+"""
+Compare exact lowess with the binned approximation in diagnostics.py.
+
+For increasing sample sizes, an added-variable-like scatter (a smooth
+trend plus heteroskedastic noise) is smoothed both ways, and the run
+times and the largest difference between the two smooths, relative
+to the standard deviation of y, are reported.
+
+    python bench_lowess.py --sizes 1000 10000 50000
+"""
+
+import argparse
+import time
+
+import numpy as np
+from statsmodels.nonparametric.smoothers_lowess import lowess
+
+from diagnostics import binned_lowess
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--frac", type=float, default=0.5)
+    parser.add_argument("--gridsize", type=int, default=256)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print("%10s %12s %12s %14s" % ("n", "exact (s)", "binned (s)", "max err / sd"))
+    for n in args.sizes:
+        x = rng.normal(size=n)
+        y = np.sin(2 * x) + x + (1 + 0.5 * np.abs(x)) * rng.normal(size=n)
+
+        t0 = time.perf_counter()
+        exact = lowess(y, x, frac=args.frac)
+        t1 = time.perf_counter()
+        approx = binned_lowess(y, x, frac=args.frac, gridsize=args.gridsize)
+        t2 = time.perf_counter()
+
+        err = np.abs(np.interp(exact[:, 0], approx[:, 0], approx[:, 1]) - exact[:, 1])
+        print("%10d %12.3f %12.4f %14.4f" % (n, t1 - t0, t2 - t1, err.max() / y.std()))
+
+
+if __name__ == "__main__":
+    main()
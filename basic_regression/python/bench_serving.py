@@ -0,0 +1,128 @@
+"""
+Scoring latency: statsmodels' result.predict versus exported models,
+directly and through the batching HTTP service.
+
+The spline and interaction models of the workshop are fit to
+synthetic data, exported to JSON, and loaded back.  Their predictions
+are checked against `result.predict`, and then timed for single
+records and for a batch.  Finally a local HTTP server is started and
+concurrent clients send one record per request over keep-alive
+connections.
+
+    python bench_serving.py --clients 64 --requests 200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import statsmodels.api as sm
+
+from model_export import export_model, load_model, save_model
+from nhanes_data import NHANES_VARS, synthetic_nhanes
+from scoring_service import ScoringService, serve_http
+
+
+def _fit(n):
+    da = synthetic_nhanes(n)[NHANES_VARS].dropna()
+    da["RIAGENDRx"] = da.RIAGENDR.replace({1: "Male", 2: "Female"})
+    age_mean = da.RIDAGEYR.mean()
+    da["RIDAGEYR_cen"] = da.RIDAGEYR - age_mean
+
+    spline = sm.OLS.from_formula("BPXSY1 ~ bs(RIDAGEYR, 5) + BMXBMI + RIAGENDRx", da).fit()
+    inter = sm.OLS.from_formula("BPXSY1 ~ RIDAGEYR_cen*RIAGENDRx + BMXBMI", da).fit()
+    return da, {"spline": (spline, {}),
+                "interaction": (inter, {"RIDAGEYR_cen": ("RIDAGEYR", age_mean)})}
+
+
+def _per_call(f, reps):
+    t0 = time.perf_counter()
+    for _ in range(reps):
+        f()
+    return (time.perf_counter() - t0) / reps
+
+
+async def _client(host, port, name, records, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    for rec in records:
+        body = json.dumps(rec).encode()
+        t0 = time.perf_counter()
+        writer.write(b"POST /predict/%s HTTP/1.1\r\nHost: %s\r\nContent-Length: %d\r\n\r\n"
+                     % (name.encode(), host.encode(), len(body)) + body)
+        await writer.drain()
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line == b"\r\n":
+                break
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        json.loads(await reader.readexactly(length))
+        latencies.append(time.perf_counter() - t0)
+    writer.close()
+
+
+async def _load_test(models, records, clients, requests):
+    service = ScoringService(models)
+    async with service:
+        server = await serve_http(service, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        latencies = []
+        names = list(models)
+        t0 = time.perf_counter()
+        await asyncio.gather(*[
+            _client("127.0.0.1", port, names[c % len(names)],
+                    records[(c * requests) % len(records):][0:requests], latencies)
+            for c in range(clients)])
+        elapsed = time.perf_counter() - t0
+        server.close()
+        await server.wait_closed()
+    return np.asarray(latencies), elapsed, service.records / max(service.batches, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000, help="rows used to fit the models")
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=100, help="requests per client")
+    args = parser.parse_args()
+
+    da, fits = _fit(args.rows)
+    new = da.sample(args.batch, replace=True, random_state=0)
+    records = new[["RIDAGEYR", "BMXBMI", "RIAGENDRx"]].to_dict("records")
+
+    models = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (result, derived) in fits.items():
+            path = os.path.join(tmp, name + ".json")
+            save_model(export_model(result, derived), path)
+            models[name] = load_model(path)
+            size = os.path.getsize(path)
+
+            diff = np.abs(models[name].predict(new) - result.predict(new)).max()
+            one = new.iloc[0:1]
+            t_sm1 = _per_call(lambda: result.predict(one), 50)
+            t_sm = _per_call(lambda: result.predict(new), 10)
+            t_c1 = _per_call(lambda: models[name].predict_records(records[0:1]), 500)
+            t_c = _per_call(lambda: models[name].predict_records(records), 50)
+            print("%s model: %d byte JSON, max abs difference %.2g" % (name, size, diff))
+            print("  %-22s %10.1f us/record  %10.2f us/row for %d rows"
+                  % ("result.predict", t_sm1 * 1e6, t_sm / args.batch * 1e6, args.batch))
+            print("  %-22s %10.1f us/record  %10.2f us/row for %d rows"
+                  % ("exported", t_c1 * 1e6, t_c / args.batch * 1e6, args.batch))
+
+    lat, elapsed, mean_batch = asyncio.run(_load_test(models, records, args.clients,
+                                                      args.requests))
+    print("HTTP, %d clients x %d requests: %.0f requests/s, latency p50 %.2f ms, "
+          "p99 %.2f ms, mean batch %.1f records"
+          % (args.clients, args.requests, len(lat) / elapsed, np.median(lat) * 1e3,
+             np.quantile(lat, 0.99) * 1e3, mean_batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Fitting several formulas in a process pool: pickling the data frame
+versus a SharedFrame.
+
+Three ways of getting the analysis data to the workers are compared:
+
+    per task     the DataFrame is an argument of every task
+    per worker   the DataFrame is passed once to a pool initializer
+    shared       a SharedFrame handle is passed with every task
+
+For each, the wall time of fitting all formulas is reported, along
+with the memory of the workers after their last task, summed over
+workers: the private memory (USS, what each worker holds alone) and
+the proportional set size (PSS, which splits shared pages among the
+processes using them).  Memory figures are read from /proc and are
+only available on Linux.
+
+    python bench_shared.py --rows 1000000 --workers 4 --formulas 16
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import pandas as pd
+
+from nhanes_data import NHANES_VARS, synthetic_nhanes
+from shared_frame import SharedFrame
+
+FORMULAS = [
+    "BPXSY1 ~ RIDAGEYR",
+    "BPXSY1 ~ RIDAGEYR + RIAGENDRx",
+    "BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx",
+    "BPXSY1 ~ bs(RIDAGEYR, 5) + BMXBMI + RIAGENDRx",
+    "BPXSY1 ~ RIDAGEYR*RIAGENDRx + BMXBMI",
+    "BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx + C(RIDRETH1)",
+    "BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx + C(DMDEDUC2)",
+    "BPXSY1 ~ RIDAGEYR + BMXBMI*RIAGENDRx + C(SMQ020)",
+]
+
+
+def _memory_mb():
+    mem = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if parts[0] in ("Pss:", "Private_Clean:", "Private_Dirty:"):
+                    mem[parts[0]] = int(parts[1]) / 1024
+    except OSError:
+        return float("nan"), float("nan")
+    return mem["Private_Clean:"] + mem["Private_Dirty:"], mem["Pss:"]
+
+
+def _fit(da, formula):
+    from statsmodels.regression.linear_model import OLS
+    OLS.from_formula(formula, da).fit()
+    return (os.getpid(),) + _memory_mb()
+
+
+def _per_task(args):
+    da, formula = args
+    return _fit(da, formula)
+
+
+_worker = {}
+
+
+def _init_worker(da):
+    _worker["da"] = da
+
+
+def _per_worker(formula):
+    return _fit(_worker["da"], formula)
+
+
+def _shared(args):
+    shared, formula = args
+    return _fit(shared.frame(), formula)
+
+
+def run(da, formulas, workers, context):
+    ctx = multiprocessing.get_context(context)
+    rows = []
+
+    def record(name, t, out):
+        last = {}
+        for pid, uss, pss in out:
+            last[pid] = (uss, pss)
+        rows.append({"method": name, "seconds": t,
+                     "uss_mb": sum(v[0] for v in last.values()),
+                     "pss_mb": sum(v[1] for v in last.values())})
+
+    t0 = time.perf_counter()
+    with ctx.Pool(workers) as pool:
+        out = pool.map(_per_task, [(da, f) for f in formulas], chunksize=1)
+    record("per task", time.perf_counter() - t0, out)
+
+    t0 = time.perf_counter()
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(da,)) as pool:
+        out = pool.map(_per_worker, formulas, chunksize=1)
+    record("per worker", time.perf_counter() - t0, out)
+
+    t0 = time.perf_counter()
+    with SharedFrame.from_frame(da) as shared:
+        with ctx.Pool(workers) as pool:
+            out = pool.map(_shared, [(shared, f) for f in formulas], chunksize=1)
+        record("shared", time.perf_counter() - t0, out)
+        nbytes = shared.nbytes
+
+    return pd.DataFrame(rows), nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--formulas", type=int, default=16)
+    parser.add_argument("--context", default="spawn", choices=["spawn", "fork", "forkserver"])
+    args = parser.parse_args()
+
+    da = synthetic_nhanes(args.rows)[NHANES_VARS].dropna()
+    # As a categorical, so that all three methods fit the same columns
+    # (a SharedFrame stores strings as categoricals).
+    da["RIAGENDRx"] = da.RIAGENDR.replace({1: "Male", 2: "Female"}).astype("category")
+    formulas = (FORMULAS * args.formulas)[0:args.formulas]
+
+    df, nbytes = run(da, formulas, args.workers, args.context)
+    print("%d rows, data frame %.1f MB, shared block %.1f MB, %d formulas, %d workers"
+          % (len(da), da.memory_usage(deep=True).sum() / 2**20, nbytes / 2**20,
+             len(formulas), args.workers))
+    print(df.to_string(index=False, float_format="%.2f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Import time of the workflow modules and of the libraries they use.
+
+Each statement is run in a fresh interpreter, several times, and the
+median time of the statement itself (not counting interpreter
+startup) is reported, along with which of the heavy plotting and
+sandbox modules it loaded.  The first rows show the imports at the top
+of nhanes_ols.py for comparison.  Finally the fit-only entry point of
+nhanes_workflow.py is run end to end on a synthetic file with an
+empty cache.
+
+    python bench_startup.py --repeat 5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from nhanes_data import synthetic_nhanes
+
+HEAVY = ["matplotlib.pyplot", "seaborn", "statsmodels.sandbox.predict_functional",
+         "statsmodels.graphics.regressionplots", "scipy.signal"]
+
+STATEMENTS = [
+    ("nhanes_ols.py imports",
+     "import matplotlib.pyplot as plt; import seaborn as sns; import pandas as pd; "
+     "import statsmodels.api as sm; import numpy as np; "
+     "from statsmodels.sandbox.predict_functional import predict_functional"),
+    ("statsmodels.api", "import statsmodels.api"),
+    ("matplotlib.pyplot", "import matplotlib.pyplot"),
+    ("seaborn", "import seaborn"),
+    ("OLS and GLM only", "from statsmodels.regression.linear_model import OLS; "
+     "from statsmodels.genmod.generalized_linear_model import GLM"),
+    ("nhanes_workflow", "import nhanes_workflow"),
+    ("diagnostics", "import diagnostics"),
+    ("model_export", "import model_export"),
+]
+
+_TEMPLATE = """
+import sys, time, json
+t0 = time.perf_counter()
+%s
+t = time.perf_counter() - t0
+print(json.dumps([t, [m for m in %r if m in sys.modules]]))
+"""
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_statement(stmt, repeat):
+    """
+    Return the median import time and the heavy modules loaded.
+    """
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _TEMPLATE % (stmt, HEAVY)], cwd=HERE,
+                             capture_output=True, text=True, check=True)
+        t, loaded = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(t)
+    return float(np.median(times)), loaded
+
+
+def time_fit_only(rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = os.path.join(tmp, "nhanes.csv")
+        synthetic_nhanes(rows).to_csv(csv, index=False)
+        cmd = [sys.executable, os.path.join(HERE, "nhanes_workflow.py"), "--source", csv,
+               "--cache-dir", os.path.join(tmp, "cache"), "--fit-only",
+               "--export", os.path.join(tmp, "models")]
+        t0 = time.perf_counter()
+        subprocess.run(cmd, cwd=HERE, capture_output=True, check=True)
+        return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=5000,
+                        help="rows of the synthetic file for the fit-only run")
+    args = parser.parse_args()
+
+    # Run once so that the timed runs do not include writing bytecode
+    # caches.
+    for _, stmt in STATEMENTS:
+        time_statement(stmt, 1)
+
+    for name, stmt in STATEMENTS:
+        t, loaded = time_statement(stmt, args.repeat)
+        print("%-24s %8.3f s   %s" % (name, t, ", ".join(loaded) or "-"))
+
+    print("%-24s %8.3f s   (total, including interpreter startup)"
+          % ("fit-only workflow run", time_fit_only(args.rows)))
+
+
+if __name__ == "__main__":
+    main()
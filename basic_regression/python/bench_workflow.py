@@ -0,0 +1,290 @@
+"""
+Time and memory of the steps of nhanes_ols.py at increasing data sizes.
+
+For each size a synthetic NHANES-shaped CSV file is written to a
+temporary directory, and each step of the workshop is measured on it in
+a fresh process, after running (untimed) the steps whose results it
+uses:
+
+    load      pd.read_csv of the full file
+    project   selecting the analysis columns, dropna, gender labels
+    design    patsy design matrices for the main formula
+    ols       OLS fit from the design matrices
+    glm       Gaussian GLM fit from the design matrices
+    bands     predict_functional with simultaneous confidence bands
+    plots     residual, CCPR and added variable plots (diagnostics.py)
+
+The steps are run twice.  The first run measures wall time and the
+peak resident set size during the step, with `rss_growth_mb`, how far
+the peak rose above the resident set size at the start of the step.
+The peak can only be reset on Linux; elsewhere `peak_rss_reset` is
+false, the peak includes the untimed steps run before the step, and
+the growth is not reported.  The second run traces allocations with
+tracemalloc (which slows it down), and records each step's peak
+traced memory, the memory still held when it finishes, and the number
+of memory blocks it left allocated.
+
+Results are written as JSON, with the versions of the main packages
+and the git commit, so that runs can be compared across commits:
+
+    python bench_workflow.py --sizes 10000 100000 1000000 10000000 --output new.json
+    python bench_workflow.py --output new.json --baseline old.json
+
+No network access is needed.
+"""
+
+import argparse
+import gc
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import patsy
+import statsmodels
+import statsmodels.api as sm
+
+from nhanes_data import NHANES_VARS, synthetic_nhanes
+
+FORMULA = "BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx"
+
+VALUES = {"RIAGENDRx": "Female", "RIAGENDR": 2, "BMXBMI": 25,
+          "DMDEDUC2": 1, "RIDRETH1": 1, "SMQ020": 1}
+
+
+def _reset_peak_rss():
+    """
+    Reset the peak resident set size of the process, where possible.
+
+    Only Linux allows this (through /proc/self/clear_refs); returns
+    False elsewhere.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return r / 2**20 if sys.platform == "darwin" else r / 2**10
+
+
+def _load(st):
+    st["raw"] = pd.read_csv(st["csv"])
+
+
+def _project(st):
+    da = st["raw"][NHANES_VARS].dropna()
+    da["RIAGENDRx"] = da.RIAGENDR.replace({1: "Male", 2: "Female"})
+    st["da"] = da
+
+
+def _design(st):
+    st["y"], st["X"] = patsy.dmatrices(FORMULA, st["da"], return_type="dataframe")
+
+
+def _ols(st):
+    st["ols"] = sm.OLS(st["y"], st["X"]).fit()
+
+
+def _glm(st):
+    st["glm"] = sm.GLM(st["y"], st["X"]).fit()
+
+
+def _bands_setup(st):
+    st["fit"] = sm.OLS.from_formula(FORMULA, st["da"]).fit()
+
+
+def _bands(st):
+    from statsmodels.sandbox.predict_functional import predict_functional
+    st["bands"] = predict_functional(st["fit"], "RIDAGEYR", values=VALUES,
+                                     ci_method="simultaneous")
+
+
+def _plots(st):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import diagnostics
+
+    fig, axes = plt.subplots(1, 3, figsize=(12, 4))
+    diagnostics.plot_resid_fitted(st["ols"], ax=axes[0], lowess_frac=0.5)
+    diagnostics.plot_ccpr(st["ols"], "RIDAGEYR", ax=axes[1])
+    diagnostics.plot_added_variable(st["glm"], "BMXBMI", ax=axes[2], lowess_frac=0.5)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    plt.close(fig)
+    st["png"] = buf.getvalue()
+
+
+# (name, untimed setup, step, the stages whose results the step uses)
+STAGES = [
+    ("load", None, _load, []),
+    ("project", None, _project, ["load"]),
+    ("design", None, _design, ["project"]),
+    ("ols", None, _ols, ["design"]),
+    ("glm", None, _glm, ["design"]),
+    ("bands", _bands_setup, _bands, ["project"]),
+    ("plots", None, _plots, ["ols", "glm"]),
+]
+
+
+def _prerequisites(name):
+    """
+    Return the stages that must run before `name`, in the order of STAGES.
+    """
+    deps = {s[0]: s[3] for s in STAGES}
+    need, todo = set(), list(deps[name])
+    while todo:
+        d = todo.pop()
+        if d not in need:
+            need.add(d)
+            todo.extend(deps[d])
+    return [s for s in STAGES if s[0] in need]
+
+
+def _run_stage(args):
+    """
+    Measure one stage, in a process of its own.
+
+    The stages it depends on are run first, untimed.
+    """
+    csv, name = args
+    st = {"csv": csv}
+    for _, setup, step, _ in _prerequisites(name):
+        if setup is not None:
+            setup(st)
+        step(st)
+    _, setup, step, _ = [s for s in STAGES if s[0] == name][0]
+    if setup is not None:
+        setup(st)
+    before = dict(st)
+
+    gc.collect()
+    reset = _reset_peak_rss()
+    # Just after a reset the peak is the current resident set size.
+    rss0 = _peak_rss_mb()
+    t0 = time.perf_counter()
+    step(st)
+    record = {"stage": name, "seconds": time.perf_counter() - t0,
+              "peak_rss_mb": _peak_rss_mb(), "peak_rss_reset": reset}
+    record["rss_growth_mb"] = record["peak_rss_mb"] - rss0 if reset else None
+    rows = st["da"].shape[0] if "da" in st else None
+
+    # Run the step again from the same inputs, tracing allocations.
+    del st
+    st = dict(before)
+    gc.collect()
+    tracemalloc.start()
+    blocks0 = sys.getallocatedblocks()
+    step(st)
+    size1, peak = tracemalloc.get_traced_memory()
+    record.update(traced_peak_mb=peak / 2**20, retained_mb=size1 / 2**20,
+                  blocks=sys.getallocatedblocks() - blocks0)
+    tracemalloc.stop()
+
+    return rows, record
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def run(sizes, stages, extra=20, seed=0):
+    """
+    Run the benchmark and return a JSON-serializable dict.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            csv = os.path.join(tmp, "nhanes_%d.csv" % n)
+            synthetic_nhanes(n, seed=seed, extra=extra).to_csv(csv, index=False)
+            size_rows = None
+            for name in [s[0] for s in STAGES if s[0] in stages]:
+                with ctx.Pool(1) as pool:
+                    rows, r = pool.apply(_run_stage, ((csv, name),))
+                size_rows = rows if rows is not None else size_rows
+                results.append(r)
+            os.remove(csv)
+            for r in results:
+                r.setdefault("size", n)
+                r.setdefault("rows", size_rows)
+
+    return {
+        "commit": _git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "versions": {"numpy": np.__version__, "pandas": pd.__version__,
+                     "patsy": patsy.__version__, "statsmodels": statsmodels.__version__},
+        "extra_columns": extra,
+        "results": results,
+    }
+
+
+def compare(new, old):
+    """
+    Return a table of the time ratios of two runs, by size and stage.
+    """
+    a = pd.DataFrame(new["results"]).set_index(["size", "stage"])
+    b = pd.DataFrame(old["results"]).set_index(["size", "stage"])
+    df = pd.DataFrame({"seconds": a.seconds, "baseline": b.seconds}).dropna()
+    df["ratio"] = df.seconds / df.baseline
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--stages", nargs="+", default=[s[0] for s in STAGES],
+                        choices=[s[0] for s in STAGES])
+    parser.add_argument("--extra", type=int, default=20, help="unused columns in the CSV")
+    parser.add_argument("--output", default="bench_workflow.json")
+    parser.add_argument("--baseline", help="a previous output file to compare with")
+    args = parser.parse_args()
+
+    out = run(args.sizes, args.stages, args.extra)
+    with open(args.output, "w") as f:
+        json.dump(out, f, indent=1)
+
+    df = pd.DataFrame(out["results"])
+    cols = ["size", "stage", "seconds", "peak_rss_mb", "rss_growth_mb", "traced_peak_mb",
+            "retained_mb", "blocks"]
+    print(df[cols].to_string(index=False, float_format="%.3f"))
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            old = json.load(f)
+        print()
+        print("Compared with %s (commit %s):" % (args.baseline, old.get("commit")))
+        print(compare(out, old).to_string(float_format="%.3f"))
+
+
+if __name__ == "__main__":
+    main()
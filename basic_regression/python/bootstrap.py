@@ -0,0 +1,191 @@
+"""
+Nonparametric bootstrap for OLS fits, solved in batches.
+
+Refitting a model in a loop over resampled data frames spends most of
+its time in formula processing and per-fit overhead.  Here the design
+matrix is built once.  A bootstrap resample of the rows is represented
+by a vector of multinomial counts w, and the replicate estimate solves
+the weighted normal equations
+
+    X' diag(w) X b = X' diag(w) y.
+
+For a block of B replicates with count matrix W (B x n), all of the
+weighted cross products are obtained with one matrix product W Z,
+where the rows of Z hold the distinct products x_i x_j and x_i y of
+each observation, followed by a batched p x p solve.  The counts are
+drawn into a reused buffer of at most `COUNT_BUFFER_BYTES`, so on
+large data W Z is formed a few rows of W at a time and memory does
+not grow with the block size times n.
+
+Replicates are generated in fixed-size blocks, each with its own
+random stream spawned from the seed, and blocks are distributed over a
+process pool.  The result for a given seed and block size therefore
+does not depend on the number of workers.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from design_cache import DesignCache
+
+
+def _products(endog, exog):
+    """
+    Return Z such that (W @ Z) holds X'WX (upper triangle) and X'Wy.
+    """
+    p = exog.shape[1]
+    iu = np.triu_indices(p)
+    Z = np.empty((exog.shape[0], len(iu[0]) + p))
+    Z[:, 0:len(iu[0])] = exog[:, iu[0]] * exog[:, iu[1]]
+    Z[:, len(iu[0]):] = exog * endog[:, None]
+    return Z
+
+
+# The most memory used for the count vectors of a block, in bytes.
+# Blocks on large data are reduced in several products of at most this
+# many rows of W at a time.
+COUNT_BUFFER_BYTES = 32 * 2**20
+
+
+def _solve_block(Z, p, nobs, nrep, seed):
+    rng = np.random.default_rng(seed)
+    rows = int(max(1, min(nrep, COUNT_BUFFER_BYTES // (8 * nobs))))
+    W = np.empty((rows, nobs))
+    S = np.empty((nrep, Z.shape[1]))
+    for i in range(0, nrep, rows):
+        k = min(rows, nrep - i)
+        for r in range(k):
+            # The counts of n draws with replacement, a multinomial vector.
+            W[r] = np.bincount(rng.integers(0, nobs, nobs), minlength=nobs)
+        np.matmul(W[0:k], Z, out=S[i:i + k])
+
+    iu = np.triu_indices(p)
+    m = len(iu[0])
+    xtx = np.empty((nrep, p, p))
+    xtx[:, iu[0], iu[1]] = S[:, 0:m]
+    xtx[:, iu[1], iu[0]] = S[:, 0:m]
+    xty = S[:, m:]
+
+    params = np.full((nrep, p), np.nan)
+    # A resample can be singular (e.g. a rare category is not drawn);
+    # such replicates are returned as missing.
+    ok = np.linalg.matrix_rank(xtx) == p
+    params[ok] = np.linalg.solve(xtx[ok], xty[ok][:, :, None])[:, :, 0]
+    return params
+
+
+# Per-process state, so that Z is sent to each worker only once.
+_worker = {}
+
+
+def _init_worker(Z, p, nobs):
+    _worker.update(Z=Z, p=p, nobs=nobs)
+
+
+def _run_block(args):
+    nrep, seed = args
+    return _solve_block(_worker["Z"], _worker["p"], _worker["nobs"], nrep, seed)
+
+
+class BootstrapResults:
+    """
+    Bootstrap replicates of regression coefficients.
+
+    Attributes
+    ----------
+    params : Series
+        The coefficients fit to the original data.
+    replicates : DataFrame
+        One row of coefficients per bootstrap replicate.  Replicates
+        whose resampled design was singular are missing.
+    """
+
+    def __init__(self, params, replicates):
+        self.params = params
+        self.replicates = replicates
+
+    @property
+    def bse(self):
+        """
+        Bootstrap standard errors.
+        """
+        return self.replicates.std(ddof=1)
+
+    def conf_int(self, alpha=0.05):
+        """
+        Percentile confidence intervals.
+        """
+        q = self.replicates.quantile([alpha / 2, 1 - alpha / 2]).T
+        q.columns = [0, 1]
+        return q
+
+
+def bootstrap_ols(endog, exog, nrep=1000, seed=0, block_size=100, n_workers=1):
+    """
+    Bootstrap the coefficients of an OLS fit by resampling rows.
+
+    Parameters
+    ----------
+    endog : array_like
+        The outcome.
+    exog : array_like
+        The design matrix.
+    nrep : int
+        The number of bootstrap replicates.
+    seed : int
+        Seed for the random resampling.
+    block_size : int
+        The number of replicates solved together.  The replicates
+        depend on the seed and the block size, but not on the number
+        of workers.
+    n_workers : int
+        The number of processes.  If 1, everything runs in the
+        calling process; None uses all available cores.
+
+    Returns
+    -------
+    A BootstrapResults instance.
+    """
+    names = getattr(exog, "columns", None)
+    y = np.asarray(endog, dtype=np.float64).reshape(-1)
+    X = np.asarray(exog, dtype=np.float64)
+    nobs, p = X.shape
+    if names is None:
+        names = ["x%d" % j for j in range(p)]
+
+    params = pd.Series(np.linalg.lstsq(X, y, rcond=None)[0], index=names)
+    Z = _products(y, X)
+
+    sizes = [min(block_size, nrep - i) for i in range(0, nrep, block_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = list(zip(sizes, seeds))
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if n_workers == 1 or len(tasks) == 1:
+        blocks = [_solve_block(Z, p, nobs, k, s) for k, s in tasks]
+    else:
+        with ProcessPoolExecutor(n_workers, initializer=_init_worker,
+                                 initargs=(Z, p, nobs)) as ex:
+            blocks = list(ex.map(_run_block, tasks))
+
+    replicates = pd.DataFrame(np.vstack(blocks), columns=names)
+    return BootstrapResults(params, replicates)
+
+
+def bootstrap_formula(formula, data, cache=None, **kwargs):
+    """
+    Bootstrap an OLS model specified by a formula.
+
+    The design matrix is built once from the full data, so data
+    dependent transforms such as the knots of `bs()` are held fixed
+    across replicates.  Keyword arguments are passed to
+    `bootstrap_ols`.
+    """
+    if cache is None:
+        cache = DesignCache(data)
+    y, X = cache.dmatrices(formula, eval_env=1)
+    return bootstrap_ols(y, X, **kwargs)
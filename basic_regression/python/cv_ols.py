@@ -0,0 +1,241 @@
+"""
+Out-of-sample prediction error of OLS fits without refitting.
+
+The workshop judges models by the in-sample R^2,
+
+    np.corrcoef(da.BPXSY1, result.fittedvalues)**2
+
+which always grows as terms are added.  Cross validation estimates the
+error for new data instead, but done naively it refits the model from
+the formula once per fold, or once per observation for leave-one-out.
+
+Leave-one-out residuals of OLS have a closed form.  With hat matrix
+diagonal h_i = x_i'(X'X)^-1 x_i, which is the squared norm of row i of
+Q in the thin QR factorization X = QR, the residual of observation i
+from the fit without it is e_i / (1 - h_i).  The PRESS statistic is
+the sum of their squares, and is obtained from one fit.
+
+For K-fold cross validation, the fit without fold f solves
+
+    (X'X - X_f'X_f) b = X'y - X_f'y_f,
+
+so the cross products of the full data are computed once, and each
+fold only computes the cross products of its own rows and a p x p
+solve.  Folds are independent and can run in a process pool.
+
+    cv = kfold_formula("BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx", da, k=10)
+    cv.mse, cv.rsquared
+    loo = loocv_formula("BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx", da)
+    loo.press
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from design_cache import DesignCache
+from suffstats import exog_k_constant
+
+
+def _arrays(endog, exog):
+    y = np.asarray(endog, dtype=np.float64).reshape(-1)
+    X = np.asarray(exog, dtype=np.float64)
+    if X.ndim == 1:
+        X = X[:, None]
+    if X.shape[0] != y.shape[0]:
+        raise ValueError("endog has %d rows but exog has %d" % (y.shape[0], X.shape[0]))
+    return y, X
+
+
+def _tss(y, X):
+    # As for R^2 in statsmodels: centered if there is a constant.
+    if exog_k_constant(X):
+        return float(((y - y.mean())**2).sum())
+    return float(y @ y)
+
+
+class CVResults:
+    """
+    Cross-validated prediction errors of an OLS model.
+
+    Attributes
+    ----------
+    resid : ndarray
+        For each observation, the outcome minus its prediction from
+        the fit that did not use it.
+    folds : ndarray
+        The fold of each observation; for leave-one-out, the row
+        number.
+    tss : float
+        The total sum of squares, centered if the model has a
+        constant.
+    """
+
+    def __init__(self, resid, folds, tss):
+        self.resid = resid
+        self.folds = folds
+        self.tss = tss
+
+    @property
+    def nobs(self):
+        return len(self.resid)
+
+    @property
+    def press(self):
+        """
+        The sum of squared out-of-fold residuals.
+        """
+        return float(self.resid @ self.resid)
+
+    @property
+    def mse(self):
+        """
+        The mean squared out-of-fold prediction error.
+        """
+        return self.press / self.nobs
+
+    @property
+    def rsquared(self):
+        """
+        The cross-validated R^2, 1 - PRESS / TSS.
+
+        Unlike the in-sample R^2, this can decrease when terms are
+        added to the model.
+        """
+        return 1 - self.press / self.tss
+
+    def fold_mse(self):
+        """
+        Return the mean squared prediction error within each fold.
+        """
+        return pd.Series(self.resid**2).groupby(self.folds).mean()
+
+
+def loocv(endog, exog):
+    """
+    Leave-one-out cross validation of an OLS fit, from one fit.
+
+    Parameters
+    ----------
+    endog : array_like
+        The outcome.
+    exog : array_like
+        The design matrix, of full column rank.
+
+    Returns
+    -------
+    A CVResults instance.
+    """
+    y, X = _arrays(endog, exog)
+    Q, R = np.linalg.qr(X)
+    if np.any(np.abs(np.diag(R)) <= np.abs(R).max() * max(X.shape) * np.finfo(float).eps):
+        raise ValueError("the design matrix does not have full column rank")
+    resid = y - Q @ (Q.T @ y)
+    h = (Q**2).sum(1)
+    return CVResults(resid / (1 - h), np.arange(len(y)), _tss(y, X))
+
+
+def _fold_resid(y, X, xtx, xty, ii):
+    Xf, yf = X[ii], y[ii]
+    b = np.linalg.solve(xtx - Xf.T @ Xf, xty - Xf.T @ yf)
+    return yf - Xf @ b
+
+
+# Per-process state, so that the data are sent to each worker only once.
+_worker = {}
+
+
+def _init_worker(y, X, folds):
+    _worker.update(y=y, X=X, folds=folds, xtx=X.T @ X, xty=X.T @ y)
+
+
+def _run_fold(f):
+    w = _worker
+    ii = np.flatnonzero(w["folds"] == f)
+    return ii, _fold_resid(w["y"], w["X"], w["xtx"], w["xty"], ii)
+
+
+def kfold(endog, exog, k=10, seed=0, folds=None, n_workers=1):
+    """
+    K-fold cross validation of an OLS fit, by downdating X'X.
+
+    Parameters
+    ----------
+    endog : array_like
+        The outcome.
+    exog : array_like
+        The design matrix.
+    k : int
+        The number of folds.
+    seed : int
+        Seed for the random assignment of rows to folds, which have
+        sizes differing by at most one.
+    folds : array_like, optional
+        The fold of each row, as integers or labels (e.g. survey
+        strata); overrides `k` and `seed`.
+    n_workers : int
+        The number of processes; None uses all available cores.
+
+    Returns
+    -------
+    A CVResults instance.
+
+    Notes
+    -----
+    Each fit without a fold must have full rank; a categorical level
+    that only occurs in one fold makes that fit singular.
+    """
+    y, X = _arrays(endog, exog)
+    if folds is None:
+        if not 2 <= k <= len(y):
+            raise ValueError("k must be between 2 and the number of rows, got %d" % k)
+        folds = np.random.default_rng(seed).permutation(len(y)) % k
+    else:
+        folds = pd.factorize(np.asarray(folds))[0]
+        if len(folds) != len(y):
+            raise ValueError("folds has %d values but the data have %d rows"
+                             % (len(folds), len(y)))
+    labels = np.unique(folds)
+
+    resid = np.empty_like(y)
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if n_workers == 1 or len(labels) == 1:
+        xtx, xty = X.T @ X, X.T @ y
+        for f in labels:
+            ii = np.flatnonzero(folds == f)
+            resid[ii] = _fold_resid(y, X, xtx, xty, ii)
+    else:
+        with ProcessPoolExecutor(n_workers, initializer=_init_worker,
+                                 initargs=(y, X, folds)) as ex:
+            for ii, r in ex.map(_run_fold, labels):
+                resid[ii] = r
+
+    return CVResults(resid, folds, _tss(y, X))
+
+
+def loocv_formula(formula, data, cache=None):
+    """
+    Leave-one-out cross validation of an OLS model given by a formula.
+    """
+    if cache is None:
+        cache = DesignCache(data)
+    y, X = cache.dmatrices(formula, eval_env=1)
+    return loocv(y, X)
+
+
+def kfold_formula(formula, data, cache=None, **kwargs):
+    """
+    K-fold cross validation of an OLS model given by a formula.
+
+    The design matrix is built once from the full data, so data
+    dependent transforms such as the knots of `bs()` are not
+    re-estimated within folds.  Keyword arguments are passed to
+    `kfold`.
+    """
+    if cache is None:
+        cache = DesignCache(data)
+    y, X = cache.dmatrices(formula, eval_env=1)
+    return kfold(y, X, **kwargs)
@@ -0,0 +1,406 @@
+"""
+Reuse encoded design matrix columns across a sequence of formula fits.
+
+The workshop fits many models to the same data frame, e.g.
+
+    BPXSY1 ~ RIDAGEYR
+    BPXSY1 ~ RIDAGEYR + RIAGENDRx
+    BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx
+    BPXSY1 ~ bs(RIDAGEYR, 5) + BMXBMI + RIAGENDRx
+
+and `from_formula` evaluates and encodes every factor from scratch
+for each one.  A `DesignCache` evaluates each factor (a variable, a
+spline basis, a centered or standardized variable, ...) once, and
+keeps the encoded columns of each term, keyed by the term, its coding
+and the contents of the data columns and of the variables from the
+formula's environment that it refers to.  Assembling a new design
+matrix then mostly amounts to stacking cached blocks.
+
+The column names, column order and contrast coding are the same as
+patsy's, so that
+
+    y, X = cache.dmatrices("BPXSY1 ~ RIDAGEYR + RIAGENDRx")
+    sm.OLS(y, X).fit()
+
+gives the same results as `sm.OLS.from_formula(...).fit()`.  Since
+such models do not carry a formula, tools that need to re-evaluate the
+formula on new data (e.g. `predict_functional`) should still use
+`from_formula`.
+
+Columns that are pandas categoricals (e.g. from `load_nhanes(...,
+categorical=True)`) are encoded from their integer codes directly,
+without inspecting their values.
+"""
+
+import ast
+import hashlib
+import pickle
+import types
+
+import numpy as np
+import pandas as pd
+import patsy
+from patsy.categorical import CategoricalSniffer, categorical_to_int, guess_categorical
+from patsy.contrasts import Treatment, code_contrast_matrix
+from patsy.redundancy import pick_contrasts_for_term
+
+
+class _Factor:
+    """
+    The evaluated value of one factor.
+
+    For a numerical factor `values` is a n x k float array and
+    `levels` is None.  For a categorical factor `values` holds the
+    integer level codes (-1 for missing) and `levels`, `contrast` are
+    as returned by patsy's categorical sniffer.
+    """
+
+    def __init__(self, values, levels=None, contrast=None):
+        self.values = values
+        self.levels = levels
+        self.contrast = contrast
+
+    @property
+    def categorical(self):
+        return self.levels is not None
+
+    def missing(self):
+        if self.categorical:
+            return self.values < 0
+        return np.isnan(self.values).any(1)
+
+
+def _referenced_names(code):
+    """
+    Return the names that may refer to data columns or variables in a
+    factor's code.
+    """
+    names = set()
+    for node in ast.walk(ast.parse(code.strip(), mode="eval")):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+            # Q("name") refers to a column by its name
+            names.add(node.value)
+    return names
+
+
+def _column_fingerprint(col):
+    return int(pd.util.hash_pandas_object(col, index=True).sum())
+
+
+def _env_fingerprint(value):
+    """
+    Return a key for a value that a factor takes from its environment.
+
+    Modules and functions are keyed by identity, and data by contents,
+    so that e.g. changing `scale` in `I(RIDAGEYR * scale)` changes the
+    key.  Returns None for values whose contents cannot be digested.
+    """
+    if isinstance(value, (types.ModuleType, type)) or callable(value):
+        try:
+            hash(value)
+            return ("object", value)
+        except TypeError:
+            pass
+    if isinstance(value, (pd.Series, pd.DataFrame, pd.Index)):
+        return ("pandas", _column_fingerprint(value))
+    h = hashlib.sha256()
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        h.update(("%s %s" % (value.dtype.str, value.shape)).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    else:
+        try:
+            h.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            return None
+    return ("data", h.hexdigest())
+
+
+class DesignCache:
+    """
+    Build design matrices from formulas, reusing encoded columns.
+
+    Parameters
+    ----------
+    data : DataFrame
+        The data that formulas are evaluated against.  Columns may be
+        added to or changed in this data frame between calls; cached
+        blocks are keyed by the contents of the columns they use, and
+        of the variables they take from `eval_env`, so they are
+        invalidated automatically.  Factors that use a variable whose
+        contents cannot be digested (one that cannot be pickled) are
+        not cached.
+    NA_action : str or patsy.NAAction
+        How missing values are handled, as in patsy.  The default
+        drops rows with a missing value in any factor of the formula.
+
+    Attributes
+    ----------
+    hits, misses : int
+        Counts of cache hits and misses for term blocks.
+    """
+
+    def __init__(self, data, NA_action="drop"):
+        self.data = data
+        if isinstance(NA_action, str):
+            NA_action = patsy.NAAction(NA_action)
+        self.NA_action = NA_action
+        self._descs = {}
+        self._factors = {}
+        self._blocks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        """
+        Discard all cached factors and term blocks.
+        """
+        self._factors.clear()
+        self._blocks.clear()
+
+    def _desc(self, formula):
+        desc = self._descs.get(formula)
+        if desc is None:
+            desc = patsy.ModelDesc.from_formula(formula)
+            self._descs[formula] = desc
+        return desc
+
+    def _version(self, factor, eval_env, fingerprints):
+        """
+        Return a key that changes whenever a column or a variable of
+        the environment used by `factor` changes, or None if the
+        factor cannot be cached.
+        """
+        key = []
+        for name in sorted(_referenced_names(factor.code)):
+            if name in self.data.columns:
+                if name not in fingerprints:
+                    fingerprints[name] = _column_fingerprint(self.data[name])
+                key.append((name, fingerprints[name]))
+                continue
+            try:
+                value = eval_env.namespace[name]
+            except KeyError:
+                # A patsy or Python builtin, or a string constant.
+                continue
+            fp = _env_fingerprint(value)
+            if fp is None:
+                return None
+            key.append((name, fp))
+        return (factor, tuple(key))
+
+    def _eval_factor(self, factor, eval_env):
+        state = {}
+        passes = factor.memorize_passes_needed(state, eval_env)
+        for j in range(passes):
+            factor.memorize_chunk(state, j, self.data)
+            factor.memorize_finish(state, j)
+        value = factor.eval(state, self.data)
+
+        if isinstance(getattr(value, "dtype", None), pd.CategoricalDtype):
+            cat = value.array if isinstance(value, pd.Series) else value
+            return _Factor(np.asarray(cat.codes), tuple(cat.categories))
+
+        if guess_categorical(value):
+            sniffer = CategoricalSniffer(self.NA_action, origin=factor)
+            sniffer.sniff(value)
+            levels, contrast = sniffer.levels_contrast()
+            codes = categorical_to_int(value, levels, self.NA_action, origin=factor)
+            return _Factor(codes, levels, contrast)
+
+        value = np.asarray(value, dtype=np.float64)
+        if value.ndim == 1:
+            value = value[:, None]
+        return _Factor(value)
+
+    def _factor(self, factor, eval_env, fingerprints):
+        key = self._version(factor, eval_env, fingerprints)
+        fac = None if key is None else self._factors.get(key)
+        if fac is None:
+            fac = self._eval_factor(factor, eval_env)
+            if key is not None:
+                self._factors[key] = fac
+        return key, fac
+
+    def _build_block(self, term, coding, factors):
+        """
+        Encode one subterm, following patsy's column order and names.
+        """
+        mats, names = [], []
+        for factor in term.factors:
+            fac = factors[factor]
+            if fac.categorical:
+                if factor not in coding:
+                    continue
+                cm = code_contrast_matrix(coding[factor], fac.levels, fac.contrast,
+                                          default=Treatment)
+                codes = np.where(fac.values < 0, 0, fac.values)
+                mats.append(cm.matrix[codes, :])
+                names.append(["%s%s" % (factor.name(), s) for s in cm.column_suffixes])
+            else:
+                k = fac.values.shape[1]
+                mats.append(fac.values)
+                if k == 1:
+                    names.append([factor.name()])
+                else:
+                    names.append(["%s[%d]" % (factor.name(), j) for j in range(k)])
+
+        n = self.data.shape[0]
+        block = np.ones((n, 1))
+        bnames = [""]
+        # The left-most factor varies fastest, as in patsy and R.
+        for mat, nm in zip(mats, names):
+            block = (mat[:, :, None] * block[:, None, :]).reshape(n, -1)
+            bnames = [(b + ":" + a) if b else a for a in nm for b in bnames]
+        if not mats:
+            bnames = ["Intercept"]
+        return block, bnames
+
+    def _assemble(self, termlist, eval_env, fingerprints):
+        factors, fkeys = {}, {}
+        for term in termlist:
+            for factor in term.factors:
+                if factor not in factors:
+                    fkeys[factor], factors[factor] = self._factor(factor, eval_env, fingerprints)
+
+        # Group terms by their numerical factors and pick contrasts
+        # within each group, as patsy does.
+        buckets = {}
+        for term in termlist:
+            num = frozenset(f for f in term.factors if not factors[f].categorical)
+            buckets.setdefault(num, []).append(term)
+        order = list(buckets)
+        if frozenset() in buckets:
+            order.remove(frozenset())
+            order.insert(0, frozenset())
+
+        blocks, names = [], []
+        for num in order:
+            used = set()
+            for term in sorted(buckets[num], key=lambda t: len(t.factors)):
+                codings = pick_contrasts_for_term(term, num, used)
+                for coding in codings:
+                    key = (tuple(fkeys[f] for f in term.factors),
+                           tuple(sorted((f.name(), v) for f, v in coding.items())))
+                    if None in key[0]:
+                        key = None
+                    blk = None if key is None else self._blocks.get(key)
+                    if blk is None:
+                        self.misses += 1
+                        blk = self._build_block(term, coding, factors)
+                        if key is not None:
+                            self._blocks[key] = blk
+                    else:
+                        self.hits += 1
+                    blocks.append(blk[0])
+                    names.extend(blk[1])
+
+        missing = np.zeros(self.data.shape[0], dtype=bool)
+        for fac in factors.values():
+            missing |= fac.missing()
+
+        return blocks, names, missing
+
+    def _frame(self, blocks, names, keep):
+        n = self.data.shape[0]
+        mat = np.hstack(blocks) if blocks else np.empty((n, 0))
+        index = self.data.index
+        if keep is not None:
+            mat = mat[keep, :]
+            index = index[keep]
+        return pd.DataFrame(mat, index=index, columns=names)
+
+    def _keep(self, missing):
+        if not missing.any():
+            return None
+        if "drop" not in self.NA_action.on_NA:
+            raise patsy.PatsyError("factor contains missing values")
+        return ~missing
+
+    def dmatrices(self, formula, eval_env=0):
+        """
+        Return the outcome and design matrices for a formula.
+
+        Parameters
+        ----------
+        formula : str
+            A patsy formula with a left hand side.
+        eval_env : int or patsy.EvalEnvironment
+            Where to look up names that are not columns of the data,
+            as in `patsy.dmatrices`.
+
+        Returns
+        -------
+        y, X : DataFrame
+            The outcome and design matrices.
+        """
+        eval_env = patsy.EvalEnvironment.capture(eval_env, reference=1)
+        return self._dmatrices(formula, eval_env)[0:2]
+
+    def _dmatrices(self, formula, eval_env):
+        desc = self._desc(formula)
+        if not desc.lhs_termlist:
+            raise patsy.PatsyError("model is missing required outcome variables")
+        fingerprints = {}
+        yb, yn, ym = self._assemble(desc.lhs_termlist, eval_env, fingerprints)
+        xb, xn, xm = self._assemble(desc.rhs_termlist, eval_env, fingerprints)
+        keep = self._keep(ym | xm)
+        return self._frame(yb, yn, keep), self._frame(xb, xn, keep), keep
+
+    def dmatrix(self, formula, eval_env=0):
+        """
+        Return the design matrix for a formula without outcome.
+        """
+        eval_env = patsy.EvalEnvironment.capture(eval_env, reference=1)
+        desc = self._desc(formula)
+        xb, xn, xm = self._assemble(desc.rhs_termlist, eval_env, {})
+        return self._frame(xb, xn, self._keep(xm))
+
+    def model(self, model_class, formula, eval_env=0, **kwargs):
+        """
+        Construct a model such as `sm.OLS` or `sm.GLM` from a formula.
+
+        Extra keyword arguments are passed to the model class.
+        """
+        eval_env = patsy.EvalEnvironment.capture(eval_env, reference=1)
+        y, X = self.dmatrices(formula, eval_env)
+        return model_class(y, X, **kwargs)
+
+
+def dmatrices_rows(formula, data, cache=None, eval_env=0):
+    """
+    Return the outcome and design matrices and the positions of their rows.
+
+    Rows are identified by position in `data`, since the index of
+    stacked data (e.g. several cycles joined with pd.concat) may have
+    duplicate labels, so that `data.loc[X.index]` selects too many rows.
+
+    Parameters
+    ----------
+    formula : str
+        A patsy formula with a left hand side.
+    data : DataFrame
+        The data.
+    cache : DesignCache, optional
+        A cache for `data`; patsy is used if not given.
+    eval_env : int or patsy.EvalEnvironment
+        As in `patsy.dmatrices`.
+
+    Returns
+    -------
+    y, X : DataFrame
+        The outcome and design matrices, with the index of `data`.
+    rows : ndarray
+        The positions in `data` of the rows of y and X.
+    """
+    eval_env = patsy.EvalEnvironment.capture(eval_env, reference=1)
+    if cache is not None:
+        y, X, keep = cache._dmatrices(formula, eval_env)
+        rows = np.arange(data.shape[0]) if keep is None else np.flatnonzero(keep)
+    else:
+        y, X = patsy.dmatrices(formula, data.reset_index(drop=True), eval_env=eval_env,
+                               return_type="dataframe")
+        rows = np.asarray(X.index)
+        y.index = X.index = data.index[rows]
+    return y, X, rows
@@ -0,0 +1,345 @@
+"""
+Regression diagnostic plots that stay fast for large samples.
+
+The workshop draws every observation in the residuals versus fitted
+plot, the CCPR plots and the added variable plots, and reduces
+overplotting by making the points transparent.  With many survey
+cycles stacked, drawing the points dominates the run time and the size
+of the saved figures.  The functions here draw the points in one of
+several ways:
+
+    'points'     every observation, as in statsmodels
+    'hexbin'     a 2D histogram of the points, with log-scaled counts
+    'subsample'  at most `max_points` points, sampled within bins of
+                 the x variable so that sparse regions are kept whole
+    'auto'       'points' for small samples, 'hexbin' otherwise
+
+Fitted lines and smooths are always computed from all observations.
+Exact lowess does work proportional to n * frac * n, which takes
+seconds for large samples, so smooths of more than `max_exact` points
+use `binned_lowess`, a local linear smoother computed from sums over a
+fixed grid of bins.  Its cost is linear in n, and it is within a small
+fraction of the residual standard deviation of the exact smooth (see
+bench_lowess.py).
+"""
+
+import numpy as np
+from statsmodels.nonparametric.smoothers_lowess import lowess
+
+from added_variable import added_variable_resids
+
+
+def _cap(counts, total):
+    """
+    Return the largest c with sum(min(counts, c)) <= total.
+    """
+    if counts.sum() <= total:
+        return counts.max()
+    c = np.sort(counts)
+    # A cap of c[k] takes all of the k + 1 smallest bins and c[k] from
+    # each of the others, cumsum(c)[k-1] + c[k] * (nbins - k) points.
+    k = np.arange(len(c))
+    used = np.concatenate(([0], np.cumsum(c)[:-1])) + c * (len(c) - k)
+    j = np.searchsorted(used, total, side="right") - 1
+    if j < 0:
+        return total // len(c)
+    # Raising the cap adds a point for each of the nbins - j - 1 bins
+    # that are larger than bin j.
+    return c[j] + (total - used[j]) // (len(c) - j - 1)
+
+
+def stratified_subsample(x, max_points, nbins=50, seed=0):
+    """
+    Return indices of min(max_points, len(x)) observations.
+
+    The range of x is split into `nbins` equal-width bins, and the
+    same maximum number of points (up to one) is taken from every bin,
+    so that bins with few observations are retained completely.
+    """
+    x = np.asarray(x)
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+    rng = np.random.default_rng(seed)
+    edges = np.linspace(x.min(), x.max(), nbins + 1)
+    b = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, nbins - 1)
+    counts = np.bincount(b, minlength=nbins)
+    cap = _cap(counts, max_points)
+    # The points left over by rounding the cap down are taken one each
+    # from randomly chosen bins that are above the cap.
+    caps = np.minimum(counts, cap)
+    extra = max_points - caps.sum()
+    caps[rng.choice(np.flatnonzero(counts > cap), extra, replace=False)] += 1
+
+    # A random rank within each bin; keep the first `caps` of each.
+    perm = rng.permutation(n)
+    order = perm[np.argsort(b[perm], kind="stable")]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n) - np.repeat(starts, counts)
+    return np.sort(np.flatnonzero(rank < caps[b]))
+
+
+def scatter(ax, x, y, kind="auto", max_points=5000, gridsize=60, seed=0, **kwargs):
+    """
+    Draw the points (x, y) on `ax` using one of the methods above.
+
+    Extra keyword arguments are passed to `ax.plot` (for 'points'
+    and 'subsample') or `ax.hexbin`.
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    if kind == "auto":
+        kind = "points" if len(x) <= max_points else "hexbin"
+
+    if kind == "hexbin":
+        args = dict(gridsize=gridsize, mincnt=1, bins="log", cmap="Greys")
+        args.update(kwargs)
+        return ax.hexbin(x, y, **args)
+    if kind == "subsample":
+        ii = stratified_subsample(x, max_points, seed=seed)
+        x, y = x[ii], y[ii]
+    elif kind != "points":
+        raise ValueError("unknown kind '%s'" % kind)
+    args = dict(alpha=0.2)
+    args.update(kwargs)
+    return ax.plot(x, y, "o", **args)
+
+
+def _tricube(u):
+    return np.clip(1 - np.abs(u)**3, 0, None)**3
+
+
+def _binned_fit(xc, y, w, b, grid, k):
+    """
+    Local linear fits at the grid points from binned sums.
+    """
+    G = len(grid)
+    W = np.bincount(b, w, G)
+    Sx = np.bincount(b, w * xc, G)
+    Sxx = np.bincount(b, w * xc**2, G)
+    Sy = np.bincount(b, w * y, G)
+    Sxy = np.bincount(b, w * xc * y, G)
+
+    # The half-width of each local window is the distance to the k-th
+    # nearest point, up to the bin width, using unweighted counts.
+    counts = np.bincount(b, minlength=G)
+    cum = np.concatenate(([0], np.cumsum(counts)))
+    r = np.zeros(G, dtype=np.int64)
+    idx = np.arange(G)
+    short = np.ones(G, dtype=bool)
+    while short.any():
+        lo = np.clip(idx - r, 0, G)
+        hi = np.clip(idx + r + 1, 0, G)
+        short = cum[hi] - cum[lo] < k
+        r += short
+    delta = grid[1] - grid[0]
+    h = (r + 0.5) * delta
+
+    K = _tricube((grid[None, :] - grid[:, None]) / h[:, None])
+    s0 = K @ W
+    s1 = K @ Sx - grid * s0
+    s2 = K @ Sxx - 2 * grid * (K @ Sx) + grid**2 * s0
+    t0 = K @ Sy
+    t1 = K @ Sxy - grid * t0
+    det = s0 * s2 - s1**2
+    ok = det > 1e-12 * np.maximum(s0 * s2, 1e-300)
+    return np.where(ok, (s2 * t0 - s1 * t1) / np.where(ok, det, 1), t0 / s0)
+
+
+def binned_lowess(endog, exog, frac=2.0 / 3, it=3, gridsize=256):
+    """
+    Approximate lowess smoothing using binned sums.
+
+    The range of `exog` is covered by `gridsize` equally spaced points,
+    each observation is assigned to the nearest grid point, and a
+    tricube-weighted local linear regression is fit at each grid point
+    using the per-bin sums of the weights, x, x^2, y and xy.  The
+    window of each fit holds about `frac * n` observations, and `it`
+    robustifying iterations are done as in lowess.
+
+    Parameters
+    ----------
+    endog, exog : array_like
+        The y and x values.
+    frac : float
+        The fraction of the data used for each local fit.
+    it : int
+        The number of robustifying iterations.
+    gridsize : int
+        The number of grid points.
+
+    Returns
+    -------
+    An array with two columns, the grid points and the smoothed values,
+    like the output of `lowess`.
+    """
+    if not 0 < frac <= 1:
+        # As lowess; a window cannot hold more than all of the points.
+        raise ValueError("frac must be in the range (0, 1]")
+    y, x = np.asarray(endog, dtype=np.float64), np.asarray(exog, dtype=np.float64)
+    ok = np.isfinite(x) & np.isfinite(y)
+    x, y = x[ok], y[ok]
+    grid = np.linspace(x.min(), x.max(), gridsize)
+    if grid[-1] == grid[0]:
+        return np.array([[grid[0], y.mean()]])
+
+    # Center x at its minimum so the binned moments are well scaled.
+    xc = x - grid[0]
+    grid = grid - grid[0]
+    b = np.clip(np.rint(xc / (grid[1] - grid[0])).astype(np.int64), 0, gridsize - 1)
+    k = min(max(int(frac * len(x) + 1e-10), 2), len(x))
+
+    w = np.ones_like(y)
+    for j in range(it + 1):
+        fit = _binned_fit(xc, y, w, b, grid, k)
+        if j == it:
+            break
+        resid = y - np.interp(xc, grid, fit)
+        s = np.median(np.abs(resid))
+        if s == 0:
+            break
+        w = (1 - np.clip(resid / (6 * s), -1, 1)**2)**2
+
+    return np.column_stack((grid + x.min(), fit))
+
+
+def smooth(endog, exog, frac=2.0 / 3, it=3, max_exact=2000, gridsize=256):
+    """
+    Lowess smooth of endog on exog, binned if there are many points.
+    """
+    if len(np.asarray(exog)) <= max_exact:
+        return lowess(endog, exog, frac=frac, it=it)
+    return binned_lowess(endog, exog, frac=frac, it=it, gridsize=gridsize)
+
+
+def add_lowess(ax, lines_idx=0, frac=0.2, max_exact=2000, gridsize=256, x=None, y=None,
+               **kwargs):
+    """
+    Add a lowess line to a plot, like statsmodels' `add_lowess`.
+
+    The points (x, y) are smoothed if given, and otherwise the points
+    of line `lines_idx` of `ax`.  A hexbin plot (or a subsample) does
+    not hold all of the points, so `x` and `y` must be given for the
+    plots drawn with `kind='hexbin'` or `kind='subsample'`.  The smooth
+    is exact if there are at most `max_exact` points and by
+    `binned_lowess` otherwise.  Extra keyword arguments are passed to
+    `ax.plot`.
+    """
+    if (x is None) != (y is None):
+        raise ValueError("x and y must be given together")
+    if x is None:
+        lines = ax.get_lines()
+        if len(lines) <= lines_idx:
+            raise ValueError("the axes have no line %d to smooth; pass x and y "
+                             "(e.g. for a hexbin plot)" % lines_idx)
+        x, y = lines[lines_idx].get_xdata(), lines[lines_idx].get_ydata()
+    fit = smooth(np.asarray(y), np.asarray(x), frac=frac, max_exact=max_exact,
+                 gridsize=gridsize)
+    args = dict(color="r", lw=1.5)
+    args.update(kwargs)
+    ax.plot(fit[:, 0], fit[:, 1], **args)
+    return ax.figure
+
+
+def _smooth(ax, x, y, frac, **kwargs):
+    fit = smooth(y, x, frac=frac)
+    args = dict(color="orange", lw=2)
+    args.update(kwargs)
+    ax.plot(fit[:, 0], fit[:, 1], "-", **args)
+
+
+def _axes(ax):
+    if ax is None:
+        # pyplot is imported here so that the smoothers can be used, and
+        # plots drawn on given axes, without loading a GUI backend.
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots()
+    return ax.figure, ax
+
+
+def _resid(results):
+    # GLM results have response residuals rather than `resid`.
+    if hasattr(results, "resid_response"):
+        return np.asarray(results.resid_response)
+    return np.asarray(results.resid)
+
+
+def _exog_index(model, exog_idx):
+    if isinstance(exog_idx, str):
+        return exog_idx, model.exog_names.index(exog_idx)
+    return model.exog_names[exog_idx], exog_idx
+
+
+def plot_resid_fitted(results, ax=None, kind="auto", max_points=5000, gridsize=60,
+                      lowess_frac=None, seed=0):
+    """
+    Plot residuals against fitted values.
+
+    Parameters
+    ----------
+    results : statsmodels results
+        A fitted regression model.
+    ax : Axes, optional
+        Where to draw; a new figure is created if not given.
+    kind, max_points, gridsize, seed
+        How the points are drawn, see the module docstring.
+    lowess_frac : float, optional
+        If given, a lowess smooth of the residuals on the fitted values,
+        using all observations, is added.
+
+    Returns
+    -------
+    The figure.
+    """
+    fig, ax = _axes(ax)
+    fv, resid = np.asarray(results.fittedvalues), _resid(results)
+    scatter(ax, fv, resid, kind, max_points, gridsize, seed)
+    if lowess_frac is not None:
+        _smooth(ax, fv, resid, lowess_frac)
+    ax.set_xlabel("Fitted values")
+    ax.set_ylabel("Residuals")
+    return fig
+
+
+def plot_ccpr(results, exog_idx, ax=None, kind="auto", max_points=5000, gridsize=60,
+              seed=0):
+    """
+    Component and component-plus-residual plot, as in statsmodels.
+
+    The line x * beta is drawn over its full range.  See
+    `plot_resid_fitted` for the other arguments.
+    """
+    fig, ax = _axes(ax)
+    name, j = _exog_index(results.model, exog_idx)
+    x1 = results.model.exog[:, j]
+    x1beta = x1 * np.asarray(results.params)[j]
+    scatter(ax, x1, x1beta + _resid(results), kind, max_points, gridsize, seed)
+    xx = np.array([x1.min(), x1.max()])
+    ax.plot(xx, xx * np.asarray(results.params)[j], "-", color="orange")
+    ax.set_title("Component and component plus residual plot")
+    ax.set_ylabel("Residual + %s*beta_%d" % (name, j))
+    ax.set_xlabel(name)
+    return fig
+
+
+def plot_added_variable(results, focus_exog, ax=None, kind="auto", max_points=5000,
+                        gridsize=60, lowess_frac=None, seed=0):
+    """
+    Added variable plot, as `results.plot_added_variable`.
+
+    The residuals are computed from the full fit, without refitting,
+    by `added_variable.added_variable_resids`.  See `plot_resid_fitted`
+    for the other arguments.
+    """
+    fig, ax = _axes(ax)
+    name, _ = _exog_index(results.model, focus_exog)
+    endog_resid, focus_resid = added_variable_resids(results, name)
+    endog_resid, focus_resid = endog_resid[name].values, focus_resid[name].values
+    scatter(ax, focus_resid, endog_resid, kind, max_points, gridsize, seed)
+    if lowess_frac is not None:
+        _smooth(ax, focus_resid, endog_resid, lowess_frac)
+    ax.set_title("Added variable plot", fontsize="large")
+    ax.set_xlabel(name, size=15)
+    ax.set_ylabel(results.model.endog_names + " residuals", size=15)
+    return fig
@@ -0,0 +1,449 @@
+"""
+Opt-in timing, memory and profiling of the regression workflow.
+
+Inside a `recording` block, the calls that dominate the workflow
+(formula processing, model fits, result summaries, predictions and
+plots) are wrapped so that each call emits a span with its duration,
+the shapes of its array arguments and result, and optionally its
+memory use traced with tracemalloc:
+
+    with instrument.recording(memory=True, sample_interval=0.005) as rec:
+        model = sm.OLS.from_formula("BPXSY1 ~ RIDAGEYR + RIAGENDRx", data=da)
+        result = model.fit()
+        result.summary()
+    print(rec.report())
+    rec.write_trace("trace.json")     # chrome://tracing or ui.perfetto.dev
+    rec.write_folded("stacks.txt")    # flamegraph.pl or speedscope
+
+Own code can add spans with `span("name", key=value)`.
+
+The wrappers are installed when the block is entered and removed when
+it exits, so outside of a recording the library functions are the
+originals and cost nothing extra; `span` then only checks a global.
+
+With `sample_interval` set, a background thread samples the stack of
+the recording thread at that interval.  The samples are aggregated as
+folded stacks (one line per distinct stack with its count), prefixed
+by the names of the enclosing spans, which is the input format of
+flame graph tools.  `on_sample` is called with each sampled stack,
+for feeding another profiler.
+"""
+
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+# The functions wrapped while recording: (module, attribute path).
+TARGETS = [
+    ("patsy", "dmatrices"),
+    ("patsy", "dmatrix"),
+    ("statsmodels.base.model", "Model.from_formula"),
+    ("statsmodels.regression.linear_model", "RegressionModel.fit"),
+    ("statsmodels.genmod.generalized_linear_model", "GLM.fit"),
+    ("statsmodels.regression.linear_model", "RegressionResults.summary"),
+    ("statsmodels.genmod.generalized_linear_model", "GLMResults.summary"),
+    ("statsmodels.genmod.generalized_linear_model", "GLMResults.plot_added_variable"),
+    ("statsmodels.graphics.regressionplots", "plot_ccpr"),
+    ("statsmodels.graphics.regressionplots", "plot_added_variable"),
+    ("statsmodels.sandbox.predict_functional", "predict_functional"),
+    ("matplotlib.figure", "Figure.savefig"),
+    ("bands", "predict_functional_batch"),
+    ("diagnostics", "plot_resid_fitted"),
+    ("diagnostics", "plot_ccpr"),
+    ("diagnostics", "plot_added_variable"),
+]
+
+# The active Recorder, or None.
+_recorder = None
+
+
+def _shape(x):
+    shape = getattr(x, "shape", None)
+    if isinstance(shape, tuple):
+        return shape
+    # A model (for fit) or results (for summary and plots).
+    for obj in (getattr(x, "model", None), x):
+        exog = getattr(obj, "exog", None)
+        if isinstance(getattr(exog, "shape", None), tuple):
+            return exog.shape
+    return None
+
+
+def _shapes(args, kwargs):
+    out = [s for s in (_shape(a) for a in list(args) + list(kwargs.values()))
+           if s is not None]
+    return out or None
+
+
+class _Span:
+
+    def __init__(self, rec, name, attrs):
+        self.rec = rec
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.rec._enter(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.rec._exit(self)
+        return False
+
+
+class Recorder:
+    """
+    Spans and stack samples collected by `recording`.
+
+    Attributes
+    ----------
+    spans : list of dict
+        The finished spans, in the order they ended, with keys 'name',
+        'depth', 'start' and 'seconds' (relative to the start of the
+        recording), 'attrs', and with memory tracing also 'mem_delta'
+        and 'mem_peak' (bytes).
+    samples : dict
+        Sampled stacks, as tuples of frame names, with their counts.
+    """
+
+    def __init__(self, memory=False, sample_interval=None, on_sample=None):
+        self.memory = memory
+        self.sample_interval = sample_interval
+        self.on_sample = on_sample
+        self.spans = []
+        self.samples = {}
+        self._stack = []
+        self._t0 = time.perf_counter()
+        self._thread = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    # Spans
+
+    def span(self, name, **attrs):
+        return _Span(self, name, attrs)
+
+    def _enter(self, sp):
+        sp.depth = len(self._stack)
+        if self.memory:
+            cur, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent.abs_peak = max(parent.abs_peak, peak)
+            tracemalloc.reset_peak()
+            sp.mem0 = sp.abs_peak = cur
+        self._stack.append(sp)
+        sp.t0 = time.perf_counter()
+
+    def _exit(self, sp):
+        t1 = time.perf_counter()
+        self._stack.pop()
+        rec = {"name": sp.name, "depth": sp.depth, "start": sp.t0 - self._t0,
+               "seconds": t1 - sp.t0, "attrs": sp.attrs}
+        if self.memory:
+            cur, peak = tracemalloc.get_traced_memory()
+            sp.abs_peak = max(sp.abs_peak, peak)
+            rec["mem_delta"] = cur - sp.mem0
+            rec["mem_peak"] = sp.abs_peak - sp.mem0
+            if self._stack:
+                parent = self._stack[-1]
+                parent.abs_peak = max(parent.abs_peak, sp.abs_peak)
+            tracemalloc.reset_peak()
+        self.spans.append(rec)
+
+    def _wrap(self, name, func, method=False):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is not self or threading.get_ident() != self._thread:
+                return func(*args, **kwargs)
+            label = name
+            if method:
+                # Name the span by the class of the instance (or the
+                # class itself, for a classmethod), e.g. OLS.fit.
+                cls = args[0] if isinstance(args[0], type) else type(args[0])
+                label = "%s.%s" % (cls.__name__, name)
+            with self.span(label) as sp:
+                result = func(*args, **kwargs)
+                sp.attrs["args"] = _shapes(args, kwargs)
+                shape = _shape(result)
+                if shape is None and isinstance(result, tuple):
+                    shape = [_shape(r) for r in result]
+                sp.attrs["result"] = shape
+            return result
+        wrapper.__instrumented__ = func
+        return wrapper
+
+    # Sampling
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(self._thread)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%d)" % (code.co_name, code.co_filename.rsplit("/", 1)[-1],
+                                             code.co_firstlineno))
+                frame = frame.f_back
+            stack = tuple("[%s]" % s.name for s in list(self._stack)) + tuple(reversed(stack))
+            self.samples[stack] = self.samples.get(stack, 0) + 1
+            if self.on_sample is not None:
+                self.on_sample(stack)
+
+    def _start_sampler(self):
+        if self.sample_interval:
+            self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+            self._sampler.start()
+
+    def _stop_sampler(self):
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+
+    # Output
+
+    def report(self):
+        """
+        Return the spans as a DataFrame, in the order they started.
+        """
+        df = pd.DataFrame(self.spans)
+        if len(df) == 0:
+            return df
+        df = df.sort_values("start").reset_index(drop=True)
+        df["name"] = ["  " * d + n for d, n in zip(df.depth, df.name)]
+        for k in "mem_delta", "mem_peak":
+            if k in df:
+                df[k + "_mb"] = df.pop(k) / 2**20
+        df["shapes"] = [a.get("args") for a in df["attrs"]]
+        return df.drop(columns=["attrs"])
+
+    def totals(self):
+        """
+        Return the number of calls and the total and mean seconds by span name.
+        """
+        df = pd.DataFrame(self.spans)
+        if len(df) == 0:
+            return df
+        g = df.groupby("name").seconds
+        out = pd.DataFrame({"calls": g.size(), "seconds": g.sum(), "mean": g.mean()})
+        return out.sort_values("seconds", ascending=False)
+
+    def write_trace(self, fname):
+        """
+        Write the spans in the Chrome trace event format.
+        """
+        events = []
+        for s in self.spans:
+            args = {k: repr(v) for k, v in s["attrs"].items()}
+            for k in "mem_delta", "mem_peak":
+                if k in s:
+                    args[k] = s[k]
+            events.append({"name": s["name"], "ph": "X", "pid": 0, "tid": 0,
+                           "ts": s["start"] * 1e6, "dur": s["seconds"] * 1e6,
+                           "args": args})
+        with open(fname, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def write_folded(self, fname):
+        """
+        Write the sampled stacks in the folded format of flame graph tools.
+        """
+        with open(fname, "w") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write("%s %d\n" % (";".join(s.replace(";", ",") for s in stack), count))
+
+
+def span(name, **attrs):
+    """
+    A context manager that records a span while a recording is active.
+    """
+    if _recorder is None:
+        return contextlib.nullcontext()
+    return _recorder.span(name, **attrs)
+
+
+class _Patcher:
+    """
+    Wraps the TARGETS for a Recorder and restores them afterwards.
+
+    Target modules that are already imported are patched at once, and
+    the others when they are first imported, so that recording does
+    not import anything (such as matplotlib) that the run would not.
+    """
+
+    def __init__(self, rec):
+        self.rec = rec
+        self.undo = []
+        self.wrappers = {}
+        self.hook = None
+
+    def _wrap(self, owner, attr, modname):
+        raw = owner.__dict__.get(attr) if isinstance(owner, type) else getattr(owner, attr)
+        if raw is None:
+            return None
+        if isinstance(raw, classmethod):
+            new = classmethod(self.rec._wrap(attr, raw.__func__, method=True))
+        elif isinstance(owner, type):
+            new = self.rec._wrap(attr, raw, method=True)
+        else:
+            new = self.rec._wrap("%s.%s" % (modname.rsplit(".", 1)[-1], attr), raw)
+        setattr(owner, attr, new)
+        self.undo.append((owner, attr, raw))
+        self.wrappers[id(new)] = (new, raw)
+        return raw, new
+
+    def patch(self, modname):
+        """
+        Wrap the targets in an imported module.
+
+        Returns the replaced module-level functions and their wrappers,
+        by id of the function.
+        """
+        replaced = {}
+        for m, path in TARGETS:
+            if m != modname:
+                continue
+            owner = sys.modules[modname]
+            parts = path.split(".")
+            try:
+                for p in parts[0:-1]:
+                    owner = getattr(owner, p)
+                r = self._wrap(owner, parts[-1], modname)
+            except AttributeError:
+                continue
+            if r is not None and not isinstance(owner, type):
+                replaced[id(r[0])] = r
+        return replaced
+
+    def rebind(self, replaced):
+        """
+        Replace references to replaced functions that other modules
+        imported by name, e.g. `from bands import predict_functional_batch`.
+        """
+        if not replaced:
+            return
+        for m in list(sys.modules.values()):
+            d = getattr(m, "__dict__", None)
+            if d is None:
+                continue
+            for k, v in list(d.items()):
+                r = replaced.get(id(v))
+                if r is not None and v is r[0]:
+                    d[k] = r[1]
+                    self.undo.append((m, k, r[0]))
+
+    def install(self):
+        replaced = {}
+        for modname in set(m for m, _ in TARGETS):
+            if modname in sys.modules:
+                replaced.update(self.patch(modname))
+        self.rebind(replaced)
+        self.hook = _ImportHook(self)
+        sys.meta_path.insert(0, self.hook)
+
+    def restore(self):
+        if self.hook in sys.meta_path:
+            sys.meta_path.remove(self.hook)
+        for owner, attr, raw in reversed(self.undo):
+            setattr(owner, attr, raw)
+        # Modules imported during the recording may have bound a
+        # wrapper by name, e.g. `from patsy import dmatrices`.
+        for m in list(sys.modules.values()):
+            d = getattr(m, "__dict__", None)
+            if d is None:
+                continue
+            for k, v in list(d.items()):
+                r = self.wrappers.get(id(v))
+                if r is not None and v is r[0]:
+                    d[k] = r[1]
+        self.undo = []
+        self.wrappers = {}
+
+
+class _ImportHook:
+    """
+    A meta path finder that patches target modules once they are loaded.
+    """
+
+    def __init__(self, patcher):
+        self.patcher = patcher
+        self.names = set(m for m, _ in TARGETS)
+
+    def find_spec(self, name, path=None, target=None):
+        if name not in self.names:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        spec.loader = _PatchingLoader(spec.loader, self.patcher, name)
+        return spec
+
+
+class _PatchingLoader:
+
+    def __init__(self, loader, patcher, name):
+        self.loader = loader
+        self.patcher = patcher
+        self.name = name
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.loader.exec_module(module)
+        self.patcher.rebind(self.patcher.patch(self.name))
+
+
+@contextlib.contextmanager
+def recording(memory=False, sample_interval=None, on_sample=None):
+    """
+    Record spans (and optionally stack samples) within a block.
+
+    Parameters
+    ----------
+    memory : bool
+        If True, memory is traced with tracemalloc, and each span
+        records the change in traced memory and its peak above the
+        starting level.  This slows down allocation-heavy code.
+    sample_interval : float, optional
+        If given, the stack is sampled every `sample_interval` seconds.
+    on_sample : callable, optional
+        Called with each sampled stack, a tuple of frame names.
+
+    Yields
+    ------
+    A Recorder.
+    """
+    global _recorder
+    if _recorder is not None:
+        raise RuntimeError("a recording is already active")
+    rec = Recorder(memory, sample_interval, on_sample)
+    patcher = _Patcher(rec)
+    patcher.install()
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _recorder = rec
+    rec._t0 = time.perf_counter()
+    rec._start_sampler()
+    try:
+        yield rec
+    finally:
+        rec._stop_sampler()
+        _recorder = None
+        patcher.restore()
+        if started:
+            tracemalloc.stop()
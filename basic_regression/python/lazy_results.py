@@ -0,0 +1,319 @@
+"""
+OLS results that compute inference quantities only when they are used.
+
+`sm.OLS(y, X).fit().summary()` computes every t statistic, p-value,
+confidence interval, the condition number, and the omnibus,
+Jarque-Bera and Durbin-Watson diagnostics of the residuals.  When
+hundreds of specifications are compared by their coefficients or an
+information criterion, almost all of this is thrown away.
+
+`LazyOLSResults` fits the coefficients with a least squares solve
+and computes everything else on first access, keeping the value for
+later accesses.  Reading `aic` only needs the residual sum of
+squares; reading `bse` also inverts X'X once; the residual
+diagnostics are only computed by `summary()`.  The attribute names
+are those of statsmodels' `RegressionResults`, and `results` returns
+the full statsmodels object, built from the quantities already
+computed rather than by refitting.
+
+When only the coefficients are needed, `ols_params` skips the results
+object altogether:
+
+    ols_params("BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx", da)
+
+    res = ols_lazy("BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx", da)
+    res.params, res.aic          # no standard errors computed
+    res.summary()                # statsmodels' summary, as usual
+"""
+
+import argparse
+import time
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+import patsy
+from scipy import stats
+
+from suffstats import exog_k_constant
+
+
+def _design(formula, data, cache, eval_env):
+    # eval_env is an EvalEnvironment captured by the public function.
+    if cache is not None:
+        return cache.dmatrices(formula, eval_env)
+    return patsy.dmatrices(formula, data, eval_env=eval_env, return_type="dataframe")
+
+
+def _solve(y, X):
+    params, _, rank, sv = np.linalg.lstsq(X, y, rcond=None)
+    return params, rank, sv
+
+
+class LazyOLSResults:
+    """
+    Results of an OLS fit, with inference computed on demand.
+
+    Parameters
+    ----------
+    endog : array_like
+        The outcome.
+    exog : array_like
+        The design matrix, including the intercept if there is one.
+        Pandas objects are recommended so that the results carry
+        variable names.
+
+    Notes
+    -----
+    Only `params`, `rank` and the singular values of exog are computed
+    on construction.  Every other attribute is computed on first
+    access and then cached.
+    """
+
+    def __init__(self, endog, exog):
+        if isinstance(endog, pd.DataFrame):
+            endog = endog.iloc[:, 0]
+        if not isinstance(exog, pd.DataFrame):
+            exog = np.asarray(exog, dtype=np.float64)
+            if exog.ndim == 1:
+                exog = exog[:, None]
+            exog = pd.DataFrame(exog, columns=["x%d" % j for j in range(exog.shape[1])])
+        self._endog = endog
+        self._exog = exog
+        self.endog_name = getattr(endog, "name", None) or "y"
+        self.exog_names = list(exog.columns)
+        self._y = np.asarray(endog, dtype=np.float64).reshape(-1)
+        self._X = np.asarray(exog, dtype=np.float64)
+
+        params, self.rank, self._sv = _solve(self._y, self._X)
+        self.params = pd.Series(params, index=self.exog_names)
+        self.nobs = float(len(self._y))
+        self.df_resid = self.nobs - self.rank
+
+    @cached_property
+    def k_constant(self):
+        return exog_k_constant(self._X)
+
+    @property
+    def df_model(self):
+        return float(self.rank - self.k_constant)
+
+    @cached_property
+    def fittedvalues(self):
+        return self._X @ self.params.values
+
+    @cached_property
+    def resid(self):
+        return self._y - self.fittedvalues
+
+    @cached_property
+    def ssr(self):
+        return float(self.resid @ self.resid)
+
+    @property
+    def scale(self):
+        return self.ssr / self.df_resid
+
+    @cached_property
+    def centered_tss(self):
+        d = self._y - self._y.mean()
+        return float(d @ d)
+
+    @cached_property
+    def uncentered_tss(self):
+        return float(self._y @ self._y)
+
+    @property
+    def ess(self):
+        if self.k_constant:
+            return self.centered_tss - self.ssr
+        return self.uncentered_tss - self.ssr
+
+    @property
+    def rsquared(self):
+        if self.k_constant:
+            return 1 - self.ssr / self.centered_tss
+        return 1 - self.ssr / self.uncentered_tss
+
+    @property
+    def rsquared_adj(self):
+        return 1 - (np.divide(self.nobs - self.k_constant, self.df_resid)
+                    * (1 - self.rsquared))
+
+    @property
+    def fvalue(self):
+        return (self.ess / self.df_model) / (self.ssr / self.df_resid)
+
+    @property
+    def f_pvalue(self):
+        return stats.f.sf(self.fvalue, self.df_model, self.df_resid)
+
+    @cached_property
+    def llf(self):
+        nobs2 = self.nobs / 2.0
+        return -nobs2 * (np.log(2 * np.pi) + np.log(self.ssr / self.nobs) + 1)
+
+    @property
+    def aic(self):
+        return -2 * self.llf + 2 * (self.df_model + self.k_constant)
+
+    @property
+    def bic(self):
+        return -2 * self.llf + np.log(self.nobs) * (self.df_model + self.k_constant)
+
+    @property
+    def condition_number(self):
+        return self._sv[0] / self._sv[-1]
+
+    @cached_property
+    def normalized_cov_params(self):
+        return np.linalg.pinv(self._X.T @ self._X)
+
+    def cov_params(self):
+        c = self.scale * self.normalized_cov_params
+        return pd.DataFrame(c, index=self.exog_names, columns=self.exog_names)
+
+    @cached_property
+    def bse(self):
+        return pd.Series(np.sqrt(self.scale * np.diag(self.normalized_cov_params)),
+                         index=self.exog_names)
+
+    @property
+    def tvalues(self):
+        return self.params / self.bse
+
+    @cached_property
+    def pvalues(self):
+        return pd.Series(2 * stats.t.sf(np.abs(self.tvalues), self.df_resid),
+                         index=self.exog_names)
+
+    def conf_int(self, alpha=0.05):
+        q = stats.t.ppf(1 - alpha / 2, self.df_resid)
+        return pd.DataFrame({0: self.params - q * self.bse, 1: self.params + q * self.bse})
+
+    def summary_frame(self, alpha=0.05):
+        """
+        Return the coefficient table of the summary as a DataFrame.
+
+        Unlike `summary`, this does not compute the residual
+        diagnostics or format any text.
+        """
+        ci = self.conf_int(alpha)
+        return pd.DataFrame({"coef": self.params, "std err": self.bse, "t": self.tvalues,
+                             "P>|t|": self.pvalues, "[%g" % (alpha / 2): ci[0],
+                             "%g]" % (1 - alpha / 2): ci[1]})
+
+    @cached_property
+    def results(self):
+        """
+        The statsmodels `OLSResults` for this fit.
+
+        The model is not refitted; the coefficients, rank, singular
+        values and (if already computed) the normalized covariance
+        matrix are passed to statsmodels.
+        """
+        from statsmodels.regression.linear_model import (OLS, OLSResults,
+                                                         RegressionResultsWrapper)
+
+        model = OLS(self._endog, self._exog)
+        model.rank = self.rank
+        model.wexog_singular_values = self._sv
+        model.normalized_cov_params = self.normalized_cov_params
+        model.df_model = self.df_model
+        model.df_resid = self.df_resid
+        results = OLSResults(model, self.params.values,
+                             normalized_cov_params=self.normalized_cov_params)
+        return RegressionResultsWrapper(results)
+
+    def summary(self, *args, **kwargs):
+        """
+        Summarize the fit; see `RegressionResults.summary`.
+        """
+        return self.results.summary(*args, **kwargs)
+
+
+def ols_lazy(formula, data, cache=None, eval_env=0):
+    """
+    Fit an OLS model from a formula, returning `LazyOLSResults`.
+
+    Parameters
+    ----------
+    formula : str
+        A patsy formula.
+    data : DataFrame
+        The data.
+    cache : DesignCache, optional
+        If provided, the design matrices are taken from the cache.
+    eval_env : int or patsy.EvalEnvironment
+        As in `patsy.dmatrices`, relative to the caller.
+    """
+    eval_env = patsy.EvalEnvironment.capture(eval_env, reference=1)
+    y, X = _design(formula, data, cache, eval_env)
+    return LazyOLSResults(y, X)
+
+
+def ols_params(formula, data, cache=None, eval_env=0):
+    """
+    Return only the OLS coefficients for a formula, as a Series.
+
+    No results object is created, so nothing besides the least
+    squares solution is computed.  See `ols_lazy` for the arguments.
+    """
+    eval_env = patsy.EvalEnvironment.capture(eval_env, reference=1)
+    y, X = _design(formula, data, cache, eval_env)
+    params, _, _ = _solve(np.asarray(y, dtype=np.float64).reshape(-1),
+                          np.asarray(X, dtype=np.float64))
+    return pd.Series(params, index=X.columns)
+
+
+def _specifications():
+    terms = ["RIDAGEYR", "I(RIDAGEYR**2)", "BMXBMI", "RIAGENDRx", "RIDAGEYR:RIAGENDRx",
+             "BMXBMI:RIAGENDRx", "C(RIDRETH1)", "C(DMDEDUC2)"]
+    specs = []
+    for mask in range(1, 2**len(terms)):
+        rhs = [t for j, t in enumerate(terms) if mask >> j & 1]
+        specs.append("BPXSY1 ~ " + " + ".join(rhs))
+    return specs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n", type=int, default=5000, help="rows of synthetic data")
+    parser.add_argument("--specs", type=int, default=100, help="number of specifications")
+    args = parser.parse_args()
+
+    import statsmodels.api as sm
+    from design_cache import DesignCache
+    from nhanes_data import NHANES_VARS, synthetic_nhanes
+
+    da = synthetic_nhanes(args.n)[NHANES_VARS].dropna()
+    da["RIAGENDRx"] = da.RIAGENDR.replace({1: "Male", 2: "Female"})
+    specs = _specifications()[0:args.specs]
+    cache = DesignCache(da)
+    designs = [cache.dmatrices(f) for f in specs]
+
+    def full(y, X):
+        res = sm.OLS(y, X).fit()
+        res.summary()
+        return res.aic
+
+    def lazy(y, X):
+        return LazyOLSResults(y, X).aic
+
+    timings = []
+    for name, f in [("fit + summary", full), ("lazy, aic only", lazy),
+                    ("coefficients only", lambda y, X: _solve(y.values[:, 0], X.values))]:
+        t0 = time.perf_counter()
+        out = [f(y, X) for y, X in designs]
+        timings.append((name, time.perf_counter() - t0))
+        if name == "lazy, aic only":
+            ref = [full(y, X) for y, X in designs]
+            assert np.allclose(out, ref)
+
+    print("%d specifications, %d rows" % (len(specs), da.shape[0]))
+    for name, t in timings:
+        print("%-20s %8.3f s" % (name, t))
+
+
+if __name__ == "__main__":
+    main()
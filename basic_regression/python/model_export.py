@@ -0,0 +1,334 @@
+"""
+Export fitted formula models for scoring without statsmodels or patsy.
+
+Scoring new records with a fitted model usually means keeping the
+statsmodels results object and calling `result.predict(df)`.  Each call
+re-evaluates the formula with patsy on a DataFrame, which costs about
+a millisecond however few rows there are, and the results object can
+only be saved by pickling, which ties the file to the library versions.
+
+`export_model` reads what patsy memorized when the model was fit (the
+knots of `bs()`, the means of `center()` and `standardize()`, the
+levels and contrast matrices of categorical factors) and returns a
+plain dict that can be saved as JSON, along with the coefficients.
+`CompiledModel` evaluates such a dict with NumPy only: it builds the
+design matrix columns of each term in patsy's order and applies the
+coefficients and the inverse link.
+
+The supported factors are variables, `C(x, ...)` and other categorical
+variables, `I(x**k)`, `center(x)`, `standardize(x, ...)`, and `bs(x,
+...)` or `bs_table(x, ...)`.  Variables derived from others before the
+fit, such as the centered age in the workshop, can be declared with
+`derived`, so that records only need the original variables:
+
+    da["RIDAGEYR_cen"] = da.RIDAGEYR - da.RIDAGEYR.mean()
+    result = sm.OLS.from_formula("BPXSY1 ~ RIDAGEYR_cen*RIAGENDRx + BMXBMI", da).fit()
+    spec = export_model(result, derived={"RIDAGEYR_cen": ("RIDAGEYR", da.RIDAGEYR.mean())})
+    save_model(spec, "bp_interaction.json")
+
+    model = load_model("bp_interaction.json")
+    model.predict({"RIDAGEYR": [50, 60], "RIAGENDRx": ["Male", "Female"], "BMXBMI": [25, 30]})
+"""
+
+import ast
+import json
+
+import numpy as np
+
+FORMAT = "basic-regression-linear-model"
+VERSION = 1
+
+# Inverse links of the supported GLM links, by statsmodels class name.
+_INVERSE_LINKS = {
+    "identity": lambda eta: eta,
+    "log": np.exp,
+    "logit": lambda eta: 1 / (1 + np.exp(-eta)),
+}
+_LINK_NAMES = {"Identity": "identity", "Log": "log", "Logit": "logit"}
+
+
+def _plain(v):
+    # Numpy scalars (e.g. float levels of a coded variable) as Python values.
+    return v.item() if isinstance(v, np.generic) else v
+
+
+def _floats(x):
+    # patsy accumulates means in extended precision.
+    return np.atleast_1d(np.asarray(x, dtype=np.float64)).tolist()
+
+
+def _call(code):
+    """
+    Parse a factor's code into (function name or None, args, kwargs).
+    """
+    node = ast.parse(code, mode="eval").body
+    if isinstance(node, ast.Name):
+        return None, [node], {}
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+        return node.func.id, node.args, {k.arg: k.value for k in node.keywords}
+    return "", [], {}
+
+
+def _transform(info):
+    transforms = list(info.state["transforms"].values())
+    if len(transforms) != 1:
+        raise ValueError("cannot export the factor %s" % info.factor.code)
+    return transforms[0]
+
+
+def _numerical_spec(info):
+    code = info.factor.code
+    func, args, kwargs = _call(code)
+    name = args[0].id if args and isinstance(args[0], ast.Name) else None
+
+    if func is None:
+        return {"kind": "variable", "name": name}
+    if func == "I" and len(args) == 1:
+        e = args[0]
+        if (isinstance(e, ast.BinOp) and isinstance(e.op, ast.Pow)
+                and isinstance(e.left, ast.Name) and isinstance(e.right, ast.Constant)):
+            return {"kind": "power", "name": e.left.id, "power": e.right.value}
+    if name is not None and func == "center":
+        t = _transform(info)
+        return {"kind": "affine", "name": name, "shift": _floats(t._sum / t._count),
+                "scale": [1.0]}
+    if name is not None and func == "standardize":
+        t = _transform(info)
+        opts = dict(zip(["center", "rescale", "ddof"], [ast.literal_eval(a) for a in args[1:]]))
+        opts.update({k: ast.literal_eval(v) for k, v in kwargs.items()})
+        shift = t.current_mean if opts.get("center", True) else 0 * t.current_mean
+        scale = (np.sqrt(t.current_M2 / (t.current_n - opts.get("ddof", 0)))
+                 if opts.get("rescale", True) else 0 * t.current_mean + 1)
+        return {"kind": "affine", "name": name, "shift": _floats(shift), "scale": _floats(scale)}
+    if name is not None and func in ("bs", "bs_table"):
+        t = _transform(info)
+        nbasis = len(t._all_knots) - t._degree - 1
+        return {"kind": "bspline", "name": name, "knots": list(map(float, t._all_knots)),
+                "degree": int(t._degree), "include_intercept": info.num_columns == nbasis}
+
+    raise ValueError("cannot export the factor %s" % code)
+
+
+def _categorical_spec(info):
+    func, args, _ = _call(info.factor.code)
+    if func not in (None, "C") or not args or not isinstance(args[0], ast.Name):
+        raise ValueError("cannot export the factor %s" % info.factor.code)
+    return {"kind": "categorical", "name": args[0].id,
+            "levels": [_plain(v) for v in info.categories]}
+
+
+def export_model(result, derived=None):
+    """
+    Return a JSON-serializable description of a fitted formula model.
+
+    Parameters
+    ----------
+    result : results instance
+        An OLS, WLS or GLM fit from `from_formula`.  GLMs must have an
+        identity, log or logit link.
+    derived : dict, optional
+        Variables of the formula computed from other variables before
+        the fit, as name -> (source, shift) or (source, shift, scale);
+        the variable is (source - shift) / scale.
+
+    Returns
+    -------
+    A dict, which `CompiledModel` evaluates.
+    """
+    model = result.model
+    info = getattr(model.data, "design_info", None)
+    if info is None:
+        raise ValueError("the model was not fit from a formula")
+
+    link = "identity"
+    family = getattr(model, "family", None)
+    if family is not None:
+        cls = type(family.link).__name__
+        if cls not in _LINK_NAMES:
+            raise ValueError("cannot export a model with the %s link" % cls)
+        link = _LINK_NAMES[cls]
+
+    factors = {}
+    for factor, finfo in info.factor_infos.items():
+        if finfo.type == "categorical":
+            factors[factor.code] = _categorical_spec(finfo)
+        else:
+            spec = _numerical_spec(finfo)
+            spec["columns"] = finfo.num_columns
+            factors[factor.code] = spec
+
+    terms = []
+    for term, subterms in info.term_codings.items():
+        for st in subterms:
+            terms.append({
+                "term": term.name(),
+                "factors": [f.code for f in st.factors],
+                "contrasts": {f.code: cm.matrix.tolist()
+                              for f, cm in st.contrast_matrices.items()},
+                "columns": st.num_columns,
+            })
+
+    derived = {k: {"source": v[0], "shift": float(v[1]),
+                   "scale": float(v[2]) if len(v) > 2 else 1.0}
+               for k, v in (derived or {}).items()}
+
+    return {
+        "format": FORMAT,
+        "version": VERSION,
+        "formula": getattr(model, "formula", None),
+        "model": type(model).__name__,
+        "link": link,
+        "columns": list(info.column_names),
+        "params": np.asarray(result.params, dtype=np.float64).tolist(),
+        "derived": derived,
+        "factors": factors,
+        "terms": terms,
+    }
+
+
+def save_model(spec, path):
+    """
+    Write an exported model to a JSON file.
+    """
+    with open(path, "w") as f:
+        json.dump(spec, f, indent=1)
+
+
+def load_model(path):
+    """
+    Read an exported model from a JSON file and compile it.
+    """
+    with open(path) as f:
+        return CompiledModel(json.load(f))
+
+
+def bspline_basis(x, knots, degree):
+    """
+    Evaluate all B-spline basis functions at x, by the Cox-de Boor
+    recursion.
+
+    The result matches patsy's `bs` (before dropping the first column
+    when there is no intercept), including at the upper boundary knot.
+    Values outside the boundary knots raise ValueError, as in patsy.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    t = np.asarray(knots, dtype=np.float64)
+    if np.any(x < t[0]) or np.any(x > t[-1]):
+        raise ValueError("values outside of the boundary knots [%g, %g]" % (t[0], t[-1]))
+
+    xc = x[:, None]
+    B = ((xc >= t[None, :-1]) & (xc < t[None, 1:])).astype(np.float64)
+    # The last interval is closed on the right.
+    last = np.flatnonzero(t[:-1] < t[1:])[-1]
+    B[x == t[-1], last] = 1
+
+    for d in range(1, degree + 1):
+        m = len(t) - 1 - d
+        den1 = t[d:d + m] - t[0:m]
+        den2 = t[d + 1:d + 1 + m] - t[1:1 + m]
+        w1 = np.divide(xc - t[0:m], den1, out=np.zeros((len(x), m)), where=den1 > 0)
+        w2 = np.divide(t[d + 1:d + 1 + m] - xc, den2, out=np.zeros((len(x), m)),
+                       where=den2 > 0)
+        B = w1 * B[:, 0:m] + w2 * B[:, 1:m + 1]
+    return B
+
+
+class CompiledModel:
+    """
+    Predictions from an exported model, using NumPy only.
+
+    Parameters
+    ----------
+    spec : dict
+        A model description from `export_model`, e.g. read from JSON.
+    """
+
+    def __init__(self, spec):
+        if spec.get("format") != FORMAT or spec.get("version") != VERSION:
+            raise ValueError("not a version %d %s file" % (VERSION, FORMAT))
+        self.spec = spec
+        self.params = np.asarray(spec["params"], dtype=np.float64)
+        self.link = _INVERSE_LINKS[spec["link"]]
+        self._derived = spec["derived"]
+        self._factors = spec["factors"]
+        self._terms = [(t["factors"], {k: np.asarray(v) for k, v in t["contrasts"].items()},
+                        t["columns"]) for t in spec["terms"]]
+        self._lookup = {code: {lev: j for j, lev in enumerate(f["levels"])}
+                        for code, f in self._factors.items() if f["kind"] == "categorical"}
+
+        names = set()
+        for f in self._factors.values():
+            names.add(f["name"])
+        for k, d in self._derived.items():
+            if k in names:
+                names.discard(k)
+                names.add(d["source"])
+        self.variables = sorted(names)
+
+    def _variable(self, data, name):
+        d = self._derived.get(name)
+        if d is not None:
+            return (np.asarray(data[d["source"]], dtype=np.float64) - d["shift"]) / d["scale"]
+        return data[name]
+
+    def _factor(self, data, code):
+        f = self._factors[code]
+        x = self._variable(data, f["name"])
+        kind = f["kind"]
+        if kind == "categorical":
+            lookup = self._lookup[code]
+            try:
+                return np.fromiter((lookup[v] for v in x), dtype=np.intp, count=len(x))
+            except KeyError as e:
+                raise ValueError("unknown level %r of %s" % (e.args[0], f["name"])) from None
+        x = np.asarray(x, dtype=np.float64)
+        if kind == "variable":
+            return x[:, None]
+        if kind == "power":
+            return (x**f["power"])[:, None]
+        if kind == "affine":
+            return ((x - f["shift"][0]) / f["scale"][0])[:, None]
+        if kind == "bspline":
+            basis = bspline_basis(x, f["knots"], f["degree"])
+            return basis if f["include_intercept"] else basis[:, 1:]
+        raise ValueError("unknown factor kind %s" % kind)
+
+    def design(self, data):
+        """
+        Return the design matrix for columnar data.
+
+        Parameters
+        ----------
+        data : mapping
+            Maps each name in `variables` to a sequence of values,
+            e.g. a dict of lists or a DataFrame.
+        """
+        n = len(data[self.variables[0]]) if self.variables else 1
+        values = {code: self._factor(data, code) for code in self._factors}
+
+        blocks = []
+        for factors, contrasts, ncol in self._terms:
+            block = np.ones((n, 1))
+            # The left-most factor varies fastest, as in patsy.
+            for code in factors:
+                v = values[code]
+                mat = contrasts[code][v] if code in contrasts else v
+                block = (mat[:, :, None] * block[:, None, :]).reshape(n, -1)
+            blocks.append(block)
+        return np.hstack(blocks)
+
+    def predict(self, data):
+        """
+        Return the predicted means for columnar data.
+        """
+        return self.link(self.design(data) @ self.params)
+
+    def predict_records(self, records):
+        """
+        Return the predicted means for a list of dicts, one per record.
+        """
+        try:
+            data = {k: [r[k] for r in records] for k in self.variables}
+        except KeyError as e:
+            raise ValueError("a record has no value for %s" % e.args[0]) from None
+        return self.predict(data)
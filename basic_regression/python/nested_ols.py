@@ -0,0 +1,317 @@
+"""
+Fit a nested sequence of OLS models by updating a QR factorization.
+
+The workshop fits a growing sequence of models, for example
+
+    BPXSY1 ~ RIDAGEYR
+    BPXSY1 ~ RIDAGEYR + RIAGENDRx
+    BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx
+
+and each `fit` call factors the full design matrix from scratch.
+`NestedOLS` keeps the thin QR factorization X = QR of the current
+model, and when columns Z are appended only the new block is
+orthogonalized against Q:
+
+    Z - Q(Q'Z) = Q2 R2,   X' = [Q Q2] [[R, Q'Z], [0, R2]].
+
+This costs O(npk) for k new columns rather than O(np^2) for a refit.
+Because the factorization of every earlier model is a leading block of
+the current one, any model in the sequence can be reported, and many
+single-column candidates can be screened against the current model in
+one vectorized pass with `scan`.
+
+`fit` returns ordinary statsmodels `OLSResults`, so `params`, `bse`,
+`rsquared` and `summary()` are the same as for `sm.OLS(y, X).fit()`.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from statsmodels.regression.linear_model import OLS, OLSResults, RegressionResultsWrapper
+
+from design_cache import DesignCache
+
+
+def _as_frame(exog, prefix="x"):
+    if isinstance(exog, pd.Series):
+        return exog.to_frame()
+    if isinstance(exog, pd.DataFrame):
+        return exog
+    exog = np.asarray(exog, dtype=np.float64)
+    if exog.ndim == 1:
+        exog = exog[:, None]
+    return pd.DataFrame(exog, columns=["%s%d" % (prefix, j) for j in range(exog.shape[1])])
+
+
+class NestedOLS:
+    """
+    OLS fits for a sequence of models with a growing set of columns.
+
+    Parameters
+    ----------
+    endog : array_like
+        The outcome variable.
+    exog : array_like, optional
+        The columns of the first model.  Pandas objects are
+        recommended so that the results carry variable names.
+    tol : float
+        A new column whose component orthogonal to the current columns
+        has norm less than `tol` times its own norm is considered to
+        be collinear with the current model.
+
+    Examples
+    --------
+    >>> cache = DesignCache(da)
+    >>> y, X = cache.dmatrices("BPXSY1 ~ RIDAGEYR")
+    >>> nest = NestedOLS(y, X)
+    >>> r1 = nest.fit()
+    >>> nest.add(cache.dmatrix("RIDAGEYR + RIAGENDRx"))
+    >>> r2 = nest.fit()
+    """
+
+    def __init__(self, endog, exog=None, tol=1e-8):
+        if isinstance(endog, pd.DataFrame):
+            endog = endog.iloc[:, 0]
+        self._endog = endog
+        self._y = np.asarray(endog, dtype=np.float64)
+        self.nobs = self._y.shape[0]
+        self.tol = tol
+
+        self._Q = np.empty((self.nobs, 0))
+        self._R = np.empty((0, 0))
+        self._qty = np.empty(0)
+        self._index = getattr(endog, "index", None)
+        self._columns = {}
+
+        if exog is not None:
+            self.add(exog)
+
+    @property
+    def columns(self):
+        """
+        The names of the current columns, in the order they were added.
+        """
+        return list(self._columns)
+
+    def _new_columns(self, exog):
+        if isinstance(exog, (pd.Series, pd.DataFrame)) and self._index is not None:
+            if not exog.index.equals(self._index):
+                raise ValueError("exog and endog have different row indices")
+        exog = _as_frame(exog, prefix="x%d_" % len(self._columns))
+        if exog.shape[0] != self.nobs:
+            raise ValueError("exog has %d rows, expected %d" % (exog.shape[0], self.nobs))
+        return exog[[c for c in exog.columns if c not in self._columns]]
+
+    def _orthogonalize(self, Z):
+        """
+        Return C, Q2, R2 with Z = Q C + Q2 R2.
+        """
+        # Block Gram-Schmidt, repeated once for numerical stability.
+        C = self._Q.T @ Z
+        Z = Z - self._Q @ C
+        C2 = self._Q.T @ Z
+        Z -= self._Q @ C2
+        C += C2
+        Q2, R2 = np.linalg.qr(Z)
+        return C, Q2, R2
+
+    def add(self, exog):
+        """
+        Append columns to the model.
+
+        Columns whose names are already in the model are skipped, so
+        the full design matrix of a larger model can be passed.
+
+        Parameters
+        ----------
+        exog : array_like
+            The new columns.
+
+        Returns
+        -------
+        self
+        """
+        exog = self._new_columns(exog)
+        if exog.shape[1] == 0:
+            return self
+
+        Z = np.asarray(exog, dtype=np.float64)
+        C, Q2, R2 = self._orthogonalize(Z.copy())
+
+        norms = np.sqrt((Z**2).sum(0))
+        bad = np.abs(np.diag(R2)) <= self.tol * np.where(norms > 0, norms, 1)
+        if bad.any():
+            raise ValueError("columns are collinear with the current model: %s"
+                             % ", ".join(str(c) for c in exog.columns[bad]))
+
+        p, k = self._R.shape[0], Z.shape[1]
+        R = np.zeros((p + k, p + k))
+        R[0:p, 0:p] = self._R
+        R[0:p, p:] = C
+        R[p:, p:] = R2
+        self._R = R
+        self._Q = np.hstack((self._Q, Q2))
+        self._qty = np.concatenate((self._qty, Q2.T @ self._y))
+        for j, c in enumerate(exog.columns):
+            self._columns[c] = Z[:, j]
+
+        return self
+
+    def _prefix(self, columns):
+        names = self.columns
+        k = len(columns)
+        if set(columns) != set(names[0:k]):
+            raise ValueError("columns must be the first %d columns that were added" % k)
+        return k
+
+    def fit(self, columns=None):
+        """
+        Fit the model containing the given columns.
+
+        Parameters
+        ----------
+        columns : list of str, optional
+            The columns of the model, in the order they should appear
+            in the results.  These must be the columns of the current
+            model or of an earlier model in the sequence, in any
+            order.  Defaults to all current columns in the order they
+            were added.
+
+        Returns
+        -------
+        An OLSResults instance.
+        """
+        if columns is None:
+            columns = self.columns
+        columns = list(columns)
+        k = self._prefix(columns)
+
+        R = self._R[0:k, 0:k]
+        Rinv = np.linalg.solve(R, np.eye(k))
+        params = Rinv @ self._qty[0:k]
+        ncp = Rinv @ Rinv.T
+
+        # Permute from the order of addition to the requested order.
+        pos = {c: j for j, c in enumerate(self.columns[0:k])}
+        ix = np.asarray([pos[c] for c in columns], dtype=int)
+        params = params[ix]
+        ncp = ncp[np.ix_(ix, ix)]
+
+        exog = pd.DataFrame({c: self._columns[c] for c in columns}, index=self._index)
+        model = OLS(self._endog, exog)
+        model.rank = k
+        model.wexog_singular_values = np.linalg.svd(R, compute_uv=False)
+        model.normalized_cov_params = ncp
+        model.df_model = float(k - model.k_constant)
+        model.df_resid = self.nobs - k
+
+        results = OLSResults(model, params, normalized_cov_params=ncp)
+        return RegressionResultsWrapper(results)
+
+    def ssr(self):
+        """
+        Return the residual sum of squares of the current model.
+        """
+        return float(self._y @ self._y - self._qty @ self._qty)
+
+    def ssr_added(self, exog):
+        """
+        Return the residual sum of squares after adding a block of columns.
+
+        The model is not changed, so several alternative blocks (e.g.
+        spline bases with different degrees of freedom) can be
+        compared against the same current model.
+
+        Parameters
+        ----------
+        exog : array_like
+            The columns that would be added.
+
+        Returns
+        -------
+        The residual sum of squares, or nan if the block is collinear
+        with the current columns.
+        """
+        Z = np.asarray(_as_frame(exog), dtype=np.float64)
+        _, Q2, R2 = self._orthogonalize(Z.copy())
+        norms = np.sqrt((Z**2).sum(0))
+        if np.any(np.abs(np.diag(R2)) <= self.tol * np.where(norms > 0, norms, 1)):
+            return np.nan
+        q2y = Q2.T @ self._y
+        return self.ssr() - float(q2y @ q2y)
+
+    def scan(self, candidates):
+        """
+        Screen single-column additions to the current model.
+
+        Each column of `candidates` is considered separately as an
+        additional covariate.  No refitting is done; the reduction in
+        the residual sum of squares is obtained from the part of each
+        candidate that is orthogonal to the current columns.
+
+        Parameters
+        ----------
+        candidates : array_like
+            One candidate covariate per column.
+
+        Returns
+        -------
+        A DataFrame indexed by candidate with the residual sum of
+        squares after adding the candidate (`ssr`), the F statistic
+        for the addition (`F`) and its p-value (`pvalue`).  Collinear
+        candidates have missing values.
+        """
+        candidates = _as_frame(candidates, prefix="c")
+        Z = np.asarray(candidates, dtype=np.float64)
+        Z1 = Z - self._Q @ (self._Q.T @ Z)
+        Z1 -= self._Q @ (self._Q.T @ Z1)
+
+        ss = (Z1**2).sum(0)
+        norms = (Z**2).sum(0)
+        ok = ss > (self.tol**2) * np.where(norms > 0, norms, 1)
+        ssr0 = self.ssr()
+        gain = np.where(ok, (Z1.T @ self._y)**2 / np.where(ok, ss, 1), np.nan)
+        ssr = ssr0 - gain
+        df = self.nobs - self._R.shape[0] - 1
+        F = gain / (ssr / df)
+        pvalue = stats.f.sf(F, 1, df)
+
+        return pd.DataFrame({"ssr": ssr, "F": F, "pvalue": pvalue},
+                            index=candidates.columns)
+
+
+def fit_nested(formulas, data, cache=None):
+    """
+    Fit a nested sequence of formulas by QR updating.
+
+    Parameters
+    ----------
+    formulas : list of str
+        Formulas with the same outcome, each containing the columns
+        of the previous one.
+    data : DataFrame
+        The data.
+    cache : DesignCache, optional
+        A design matrix cache to use; a new one is created if not
+        provided.
+
+    Returns
+    -------
+    A list of OLSResults, one per formula.
+    """
+    if cache is None:
+        cache = DesignCache(data)
+    nest, results = None, []
+    for f in formulas:
+        y, X = cache.dmatrices(f, eval_env=1)
+        if nest is None:
+            nest = NestedOLS(y, X)
+        else:
+            if not (y.index.equals(nest._index) and np.array_equal(y.iloc[:, 0], nest._y)):
+                raise ValueError("formula '%s' has a different outcome or rows" % f)
+            missing = [c for c in nest.columns if c not in X.columns]
+            if missing:
+                raise ValueError("formula '%s' does not contain: %s" % (f, ", ".join(missing)))
+            nest.add(X)
+        results.append(nest.fit(list(X.columns)))
+    return results
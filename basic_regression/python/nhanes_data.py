@@ -0,0 +1,415 @@
+"""
+Loading the NHANES data used in the regression workshop.
+
+The merged NHANES file is downloaded once, hashed, and converted to a
+column store (Parquet when pyarrow is available, otherwise one
+memory-mapped .npy file per column).  Later loads read
+only the requested columns from the column store, so the network
+fetch and the full CSV parse are paid a single time.  The column store
+is keyed by the SHA-256 digest of the CSV contents, so a changed CSV
+file is never served from a stale cache.
+
+The coded NHANES variables (gender, ethnicity, education, smoking)
+are stored as floating point numbers in the CSV file.  With
+`categorical=True` they are returned as pandas categoricals with the
+labels of `NHANES_LEVELS`, which hold one small integer code per row.
+Formulas then treat them as factors without converting the numbers
+to strings, and patsy (or `DesignCache`) encodes the dummy variables
+from the integer codes rather than by hashing strings.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+NHANES_URL = "https://raw.githubusercontent.com/kshedden/statswpy/master/NHANES/merged/nhanes_2015_2016.csv"
+
+# The variables used in nhanes_ols.py.
+NHANES_VARS = ["BPXSY1", "RIDAGEYR", "RIAGENDR", "RIDRETH1", "DMDEDUC2", "BMXBMI", "SMQ020"]
+
+# The codes and labels of the coded variables, with the levels in the
+# order used by formulas (the first level is the reference level).
+# Female is first so that it is the reference level, as when the labels
+# are sorted as strings in nhanes_ols.py.
+NHANES_LEVELS = {
+    "RIAGENDR": [(2, "Female"), (1, "Male")],
+    "RIDRETH1": [(1, "Mexican American"), (2, "Other Hispanic"), (3, "Non-Hispanic White"),
+                 (4, "Non-Hispanic Black"), (5, "Other Race")],
+    "DMDEDUC2": [(1, "Less than 9th grade"), (2, "9-11th grade"), (3, "High school graduate"),
+                 (4, "Some college or AA degree"), (5, "College graduate or above"),
+                 (7, "Refused"), (9, "Don't know")],
+    "SMQ020": [(1, "Yes"), (2, "No"), (7, "Refused"), (9, "Don't know")],
+}
+
+
+def default_cache_dir():
+    """
+    Return the directory used to cache downloaded and converted files.
+
+    The location can be set with the NHANES_CACHE environment
+    variable, and defaults to ~/.cache/nhanes.
+    """
+    d = os.environ.get("NHANES_CACHE")
+    if d is None:
+        d = os.path.join(os.path.expanduser("~"), ".cache", "nhanes")
+    return d
+
+
+def as_categorical(x, column):
+    """
+    Convert the numeric codes of an NHANES variable to a categorical.
+
+    Parameters
+    ----------
+    x : Series
+        The codes, as read from the CSV file; missing values are
+        allowed.
+    column : str
+        The variable, a key of `NHANES_LEVELS`.
+
+    Returns
+    -------
+    A categorical Series with the same index, with the labels of the
+    codes as categories.
+    """
+    levels = NHANES_LEVELS[column]
+    values = np.asarray(x, dtype=np.float64)
+    ok = ~np.isnan(values)
+    codes = np.full(len(values), -1, dtype=np.int8)
+    if ok.any():
+        # A lookup table from NHANES code to category position.
+        lut = np.full(max(c for c, _ in levels) + 1, -1, dtype=np.int8)
+        for j, (c, _) in enumerate(levels):
+            lut[c] = j
+        v = values[ok]
+        vi = v.astype(np.int64)
+        bad = (vi != v) | (vi < 0) | (vi >= len(lut))
+        vi[bad] = 0
+        codes[ok] = lut[vi]
+        bad |= codes[ok] < 0
+        if bad.any():
+            raise ValueError("unknown codes for %s: %s" % (
+                column, ", ".join("%g" % u for u in np.unique(v[bad]))))
+    cat = pd.Categorical.from_codes(codes, categories=[lab for _, lab in levels])
+    return pd.Series(cat, index=getattr(x, "index", None), name=getattr(x, "name", column))
+
+
+def categorize(df):
+    """
+    Return a copy of df with the coded NHANES variables as categoricals.
+
+    Columns of `NHANES_LEVELS` that are not in df are ignored.
+    """
+    df = df.copy()
+    for k in NHANES_LEVELS:
+        if k in df.columns:
+            df[k] = as_categorical(df[k], k)
+    return df
+
+
+def _have_parquet():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _is_url(source):
+    return source.startswith(("http://", "https://", "ftp://"))
+
+
+def _fetch(url, cache_dir, refresh):
+    """
+    Download url into cache_dir unless a copy is already there.
+    """
+    fname = os.path.join(cache_dir, os.path.basename(url))
+    if refresh or not os.path.exists(fname):
+        # Download to a temporary name so that an interrupted
+        # transfer never leaves a truncated file in the cache.
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".part")
+        os.close(fd)
+        try:
+            with urllib.request.urlopen(url) as src, open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(tmp, fname)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return fname
+
+
+def file_digest(fname, cache_dir=None):
+    """
+    Return the SHA-256 hex digest of the contents of a file.
+
+    If cache_dir is given, digests are remembered in a manifest keyed
+    by the file's path, size and modification time, so that an
+    unchanged file is only read once.
+    """
+    st = os.stat(fname)
+    key = os.path.abspath(fname)
+    stamp = [st.st_size, st.st_mtime_ns]
+
+    manifest = {}
+    mname = None
+    if cache_dir is not None:
+        mname = os.path.join(cache_dir, "manifest.json")
+        if os.path.exists(mname):
+            with open(mname) as f:
+                manifest = json.load(f)
+        entry = manifest.get(key)
+        if entry is not None and entry["stamp"] == stamp:
+            return entry["sha256"]
+
+    h = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    digest = h.hexdigest()
+
+    if mname is not None:
+        manifest[key] = {"stamp": stamp, "sha256": digest}
+        tmp = mname + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, mname)
+
+    return digest
+
+
+def _write_npy_store(df, dname):
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(dname))
+    dtypes = {}
+    for k in df.columns:
+        x = df[k].to_numpy()
+        if x.dtype == object:
+            # Strings are stored as integer codes (-1 for missing) and
+            # the distinct values, so missing values stay missing.
+            codes, levels = pd.factorize(x)
+            np.save(os.path.join(tmp, "%s.levels.npy" % k), np.asarray(levels, dtype=str))
+            np.save(os.path.join(tmp, "%s.npy" % k), codes)
+            dtypes[k] = "object"
+            continue
+        np.save(os.path.join(tmp, "%s.npy" % k), x)
+        dtypes[k] = str(x.dtype)
+    with open(os.path.join(tmp, "columns.json"), "w") as f:
+        json.dump(dtypes, f)
+    os.rename(tmp, dname)
+
+
+def _check_columns(columns, available):
+    missing = [k for k in columns if k not in available]
+    if missing:
+        raise KeyError("columns not in data: %s" % ", ".join(missing))
+
+
+def _read_parquet_store(fname, columns):
+    import pyarrow.parquet as pq
+    if columns is not None:
+        _check_columns(columns, pq.read_schema(fname).names)
+    return pd.read_parquet(fname, columns=columns)
+
+
+def _read_npy_store(dname, columns):
+    with open(os.path.join(dname, "columns.json")) as f:
+        dtypes = json.load(f)
+    if columns is None:
+        columns = list(dtypes)
+    _check_columns(columns, dtypes)
+    df = {}
+    for k in columns:
+        x = np.load(os.path.join(dname, "%s.npy" % k), mmap_mode="r")
+        if dtypes[k] == "object":
+            levels = np.load(os.path.join(dname, "%s.levels.npy" % k)).astype(object)
+            codes, x = x, np.full(len(x), np.nan, dtype=object)
+            x[codes >= 0] = levels[codes[codes >= 0]]
+        df[k] = x
+    return pd.DataFrame(df)
+
+
+def _build_store(csvname, store, parquet):
+    df = pd.read_csv(csvname)
+    if parquet:
+        tmp = store + ".tmp"
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, store)
+    else:
+        _write_npy_store(df, store)
+
+
+def load_nhanes(columns=None, source=NHANES_URL, cache_dir=None, refresh=False,
+                categorical=False):
+    """
+    Load NHANES data, reading only the requested columns.
+
+    Parameters
+    ----------
+    columns : list of str, optional
+        The columns to return.  All columns are returned by default.
+    source : str
+        A URL or a local path to a CSV file.  URLs are downloaded
+        into the cache directory the first time they are used.
+    cache_dir : str, optional
+        Where downloads and column stores are kept, defaults to
+        `default_cache_dir()`.
+    refresh : bool
+        If True, download the source again even if it has already
+        been cached.  The column store is rebuilt only if the
+        contents of the file have changed.
+    categorical : bool
+        If True, the variables of `NHANES_LEVELS` are returned as
+        labeled categoricals, see `categorize`.
+
+    Returns
+    -------
+    A DataFrame with the requested columns.  The row index matches
+    the index that `pd.read_csv(source)` would produce.
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+
+    if _is_url(source):
+        csvname = _fetch(source, cache_dir, refresh)
+    else:
+        csvname = source
+
+    digest = file_digest(csvname, cache_dir)
+    parquet = _have_parquet()
+    store = os.path.join(cache_dir, digest[0:16] + (".parquet" if parquet else ".npy.d"))
+    if not os.path.exists(store):
+        _build_store(csvname, store, parquet)
+
+    if columns is not None:
+        columns = list(columns)
+
+    if parquet:
+        df = _read_parquet_store(store, columns)
+    else:
+        df = _read_npy_store(store, columns)
+    if categorical:
+        df = categorize(df)
+    return df
+
+
+def iter_nhanes_chunks(sources, columns=NHANES_VARS, dropna=True, chunksize=100000,
+                       categorical=False, **kwargs):
+    """
+    Iterate over NHANES data in chunks of rows.
+
+    Each chunk is restricted to `columns` while parsing, and rows with
+    missing values in any of these columns are dropped before the
+    chunk is yielded, so memory use is governed by the projected
+    columns rather than by the width of the files.
+
+    Parameters
+    ----------
+    sources : str or list of str
+        One or more CSV files (or URLs), e.g. several survey cycles
+        that are to be stacked.
+    columns : list of str
+        The columns to keep.
+    dropna : bool
+        If True, only complete cases are retained.
+    chunksize : int
+        Number of CSV rows parsed at a time.
+    categorical : bool
+        If True, the variables of `NHANES_LEVELS` are converted to
+        labeled categoricals.  All chunks have the same categories, so
+        they can be concatenated without losing the categorical type.
+    kwargs
+        Passed to `pd.read_csv`.
+    """
+    if isinstance(sources, str):
+        sources = [sources]
+    columns = list(columns)
+    for source in sources:
+        with pd.read_csv(source, usecols=columns, chunksize=chunksize, **kwargs) as reader:
+            for chunk in reader:
+                chunk = chunk[columns]
+                if dropna:
+                    chunk = chunk.dropna()
+                if categorical:
+                    chunk = categorize(chunk)
+                yield chunk
+
+
+def load_nhanes_chunked(sources, columns=NHANES_VARS, dropna=True, chunksize=100000,
+                        categorical=False, **kwargs):
+    """
+    Build the analysis data set incrementally from chunks.
+
+    Returns the same rows (with the same index) as reading each
+    source fully with `pd.read_csv`, concatenating, and then applying
+    `da[columns].dropna()`.  See `iter_nhanes_chunks` for the
+    arguments.
+    """
+    chunks = list(iter_nhanes_chunks(sources, columns, dropna, chunksize, categorical,
+                                     **kwargs))
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=list(columns))
+    return pd.concat(chunks)
+
+
+def synthetic_nhanes(n, seed=0, extra=0, missing=0.05):
+    """
+    Simulate a data set shaped like the merged NHANES file.
+
+    The NHANES variables used in the workshop are generated with
+    plausible ranges and codings, and systolic/diastolic blood pressure
+    depend on age, BMI and gender roughly as in the real data.
+
+    Parameters
+    ----------
+    n : int
+        The number of rows.
+    seed : int
+        Seed for the random number generator.
+    extra : int
+        Number of additional unused numeric columns, to mimic the
+        width of the real file.
+    missing : float
+        The fraction of missing values in each column other than
+        SEQN and the survey design variables (SDMVSTRA, SDMVPSU,
+        WTMEC2YR).
+    """
+    rng = np.random.default_rng(seed)
+    age = rng.integers(18, 81, n)
+    gender = rng.integers(1, 3, n)
+    bmi = np.clip(rng.normal(29, 7, n), 14, 70).round(1)
+    eta = 90 + 0.5 * age + 0.3 * bmi - 3.5 * (gender == 2)
+    sd = 10 + 0.15 * age
+
+    df = pd.DataFrame({
+        "SEQN": np.arange(83732, 83732 + n),
+        "BPXSY1": np.round(eta + sd * rng.normal(size=n)),
+        "BPXDI1": np.round(50 + 0.1 * age + 0.3 * bmi + 10 * rng.normal(size=n)),
+        "RIDAGEYR": age,
+        "RIAGENDR": gender,
+        "RIDRETH1": rng.integers(1, 6, n),
+        "DMDEDUC2": rng.integers(1, 6, n),
+        "BMXBMI": bmi,
+        "SMQ020": rng.integers(1, 3, n),
+    })
+    for j in range(extra):
+        df["X%03d" % j] = rng.normal(size=n)
+
+    if missing > 0:
+        for k in df.columns[1:]:
+            df[k] = df[k].where(rng.uniform(size=n) >= missing)
+
+    # The survey design: 15 strata of two PSUs each, as in 2015-2016,
+    # and exam weights.  These are never missing.
+    psu = rng.integers(0, 30, n)
+    df["SDMVSTRA"] = 119 + psu // 2
+    df["SDMVPSU"] = 1 + psu % 2
+    df["WTMEC2YR"] = np.round(np.exp(rng.normal(9.7, 0.6, n)), 2)
+
+    return df
@@ -91,7 +91,6 @@
 
 import matplotlib.pyplot as plt
 import seaborn as sns
-import pandas as pd
 import statsmodels.api as sm
 import numpy as np
 
@@ -104,12 +103,14 @@ import numpy as np
 # that we will use in this notebook.
 
 
-url = "https://raw.githubusercontent.com/kshedden/statswpy/master/NHANES/merged/nhanes_2015_2016.csv"
-da = pd.read_csv(url)
+# `load_nhanes` (see nhanes_data.py) downloads the file once and
+# afterwards reads only the columns we ask for from a local cache.
+
+from nhanes_data import NHANES_URL, load_nhanes
 
 # Drop unused columns, drop rows with any missing values.
 vars = ["BPXSY1", "RIDAGEYR", "RIAGENDR", "RIDRETH1", "DMDEDUC2", "BMXBMI", "SMQ020"]
-da = da[vars].dropna()
+da = load_nhanes(vars, source=NHANES_URL).dropna()
 
 
 ## Linear regression and least squares
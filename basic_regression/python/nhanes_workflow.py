@@ -0,0 +1,252 @@
+"""
+The analysis of nhanes_ols.py as a pipeline of memoized stages.
+
+In nhanes_ols.py the data frame `da` is modified as the analysis
+proceeds (columns are added and deleted), and any change means running
+everything again.  Here the same analysis is written as stages that do
+not modify their inputs:
+
+    raw -> complete -> analysis -> fit_* -> bands_* -> plot_*
+                                           -> robust_main
+
+Results are cached on disk (see pipeline.py), so after a change only
+the affected stages run again.  For example, editing `fit_spline` only
+reruns that fit and `bands_spline`.
+
+    python nhanes_workflow.py --cache-dir ~/.cache/nhanes/workflow
+
+With `--profile PREFIX` the run is recorded with `instrument.recording`:
+a table of the spans is printed, and PREFIX.trace.json (spans, for
+chrome://tracing or Perfetto) and PREFIX.folded.txt (sampled stacks,
+for flame graph tools) are written.
+
+Plotting modules are imported only by the plot stages, so a batch job
+that only fits the models does not load matplotlib.  `--fit-only` runs
+just the fits, and with `--export DIR` also writes each fitted model
+as JSON for `model_export.load_model`:
+
+    python nhanes_workflow.py --fit-only --export models/
+"""
+
+import argparse
+import os
+
+import numpy as np
+import patsy
+from statsmodels.genmod.generalized_linear_model import GLM
+from statsmodels.regression.linear_model import OLS
+
+from bands import predict_functional_batch
+from nhanes_data import NHANES_URL, NHANES_VARS, as_categorical, load_nhanes
+from pipeline import Pipeline
+from robust_cov import robust_cov
+from spline_basis import scan_spline_df
+
+# The stages that fit models.
+FITS = ["fit_age", "fit_age_gender", "fit_main", "fit_glm", "fit_quadratic", "fit_spline",
+        "fit_interaction"]
+
+# The values at which non-focus variables are held in the prediction
+# plots of nhanes_ols.py.
+VALUES = {"RIAGENDRx": "Female", "RIAGENDR": 2, "BMXBMI": 25,
+          "DMDEDUC2": 1, "RIDRETH1": 1, "SMQ020": 1}
+
+
+def build(cache_dir, source=NHANES_URL, data_cache=None):
+    """
+    Return the NHANES regression pipeline.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Where stage results and figures are stored.
+    source : str
+        The NHANES CSV file or URL.
+    data_cache : str, optional
+        The cache directory for `load_nhanes`.
+    """
+    fig_dir = os.path.join(cache_dir, "figures")
+    pipe = Pipeline(cache_dir, source=source, data_cache=data_cache, fig_dir=fig_dir,
+                    values=VALUES, spline_dfs=list(range(3, 11)))
+
+    @pipe.stage
+    def raw(source, data_cache):
+        return load_nhanes(NHANES_VARS, source=source, cache_dir=data_cache)
+
+    @pipe.stage
+    def complete(raw):
+        return raw.dropna()
+
+    @pipe.stage
+    def analysis(complete):
+        da = complete.copy()
+        da["RIAGENDRx"] = as_categorical(da.RIAGENDR, "RIAGENDR")
+        da["RIDAGEYR_z"] = (da.RIDAGEYR - da.RIDAGEYR.mean()) / da.RIDAGEYR.std()
+        da["RIDAGEYR_cen"] = da.RIDAGEYR - da.RIDAGEYR.mean()
+        return da
+
+    @pipe.stage
+    def fit_age(analysis):
+        return OLS.from_formula("BPXSY1 ~ RIDAGEYR", analysis).fit()
+
+    @pipe.stage
+    def fit_age_gender(analysis):
+        return OLS.from_formula("BPXSY1 ~ RIDAGEYR + RIAGENDRx", analysis).fit()
+
+    @pipe.stage
+    def fit_main(analysis):
+        return OLS.from_formula("BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx", analysis).fit()
+
+    @pipe.stage
+    def fit_glm(analysis):
+        return GLM.from_formula("BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx", analysis).fit()
+
+    @pipe.stage
+    def fit_quadratic(analysis):
+        return OLS.from_formula("BPXSY1 ~ RIDAGEYR_z + I(RIDAGEYR_z**2) + RIAGENDRx",
+                                analysis).fit()
+
+    @pipe.stage
+    def fit_spline(analysis):
+        # Unpickling the cached fit evaluates its formula again, in the
+        # namespace of the code that loads it, so the formula uses
+        # patsy's bs rather than spline_basis.bs_table.
+        return OLS.from_formula("BPXSY1 ~ bs(RIDAGEYR, 5) + BMXBMI + RIAGENDRx",
+                                analysis).fit()
+
+    @pipe.stage
+    def spline_df(analysis, spline_dfs):
+        exog = patsy.dmatrix("BMXBMI + RIAGENDRx", analysis)
+        return scan_spline_df(analysis.BPXSY1, analysis.RIDAGEYR, spline_dfs, exog)
+
+    @pipe.stage
+    def fit_interaction(analysis):
+        return OLS.from_formula("BPXSY1 ~ RIDAGEYR_cen*RIAGENDRx + BMXBMI",
+                                analysis).fit()
+
+    @pipe.stage
+    def robust_main(fit_main, analysis):
+        # Standard errors of the main model by covariance type, with
+        # clusters by race/ethnicity.
+        return robust_cov(fit_main, groups=analysis.RIDRETH1).bse
+
+    @pipe.stage
+    def bands_main(fit_main, values):
+        age = predict_functional_batch(fit_main, "RIDAGEYR", [values])
+        v = dict(values, RIDAGEYR=50)
+        del v["BMXBMI"]
+        bmi = predict_functional_batch(fit_main, "BMXBMI", [v])
+        return {"RIDAGEYR": age, "BMXBMI": bmi}
+
+    @pipe.stage
+    def bands_spline(fit_spline, values):
+        return predict_functional_batch(fit_spline, "RIDAGEYR", [values])
+
+    @pipe.stage
+    def bands_interaction(fit_interaction, values):
+        scenarios = [dict(values, RIAGENDRx=g, RIDAGEYR=np.nan) for g in ("Female", "Male")]
+        return predict_functional_batch(fit_interaction, "RIDAGEYR_cen", scenarios)
+
+    @pipe.stage
+    def plot_bands(bands_main, bands_spline, bands_interaction, fig_dir):
+        import matplotlib.pyplot as plt
+
+        panels = [("Age", bands_main["RIDAGEYR"], ["Female"]),
+                  ("BMI", bands_main["BMXBMI"], ["Female"]),
+                  ("Age (spline)", bands_spline, ["Female"]),
+                  ("Age (centered)", bands_interaction, ["Female", "Male"])]
+        fig, axes = plt.subplots(1, 4, figsize=(16, 4))
+        for ax, (xlabel, (pred, cb, fv), labels) in zip(axes, panels):
+            for pr, b, label in zip(pred, cb, labels):
+                ax.plot(fv, pr, lw=4, label=label)
+                ax.fill_between(fv, b[:, 0], b[:, 1], color="grey", alpha=0.4)
+            ax.set_xlabel(xlabel)
+            ax.set_ylabel("SBP")
+        axes[-1].legend()
+        return _save(fig, fig_dir, "bands.png")
+
+    @pipe.stage
+    def plot_diagnostics(fit_main, fit_glm, fig_dir):
+        import matplotlib.pyplot as plt
+        import diagnostics
+
+        fig, axes = plt.subplots(1, 5, figsize=(20, 4))
+        diagnostics.plot_resid_fitted(fit_main, ax=axes[0])
+        diagnostics.plot_ccpr(fit_main, "RIDAGEYR", ax=axes[1])
+        diagnostics.plot_ccpr(fit_main, "BMXBMI", ax=axes[2])
+        diagnostics.plot_added_variable(fit_glm, "RIDAGEYR", ax=axes[3], lowess_frac=0.5)
+        diagnostics.plot_added_variable(fit_glm, "BMXBMI", ax=axes[4], lowess_frac=0.5)
+        return _save(fig, fig_dir, "diagnostics.png")
+
+    return pipe
+
+
+def _save(fig, fig_dir, name):
+    import matplotlib.pyplot as plt
+
+    os.makedirs(fig_dir, exist_ok=True)
+    fname = os.path.join(fig_dir, name)
+    fig.tight_layout()
+    fig.savefig(fname)
+    plt.close(fig)
+    return fname
+
+
+def export_fits(pipe, out_dir):
+    """
+    Write the fitted models of a pipeline run as JSON files.
+
+    The centered and standardized ages are declared as derived from
+    RIDAGEYR, so that records to be scored only need the original
+    variables.  Returns the names of the files.
+    """
+    from model_export import export_model, save_model
+
+    da = pipe["analysis"]
+    mean, sd = da.RIDAGEYR.mean(), da.RIDAGEYR.std()
+    derived = {"RIDAGEYR_cen": ("RIDAGEYR", mean), "RIDAGEYR_z": ("RIDAGEYR", mean, sd)}
+    os.makedirs(out_dir, exist_ok=True)
+    fnames = []
+    for name in FITS:
+        fname = os.path.join(out_dir, name + ".json")
+        save_model(export_model(pipe[name], derived), fname)
+        fnames.append(fname)
+    return fnames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", default=NHANES_URL)
+    parser.add_argument("--cache-dir", default=os.path.join("nhanes_cache", "workflow"))
+    parser.add_argument("--targets", nargs="*")
+    parser.add_argument("--force", nargs="*", default=[])
+    parser.add_argument("--profile", metavar="PREFIX")
+    parser.add_argument("--sample-interval", type=float, default=0.005)
+    parser.add_argument("--fit-only", action="store_true",
+                        help="run only the model fits (and the stages they need)")
+    parser.add_argument("--export", metavar="DIR", help="write the fitted models as JSON")
+    args = parser.parse_args()
+
+    pipe = build(args.cache_dir, source=args.source)
+    if args.fit_only:
+        args.targets = FITS + ["spline_df"] + (args.targets or [])
+    if args.export is not None and args.targets:
+        args.targets = args.targets + FITS
+    if args.profile is None:
+        pipe.run(args.targets, force=args.force)
+    else:
+        import instrument
+
+        with instrument.recording(memory=True, sample_interval=args.sample_interval) as rec:
+            pipe.run(args.targets, force=args.force)
+        print(rec.report().to_string(index=False))
+        rec.write_trace(args.profile + ".trace.json")
+        rec.write_folded(args.profile + ".folded.txt")
+    print(pipe.report().to_string(index=False))
+    if args.export is not None:
+        for fname in export_fits(pipe, args.export):
+            print(fname)
+
+
+if __name__ == "__main__":
+    main()
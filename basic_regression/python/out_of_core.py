@@ -0,0 +1,422 @@
+"""
+Regression on stacked NHANES cycles that do not fit in memory.
+
+Several survey cycles are read from their CSV files in chunks of rows,
+and only per-chunk design matrices are ever built.  For OLS a single
+pass accumulates the cross products X'X and X'y (see suffstats.py).
+A Gaussian GLM is fit by iteratively reweighted least squares, with
+one pass over the data per iteration: the pass that evaluates the
+current coefficients also accumulates X'WX and X'Wz for the next
+iteration.  For the identity link the weights are constant, so the
+fit converges in the same number of iterations as statsmodels' IRLS.
+
+    chunks = chunk_source(["nhanes_1999_2000.csv", ..., "nhanes_2015_2016.csv"],
+                          transform=add_gender_labels)
+    ols = ols_from_chunks("BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx", chunks)
+    glm = glm_from_chunks("BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx", chunks)
+    print(ols.summary())
+    print(glm.summary())
+
+The summaries agree with those of `sm.OLS.from_formula(...).fit()` and
+`sm.GLM.from_formula(...).fit()` on the concatenated data; see
+`compare` below.
+"""
+
+import argparse
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import patsy
+import statsmodels.api as sm
+from scipy import stats
+from statsmodels.genmod import families
+
+from nhanes_data import NHANES_VARS, iter_nhanes_chunks, synthetic_nhanes
+from suffstats import k_constant, ols_from_chunks
+
+
+def chunk_source(sources, columns=NHANES_VARS, transform=None, chunksize=100000, **kwargs):
+    """
+    Return a function that iterates over stacked NHANES files in chunks.
+
+    Parameters
+    ----------
+    sources : str or list of str
+        The CSV files, e.g. one per survey cycle.
+    columns : list of str
+        The columns to read; rows with missing values are dropped.
+    transform : callable, optional
+        Applied to each chunk, e.g. to add derived variables.  It must
+        only use the values in its chunk.
+    chunksize : int
+        The number of CSV rows parsed at a time.
+    kwargs
+        Passed to `iter_nhanes_chunks`.
+
+    Returns
+    -------
+    A function with no arguments returning a new iterator over the
+    chunks, as needed by `ols_from_chunks` and `glm_from_chunks`.
+    """
+    def chunks():
+        for chunk in iter_nhanes_chunks(sources, columns, chunksize=chunksize, **kwargs):
+            yield chunk if transform is None else transform(chunk)
+    return chunks
+
+
+def _vec(y):
+    return np.asarray(y, dtype=np.float64).reshape(-1)
+
+
+class ChunkedGLM:
+    """
+    A Gaussian GLM fit by IRLS with one pass over the data per iteration.
+
+    Parameters
+    ----------
+    blocks : callable
+        A function with no arguments that returns an iterator over
+        (endog, exog) blocks of the data.
+    exog_names : list of str
+        The names of the columns of exog.
+    endog_name : str
+        The name of the outcome.
+    link : statsmodels link, optional
+        The link function; defaults to the identity.
+    """
+
+    def __init__(self, blocks, exog_names, endog_name="y", link=None):
+        self.blocks = blocks
+        self.exog_names = list(exog_names)
+        self.endog_name = endog_name
+        self.family = families.Gaussian(link)
+
+    def _solve(self, xtwx, xtwz):
+        evals, evecs = np.linalg.eigh(xtwx)
+        tol = evals.max() * max(xtwx.shape) * np.finfo(np.float64).eps
+        keep = evals > tol
+        ncp = (evecs[:, keep] / evals[keep]) @ evecs[:, keep].T
+        return ncp @ xtwz, ncp, int(keep.sum())
+
+    def _pass(self, params, ybar):
+        """
+        Evaluate params (or the starting values), and accumulate the
+        weighted least squares problem of the next iteration.
+        """
+        fam, p = self.family, len(self.exog_names)
+        xtwx, xtwz = np.zeros((p, p)), np.zeros(p)
+        ssr = 0.
+        for y, X in self.blocks():
+            y, X = _vec(y), np.asarray(X, dtype=np.float64)
+            if params is None:
+                mu = (y + ybar) / 2
+                eta = fam.predict(mu)
+            else:
+                eta = X @ params
+                mu = fam.fitted(eta)
+            ssr += ((y - mu)**2).sum()
+            w = fam.weights(mu)
+            z = eta + fam.link.deriv(mu) * (y - mu)
+            xtwx += (X * w[:, None]).T @ X
+            xtwz += X.T @ (w * z)
+        return ssr, xtwx, xtwz
+
+    def fit(self, maxiter=100, tol=1e-8):
+        """
+        Fit the model, following statsmodels' `GLM.fit` with method IRLS.
+
+        Returns
+        -------
+        A ChunkedGLMResults instance.
+        """
+        nobs, ysum, yss = 0, 0., 0.
+        xtx, xsum = 0., 0.
+        xmin = xmax = None
+        for y, X in self.blocks():
+            y, X = _vec(y), np.asarray(X, dtype=np.float64)
+            nobs += y.size
+            ysum += y.sum()
+            yss += y @ y
+            xtx = xtx + X.T @ X
+            xsum = xsum + X.sum(0)
+            mn, mx = X.min(0), X.max(0)
+            xmin = mn if xmin is None else np.minimum(xmin, mn)
+            xmax = mx if xmax is None else np.maximum(xmax, mx)
+        ybar = ysum / nobs
+
+        # statsmodels records deviances scaled by the scale estimate of
+        # the previous iteration, and stops when two consecutive ones
+        # differ by less than tol.
+        params, ncp, rank = None, None, None
+        deviance = [np.inf]
+        converged = False
+        for k in range(maxiter + 1):
+            ssr, xtwx, xtwz = self._pass(params, ybar)
+            if params is None:
+                _, _, rank = self._solve(xtwx, xtwz)
+                scale = ssr / (nobs - rank)
+                deviance.append(ssr / scale)
+            else:
+                deviance.append(ssr / scale)
+                scale = ssr / (nobs - rank)
+                if np.allclose(deviance[-2], deviance[-1], atol=tol, rtol=0):
+                    converged = True
+                    break
+            if k == maxiter:
+                break
+            params, ncp, _ = self._solve(xtwx, xtwz)
+
+        results = ChunkedGLMResults(self, params, ncp, scale, nobs, rank)
+        results.ssr = ssr
+        results.centered_tss = yss - ysum**2 / nobs
+        results.k_constant = k_constant(xtx, xsum, nobs, xmin, xmax)
+        results.converged = converged
+        results.fit_history = {"iteration": k, "deviance": deviance}
+        return results
+
+
+class ChunkedGLMResults:
+    """
+    Results of a `ChunkedGLM` fit.
+
+    The attribute names follow statsmodels' `GLMResults`.
+    """
+
+    def __init__(self, model, params, normalized_cov_params, scale, nobs, rank):
+        self.model = model
+        self.family = model.family
+        self.exog_names = model.exog_names
+        self.params = pd.Series(params, index=self.exog_names)
+        self.normalized_cov_params = normalized_cov_params
+        self.scale = scale
+        self.nobs = float(nobs)
+        self.rank = rank
+        self.df_model = float(rank - 1)
+        self.df_resid = self.nobs - rank
+        self.method = "IRLS"
+        self.cov_type = "nonrobust"
+        self.use_t = False
+
+    @property
+    def deviance(self):
+        return self.ssr
+
+    @property
+    def pearson_chi2(self):
+        return self.ssr
+
+    @property
+    def null_deviance(self):
+        return self.centered_tss
+
+    def _loglike(self, ssr, scale):
+        return -(ssr / scale + self.nobs * np.log(2 * np.pi * scale)) / 2
+
+    @property
+    def llf(self):
+        # The profile likelihood for the identity link, as in statsmodels.
+        if isinstance(self.family.link, families.links.Identity):
+            return self._loglike(self.ssr, self.ssr / self.nobs)
+        return self._loglike(self.ssr, self.scale)
+
+    @property
+    def llnull(self):
+        # The null model fits the mean, whatever the link.
+        return self._loglike(self.centered_tss, self.scale)
+
+    def pseudo_rsquared(self, kind="cs"):
+        kind = kind.lower()
+        if kind.startswith("mcf"):
+            return 1 - self.llf / self.llnull
+        if kind.startswith("cox") or kind in ["cs", "lr"]:
+            return 1 - np.exp((self.llnull - self.llf) * (2 / self.nobs))
+        raise ValueError("only McFadden and Cox-Snell are available")
+
+    @property
+    def aic(self):
+        return -2 * self.llf + 2 * (self.df_model + 1)
+
+    @property
+    def bic_llf(self):
+        return -2 * self.llf + np.log(self.nobs) * (self.df_model + 1)
+
+    def cov_params(self):
+        c = self.scale * self.normalized_cov_params
+        return pd.DataFrame(c, index=self.exog_names, columns=self.exog_names)
+
+    @property
+    def bse(self):
+        return pd.Series(np.sqrt(self.scale * np.diag(self.normalized_cov_params)),
+                         index=self.exog_names)
+
+    @property
+    def tvalues(self):
+        return self.params / self.bse
+
+    @property
+    def pvalues(self):
+        return pd.Series(2 * stats.norm.sf(np.abs(self.tvalues)), index=self.exog_names)
+
+    def conf_int(self, alpha=0.05):
+        q = stats.norm.ppf(1 - alpha / 2)
+        return pd.DataFrame({0: self.params - q * self.bse, 1: self.params + q * self.bse})
+
+    def predict(self, exog, linear=False):
+        """
+        Return the fitted means (or linear predictors) for a design matrix.
+        """
+        eta = np.asarray(exog, dtype=np.float64) @ self.params.values
+        return eta if linear else self.family.fitted(eta)
+
+    @property
+    def fittedvalues(self):
+        """
+        The fitted means, computed from the data on each access.
+        """
+        return np.concatenate([self.predict(X) for _, X in self.model.blocks()])
+
+    @property
+    def resid_response(self):
+        """
+        The response residuals, computed from the data on each access.
+        """
+        return np.concatenate([_vec(y) - self.predict(X) for y, X in self.model.blocks()])
+
+    def summary(self, yname=None, xname=None, title=None, alpha=0.05):
+        """
+        Summarize the results, as `GLMResults.summary`.
+        """
+        from statsmodels.iolib.summary import Summary
+
+        if yname is None:
+            yname = self.model.endog_name
+        if xname is None:
+            xname = self.exog_names
+        if title is None:
+            title = "Generalized Linear Model Regression Results"
+
+        top_left = [
+            ("Dep. Variable:", None),
+            ("Model:", ["GLM"]),
+            ("Model Family:", [self.family.__class__.__name__]),
+            ("Link Function:", [self.family.link.__class__.__name__]),
+            ("Method:", [self.method]),
+            ("Date:", None),
+            ("Time:", None),
+            ("No. Iterations:", ["%d" % self.fit_history["iteration"]]),
+            ("Covariance Type:", [self.cov_type]),
+        ]
+        top_right = [
+            ("No. Observations:", None),
+            ("Df Residuals:", None),
+            ("Df Model:", None),
+            ("Scale:", ["%#8.5g" % self.scale]),
+            ("Log-Likelihood:", None),
+            ("Deviance:", ["%#8.5g" % self.deviance]),
+            ("Pearson chi2:", ["%#6.3g" % self.pearson_chi2]),
+            ("Pseudo R-squ. (CS):", ["%#6.4g" % self.pseudo_rsquared(kind="cs")]),
+        ]
+
+        smry = Summary()
+        smry.add_table_2cols(self, gleft=top_left, gright=top_right,
+                             yname=yname, xname=xname, title=title)
+        smry.add_table_params(self, yname=yname, xname=xname, alpha=alpha,
+                              use_t=self.use_t)
+        return smry
+
+
+def glm_from_chunks(formula, chunks, link=None, maxiter=100, tol=1e-8, eval_env=0):
+    """
+    Fit a Gaussian GLM from a formula, reading the data in chunks.
+
+    Parameters
+    ----------
+    formula : str
+        A patsy formula.
+    chunks : callable
+        A function with no arguments that returns a new iterator over
+        the data, as DataFrames, e.g. from `chunk_source`.  It is
+        called once per IRLS iteration, plus two or three times to set
+        up the design.
+    link : statsmodels link, optional
+        The link function; defaults to the identity.
+    maxiter, tol
+        The IRLS settings of `GLM.fit`.
+    eval_env : int or patsy.EvalEnvironment
+        Where to look up names in the formula, as in `patsy.dmatrices`.
+
+    Returns
+    -------
+    A ChunkedGLMResults instance.
+    """
+    eval_env = patsy.EvalEnvironment.capture(eval_env, reference=1)
+    ydi, xdi = patsy.incr_dbuilders(formula, chunks, eval_env=eval_env)
+
+    def blocks():
+        for chunk in chunks():
+            yield patsy.build_design_matrices([ydi, xdi], chunk, NA_action="drop")
+
+    model = ChunkedGLM(blocks, xdi.column_names, ydi.column_names[0], link=link)
+    return model.fit(maxiter=maxiter, tol=tol)
+
+
+def _add_gender_labels(chunk):
+    chunk = chunk.copy()
+    chunk["RIAGENDRx"] = chunk.RIAGENDR.replace({1: "Male", 2: "Female"})
+    return chunk
+
+
+def compare(n_cycles=3, n=5000, chunksize=2000, directory=None):
+    """
+    Check the chunked fits against statsmodels on synthetic stacked cycles.
+
+    Returns the largest absolute differences of the coefficients and
+    standard errors, and whether the summaries agree apart from the
+    date and time.  The synthetic files are written to `directory`,
+    or to a temporary directory that is removed afterwards.
+    """
+    if directory is None:
+        # The chunks are read from the files on each pass.
+        with tempfile.TemporaryDirectory() as tmp:
+            return compare(n_cycles, n, chunksize, tmp)
+
+    sources = []
+    for j in range(n_cycles):
+        fname = os.path.join(directory, "cycle%d.csv" % j)
+        synthetic_nhanes(n, seed=j).to_csv(fname, index=False)
+        sources.append(fname)
+
+    chunks = chunk_source(sources, transform=_add_gender_labels, chunksize=chunksize)
+    da = pd.concat(list(chunks()))
+
+    def body(smry):
+        # Drop the date and time rows of the top table.
+        return [line for line in str(smry).splitlines()
+                if not line.startswith(("Date:", "Time:"))]
+
+    rows = []
+    for formula in ["BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx",
+                    "BPXSY1 ~ bs(RIDAGEYR, 5) + BMXBMI + RIAGENDRx"]:
+        fits = [(sm.OLS.from_formula(formula, da).fit(), ols_from_chunks(formula, chunks)),
+                (sm.GLM.from_formula(formula, da).fit(), glm_from_chunks(formula, chunks))]
+        for ref, res in fits:
+            rows.append({"formula": formula, "model": ref.model.__class__.__name__,
+                         "params": np.abs(ref.params.values - res.params.values).max(),
+                         "bse": np.abs(ref.bse.values - res.bse.values).max(),
+                         "summary": body(ref.summary()) == body(res.summary())})
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--n", type=int, default=5000)
+    parser.add_argument("--chunksize", type=int, default=2000)
+    args = parser.parse_args()
+    print(compare(args.cycles, args.n, args.chunksize).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
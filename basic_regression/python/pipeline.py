@@ -0,0 +1,218 @@
+"""
+A small pipeline of named stages with on-disk memoization.
+
+Each stage is a function whose arguments name either other stages or
+pipeline parameters:
+
+    pipe = Pipeline(cache_dir="cache", source="nhanes.csv")
+
+    @pipe.stage
+    def raw(source):
+        return pd.read_csv(source)
+
+    @pipe.stage
+    def complete(raw):
+        return raw.dropna()
+
+    pipe.run()
+    print(pipe.report())
+
+A stage's result is stored on disk under a key that hashes the stage's
+source code, the values of the parameters it uses, and the contents
+(not the cache keys) of the results of the stages it depends on.  A
+stage therefore runs again only if its own code, its parameters, or
+the content of its inputs changed.  A parameter that names an existing
+file contributes the digest of the file's contents, so editing or
+replacing e.g. the CSV file invalidates the stages that read it.  If an upstream stage reruns but
+produces the same result, the stages below it are still cache hits.
+Cached results are only unpickled when they are needed.
+
+Stages that run are recorded as spans when `instrument.recording` is
+active.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+
+import pandas as pd
+
+from instrument import span
+from nhanes_data import file_digest
+
+
+def _digest(*parts):
+    h = hashlib.sha256()
+    for p in parts:
+        if isinstance(p, str):
+            p = p.encode("utf-8")
+        h.update(p)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class _Stage:
+
+    def __init__(self, name, func, args):
+        self.name = name
+        self.func = func
+        self.args = args
+        try:
+            self.source = inspect.getsource(func)
+        except (OSError, TypeError):
+            self.source = func.__code__.co_code.hex()
+
+
+class _Result:
+    """
+    A stage result that is read from disk on first use.
+    """
+
+    def __init__(self, path, digest, value=None, loaded=False):
+        self.path = path
+        self.digest = digest
+        self._value = value
+        self._loaded = loaded
+
+    @property
+    def value(self):
+        if not self._loaded:
+            with open(self.path, "rb") as f:
+                self._value = pickle.load(f)
+            self._loaded = True
+        return self._value
+
+
+class Pipeline:
+    """
+    A set of stages with memoized results.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Where stage results are stored.
+    params
+        Named parameters that stages may take as arguments.
+    """
+
+    def __init__(self, cache_dir, **params):
+        self.cache_dir = cache_dir
+        self.params = params
+        self._stages = {}
+        self._results = {}
+        self._report = []
+
+    def stage(self, func=None, name=None):
+        """
+        Register a function as a stage; usable as a decorator.
+        """
+        if func is None:
+            return lambda f: self.stage(f, name=name)
+        name = func.__name__ if name is None else name
+        args = list(inspect.signature(func).parameters)
+        self._stages[name] = _Stage(name, func, args)
+        return func
+
+    def _order(self, targets):
+        order, seen = [], set()
+
+        def visit(name, path):
+            if name in seen:
+                return
+            if name in path:
+                raise ValueError("stages form a cycle: %s" % " -> ".join(path + [name]))
+            if name not in self._stages:
+                raise KeyError("no stage or parameter named '%s'" % name)
+            for a in self._stages[name].args:
+                if a not in self.params:
+                    visit(a, path + [name])
+            seen.add(name)
+            order.append(name)
+
+        for t in targets:
+            visit(t, [])
+        return order
+
+    def _param_digest(self, value):
+        parts = [json.dumps(value, sort_keys=True, default=repr)]
+        if isinstance(value, (str, os.PathLike)) and os.path.isfile(value):
+            parts += ["file", file_digest(value, self.cache_dir)]
+        return _digest(*parts)
+
+    def _run_stage(self, stage, force):
+        parts = [stage.name, stage.source]
+        for a in stage.args:
+            if a in self.params:
+                parts += ["param", a, self._param_digest(self.params[a])]
+            else:
+                parts += ["stage", a, self._results[a].digest]
+        key = _digest(*parts)
+        path = os.path.join(self.cache_dir, "%s-%s.pkl" % (stage.name, key[0:16]))
+        dpath = path[0:-4] + ".digest"
+
+        t0 = time.perf_counter()
+        if os.path.exists(path) and os.path.exists(dpath) and not force:
+            with open(dpath) as f:
+                result = _Result(path, f.read().strip())
+            status = "hit"
+        else:
+            kwargs = {a: (self.params[a] if a in self.params else self._results[a].value)
+                      for a in stage.args}
+            with span("stage " + stage.name):
+                value = stage.func(**kwargs)
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            digest = _digest(data)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            with open(dpath, "w") as f:
+                f.write(digest)
+            result = _Result(path, digest, value, loaded=True)
+            status = "run"
+
+        self._results[stage.name] = result
+        self._report.append({"stage": stage.name, "status": status,
+                             "seconds": time.perf_counter() - t0})
+
+    def run(self, targets=None, force=()):
+        """
+        Bring the targets (by default, all stages) up to date.
+
+        Parameters
+        ----------
+        targets : list of str, optional
+            The stages to compute, along with the stages they depend on.
+        force : list of str
+            Stages to rerun even if their cached result is current.
+
+        Returns
+        -------
+        self
+        """
+        if targets is None:
+            targets = list(self._stages)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._results = {}
+        self._report = []
+        for name in self._order(targets):
+            self._run_stage(self._stages[name], name in force)
+        return self
+
+    def __getitem__(self, name):
+        """
+        The result of a stage from the latest run.
+        """
+        return self._results[name].value
+
+    def report(self):
+        """
+        Per-stage status ('hit' or 'run') and time of the latest run.
+
+        The time of a cache hit does not include unpickling the result,
+        which happens only when it is used.
+        """
+        return pd.DataFrame(self._report, columns=["stage", "status", "seconds"])
@@ -0,0 +1,227 @@
+"""
+A batching scoring service for exported models.
+
+Scoring records one at a time pays the fixed cost of a NumPy call per
+record, while a batch of a few hundred records costs little more than
+one.  `ScoringService` lets many concurrent callers submit single
+records with `await service.score(name, record)`; a batching task
+collects records until `max_batch` are waiting or `max_delay` seconds
+have passed since the first one, and scores each model's records with
+one `CompiledModel.predict_records` call in a thread pool, so the
+event loop keeps accepting requests while a batch is evaluated.
+
+A record that cannot be scored (an unknown level, a value outside the
+spline knots, a missing variable) fails alone: its batch is rescored
+record by record and only that caller gets the error.  Any other error
+while scoring a batch is raised to every caller in the batch, and
+callers still waiting when the service stops get a RuntimeError.
+
+`serve_http` exposes a service over a minimal HTTP/1.1 server built
+on asyncio streams, as a local stand-in for a real web framework:
+
+    POST /predict/<model>     {"RIDAGEYR": 50, ...}         -> {"prediction": 128.4}
+    POST /predict/<model>     {"records": [{...}, {...}]}   -> {"predictions": [...]}
+
+Example:
+
+    service = ScoringService({"spline": load_model("bp_spline.json")})
+    async with service:
+        server = await serve_http(service, "127.0.0.1", 8080)
+        await server.serve_forever()
+"""
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ScoringService:
+    """
+    Batch single-record scoring requests for a set of models.
+
+    Parameters
+    ----------
+    models : dict
+        CompiledModel instances by name.
+    max_batch : int
+        The largest number of records scored together.
+    max_delay : float
+        The longest time in seconds that a record waits for others
+        to join its batch.
+    n_threads : int
+        The number of threads that score batches.
+    """
+
+    def __init__(self, models, max_batch=256, max_delay=0.001, n_threads=2):
+        self.models = dict(models)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.n_threads = n_threads
+        self.batches = 0
+        self.records = 0
+        self._queue = None
+        self._task = None
+        self._executor = None
+        self._pending = set()
+        self._futures = set()
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(self.n_threads)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        for task in list(self._pending):
+            task.cancel()
+        await asyncio.gather(self._task, *self._pending, return_exceptions=True)
+        for fut in list(self._futures):
+            if not fut.done():
+                fut.set_exception(RuntimeError("the scoring service was stopped"))
+        # Threads still scoring a batch finish in the background; their
+        # results are no longer wanted.
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def score(self, name, record):
+        """
+        Return the prediction of model `name` for one record (a dict).
+        """
+        if name not in self.models:
+            raise KeyError("no model named %s" % name)
+        if self._task is None or self._task.done():
+            raise RuntimeError("the scoring service is not running")
+        fut = asyncio.get_running_loop().create_future()
+        self._futures.add(fut)
+        fut.add_done_callback(self._futures.discard)
+        await self._queue.put((name, record, fut))
+        return await fut
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _score_batch(self, model, records):
+        try:
+            return list(model.predict_records(records))
+        except (KeyError, TypeError, ValueError):
+            out = []
+            for r in records:
+                try:
+                    out.append(float(model.predict_records([r])[0]))
+                except (KeyError, TypeError, ValueError) as e:
+                    out.append(e)
+            return out
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            self.batches += 1
+            self.records += len(batch)
+            by_model = {}
+            for name, record, fut in batch:
+                by_model.setdefault(name, []).append((record, fut))
+            # Batches are scored concurrently, up to the number of threads,
+            # while the next batch is collected.
+            for name, items in by_model.items():
+                task = loop.create_task(self._dispatch(name, items))
+                self._pending.add(task)
+                task.add_done_callback(self._pending.discard)
+
+    async def _dispatch(self, name, items):
+        try:
+            preds = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._score_batch, self.models[name], [r for r, _ in items])
+        except Exception as e:
+            for _, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), p in zip(items, preds):
+            if fut.done():
+                continue
+            if isinstance(p, Exception):
+                fut.set_exception(p)
+            else:
+                fut.set_result(float(p))
+
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            500: "Internal Server Error"}
+
+
+async def _respond(writer, status, body):
+    data = json.dumps(body).encode()
+    writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n"
+                 b"Content-Length: %d\r\n\r\n" % (status, _REASONS[status].encode(), len(data)))
+    writer.write(data)
+    await writer.drain()
+
+
+async def _handle(service, reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            method, path, _ = line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                h = await reader.readline()
+                if h in (b"\r\n", b"\n", b""):
+                    break
+                k, v = h.decode("latin-1").split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            name = path[len("/predict/"):] if path.startswith("/predict/") else None
+            if name not in service.models:
+                await _respond(writer, 404, {"error": "no model at %s" % path})
+            elif method != "POST":
+                await _respond(writer, 405, {"error": "use POST"})
+            else:
+                try:
+                    req = json.loads(body)
+                    if isinstance(req, dict) and "records" in req:
+                        preds = await asyncio.gather(
+                            *[service.score(name, r) for r in req["records"]])
+                        await _respond(writer, 200, {"predictions": preds})
+                    else:
+                        await _respond(writer, 200, {"prediction": await service.score(name, req)})
+                except (KeyError, TypeError, ValueError) as e:
+                    await _respond(writer, 400, {"error": str(e)})
+                except Exception as e:
+                    await _respond(writer, 500, {"error": str(e)})
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_http(service, host="127.0.0.1", port=8080):
+    """
+    Serve a started ScoringService over HTTP; returns the asyncio server.
+    """
+    return await asyncio.start_server(lambda r, w: _handle(service, r, w), host, port)
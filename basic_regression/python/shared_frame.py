@@ -0,0 +1,190 @@
+"""
+Data frames in shared memory, for fitting models in several processes.
+
+Passing the analysis data frame to a `multiprocessing.Pool` pickles
+it for every task (or, with a pool initializer, once per worker), and
+each worker holds its own copy.  A `SharedFrame` copies the columns
+once into a `multiprocessing.shared_memory` block.  Pickling a
+`SharedFrame` sends only the name and layout of the block, and
+unpickling it in a worker attaches to the same memory, so that
+
+    with SharedFrame.from_frame(da) as shared:
+        with Pool(8) as pool:
+            results = pool.map(fit, [(shared, f) for f in formulas])
+
+    def fit(args):
+        shared, formula = args
+        return OLS.from_formula(formula, shared.frame()).fit().params
+
+costs about one copy of the data however many workers there are.
+`frame()` returns a DataFrame whose columns are read-only views of the
+shared block.
+
+Numeric columns are stored as they are, and categorical columns
+(e.g. from `load_nhanes(..., categorical=True)`) as their integer
+codes, with the categories kept in the layout.  String columns, such
+as RIAGENDRx in the workshop, are stored as categoricals with sorted
+levels, which patsy encodes the same way as the strings.
+
+The process that creates a `SharedFrame` owns the block and removes it
+when the `with` block ends, or on `unlink()`.  Frames returned by
+`frame()` must not be used after that.
+"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# SharedFrames attached in this process, by block name, so that the
+# handles unpickled for each task share one attachment and its frame.
+_ATTACHED = {}
+
+
+def _attach(layout):
+    shared = _ATTACHED.get(layout["name"])
+    if shared is None:
+        shared = SharedFrame(layout, shared_memory.SharedMemory(layout["name"]), owner=False)
+    return shared
+
+
+class SharedFrame:
+    """
+    A data frame whose columns are stored in shared memory.
+
+    Use `from_frame` to create one; instances passed to other
+    processes attach to the same memory.
+
+    Attributes
+    ----------
+    columns : list of str
+        The column names.
+    nrows : int
+        The number of rows.
+    nbytes : int
+        The size of the shared block.
+    """
+
+    def __init__(self, layout, shm, owner):
+        self._layout = layout
+        self._shm = shm
+        self._owner = owner
+        self._frame = None
+        self.columns = [c["name"] for c in layout["columns"]]
+        self.nrows = layout["nrows"]
+        self.nbytes = shm.size
+        _ATTACHED[layout["name"]] = self
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Copy a DataFrame into a new shared memory block.
+
+        Parameters
+        ----------
+        df : DataFrame
+            Columns must be numeric, boolean, categorical or strings.
+            The index is kept if it is numeric.
+        """
+        arrays, columns = [], []
+        for name in df.columns:
+            col = df[name]
+            categories = None
+            if isinstance(col.dtype, pd.CategoricalDtype):
+                categories = col.cat.categories
+                values = col.cat.codes.values
+            elif pd.api.types.is_object_dtype(col) or pd.api.types.is_string_dtype(col):
+                cat = col.astype("category")
+                categories = cat.cat.categories
+                values = cat.cat.codes.values
+            elif pd.api.types.is_numeric_dtype(col) or pd.api.types.is_bool_dtype(col):
+                values = col.to_numpy()
+            else:
+                raise ValueError("column %s has unsupported dtype %s" % (name, col.dtype))
+            arrays.append(np.ascontiguousarray(values))
+            columns.append({"name": name, "dtype": values.dtype.str,
+                            "categories": None if categories is None else list(categories),
+                            "ordered": bool(getattr(col.dtype, "ordered", False))})
+
+        index = df.index
+        if isinstance(index, pd.RangeIndex):
+            index_layout = {"range": (index.start, index.stop, index.step)}
+        elif pd.api.types.is_numeric_dtype(index):
+            index_layout = {"name": index.name, "dtype": index.dtype.str}
+            arrays.append(np.ascontiguousarray(index.values))
+        else:
+            raise ValueError("the index must be numeric")
+
+        # Each array starts at a multiple of 8 bytes.
+        offsets, size = [], 0
+        for a in arrays:
+            offsets.append(size)
+            size += -(-a.nbytes // 8) * 8
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for a, off in zip(arrays, offsets):
+            np.ndarray(a.shape, a.dtype, buffer=shm.buf, offset=off)[...] = a
+
+        for c, off in zip(columns, offsets):
+            c["offset"] = off
+        if "range" not in index_layout:
+            index_layout["offset"] = offsets[-1]
+        layout = {"name": shm.name, "nrows": len(df), "columns": columns,
+                  "index": index_layout}
+        return cls(layout, shm, owner=True)
+
+    def _array(self, dtype, offset):
+        a = np.ndarray(self.nrows, np.dtype(dtype), buffer=self._shm.buf, offset=offset)
+        a.flags.writeable = False
+        return a
+
+    def frame(self):
+        """
+        Return the data as a DataFrame of read-only views.
+
+        The same DataFrame is returned on each call within a process.
+        """
+        if self._frame is None:
+            data = {}
+            for c in self._layout["columns"]:
+                a = self._array(c["dtype"], c["offset"])
+                if c["categories"] is not None:
+                    a = pd.Categorical.from_codes(a, c["categories"], ordered=c["ordered"])
+                data[c["name"]] = a
+            ix = self._layout["index"]
+            if "range" in ix:
+                index = pd.RangeIndex(*ix["range"])
+            else:
+                index = pd.Index(self._array(ix["dtype"], ix["offset"]), name=ix["name"],
+                                 copy=False)
+            self._frame = pd.DataFrame(data, index=index, columns=self.columns, copy=False)
+        return self._frame
+
+    def __reduce__(self):
+        return _attach, (self._layout,)
+
+    def close(self):
+        """
+        Detach from the shared block in this process.
+        """
+        _ATTACHED.pop(self._layout["name"], None)
+        self._frame = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # Views of the block are still referenced; the mapping is
+            # released when they are garbage collected.
+            pass
+
+    def unlink(self):
+        """
+        Detach and remove the shared block; only the creator should call this.
+        """
+        self.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.unlink()
@@ -0,0 +1,276 @@
+"""
+Search over OLS specifications for a set of covariates.
+
+The workshop compares a handful of specifications by hand: linear
+age, quadratic age, `bs(RIDAGEYR, 5)`, and an age by gender
+interaction.  `candidate_formulas` lists specifications
+systematically: every subset of the covariates, each numeric
+covariate either linear or as a B-spline with one of several degrees
+of freedom, and optionally pairwise interactions.  `search` fits all
+of them and ranks them by AIC, BIC or cross-validated mean squared
+error.
+
+Fitting each candidate with `from_formula` would repeat the formula
+processing and the O(n p^2) factorization once per candidate.
+Instead, one design matrix is built for the union of all the terms,
+and each candidate is a subset of its columns.  For K-fold cross
+validation the cross products [X y]'[X y] within each fold are
+computed once from this matrix.  The full data fit of a candidate
+uses the sum over folds of its block of the cross products, and the
+fit without fold f uses that sum minus fold f's block, so a candidate
+costs O(K p^3) whatever the number of rows.  Candidates are scored in
+a process pool, and each worker receives the cross products once,
+when it starts.
+
+All candidates are fit to the same rows: those with no missing values
+in the outcome or any covariate of any candidate.  For the columns of
+a candidate to be the same as in its own design matrix, each formula
+must have an intercept, and each interaction must come with its main
+effects in linear form; the candidates from `candidate_formulas`
+satisfy this.
+
+    da = load_nhanes(NHANES_VARS, categorical=True)
+    res = search("BPXSY1", ["RIDAGEYR", "BMXBMI", "RIAGENDR", "C(RIDRETH1)"], da,
+                 splines=["RIDAGEYR", "BMXBMI"], rank_by="cv")
+"""
+
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import patsy
+
+CRITERIA = {"aic": "aic", "bic": "bic", "cv": "cv_mse"}
+
+
+def candidate_formulas(outcome, covariates, splines=(), spline_dfs=(4, 5, 6),
+                       max_interactions=1):
+    """
+    List OLS specifications over a set of covariates.
+
+    Parameters
+    ----------
+    outcome : str
+        The outcome variable.
+    covariates : list of str
+        Covariates, as they are written in a formula, e.g. "RIDAGEYR"
+        or "C(RIDRETH1)".
+    splines : list of str
+        The covariates that may also enter as `bs(x, df)`.
+    spline_dfs : list of int
+        The degrees of freedom of the spline forms.
+    max_interactions : int
+        The largest number of pairwise interactions in one
+        specification.  Interactions are formed between covariates
+        that are in the specification in linear form.
+
+    Returns
+    -------
+    A list of formulas, from smallest to largest.
+    """
+    for x in splines:
+        if x not in covariates:
+            raise ValueError("spline covariate %s is not one of the covariates" % x)
+
+    def forms(x):
+        return [x] + ["bs(%s, df=%d)" % (x, df) for df in spline_dfs] if x in splines else [x]
+
+    formulas = []
+    for size in range(1, len(covariates) + 1):
+        for subset in itertools.combinations(covariates, size):
+            for terms in itertools.product(*[forms(x) for x in subset]):
+                linear = [t for t in terms if t in covariates]
+                pairs = list(itertools.combinations(linear, 2))
+                for m in range(0, min(max_interactions, len(pairs)) + 1):
+                    for inter in itertools.combinations(pairs, m):
+                        rhs = list(terms) + ["%s:%s" % ab for ab in inter]
+                        formulas.append("%s ~ %s" % (outcome, " + ".join(rhs)))
+    return formulas
+
+
+def _solve(xtx, xty):
+    # Least squares from the normal equations, through the
+    # pseudo-inverse of X'X so that collinear candidates still fit.
+    evals, evecs = np.linalg.eigh(xtx)
+    tol = max(evals.max(), 0) * len(evals) * np.finfo(np.float64).eps
+    keep = evals > tol
+    params = evecs[:, keep] @ ((evecs[:, keep].T @ xty) / evals[keep])
+    return params, int(keep.sum())
+
+
+def _score(cols, G, nobs):
+    """
+    Score the candidate made of columns `cols` of the union design.
+
+    G holds the cross products of [X y] within each fold; the last
+    row and column are for y.
+    """
+    ix = np.append(cols, G.shape[1] - 1)
+    Gc = G[:, ix[:, None], ix[None, :]]
+    S = Gc.sum(0)
+
+    params, rank = _solve(S[:-1, :-1], S[:-1, -1])
+    ssr = max(S[-1, -1] - params @ S[:-1, -1], 0.)
+    llf = -nobs / 2 * (np.log(2 * np.pi) + np.log(ssr / nobs) + 1)
+
+    cv_mse = np.nan
+    if G.shape[0] > 1:
+        sse = 0.
+        for F in Gc:
+            T = S - F
+            b, _ = _solve(T[:-1, :-1], T[:-1, -1])
+            sse += F[-1, -1] - 2 * b @ F[:-1, -1] + b @ F[:-1, :-1] @ b
+        cv_mse = sse / nobs
+
+    return (rank, ssr, -2 * llf + 2 * rank, -2 * llf + np.log(nobs) * rank, cv_mse)
+
+
+# Per-process state, so that the cross products are sent to each
+# worker only once.
+_worker = {}
+
+
+def _init_worker(G, nobs):
+    _worker.update(G=G, nobs=nobs)
+
+
+def _score_block(block):
+    return [_score(cols, _worker["G"], _worker["nobs"]) for cols in block]
+
+
+def _union_design(formulas, data):
+    lhs = set()
+    rhs = []
+    for f in formulas:
+        desc = patsy.ModelDesc.from_formula(f)
+        lhs.add(tuple(desc.lhs_termlist))
+        if patsy.INTERCEPT not in desc.rhs_termlist:
+            raise ValueError("formula %s has no intercept" % f)
+        rhs.append(desc.rhs_termlist)
+    if len(lhs) != 1:
+        raise ValueError("all formulas must have the same outcome")
+
+    terms = []
+    for tl in rhs:
+        terms.extend(t for t in tl if t not in terms)
+    desc = patsy.ModelDesc(list(lhs.pop()), terms)
+    y, X = patsy.dmatrices(desc, data, eval_env=2, return_type="dataframe")
+
+    info = X.design_info
+    columns = []
+    for tl in rhs:
+        columns.append(np.concatenate([np.arange(X.shape[1])[info.slice(t)] for t in tl]))
+    return y, X, columns
+
+
+def search(outcome, covariates, data, splines=(), spline_dfs=(4, 5, 6),
+           max_interactions=1, formulas=None, cv=5, seed=0, rank_by="aic", n_workers=1,
+           chunksize=64):
+    """
+    Fit and rank OLS specifications.
+
+    Parameters
+    ----------
+    outcome, covariates, splines, spline_dfs, max_interactions
+        Passed to `candidate_formulas`.
+    data : DataFrame
+        The data.
+    formulas : list of str, optional
+        The candidates; if provided, the arguments above except
+        `data` are ignored.  See the module docstring for the
+        conditions they must satisfy.
+    cv : int or None
+        The number of cross-validation folds; None skips cross
+        validation.
+    seed : int
+        Seed for assigning rows to folds.
+    rank_by : str
+        'aic', 'bic' or 'cv'.
+    n_workers : int
+        The number of processes; None uses all available cores.
+    chunksize : int
+        The number of candidates in each task sent to a worker.
+
+    Returns
+    -------
+    A DataFrame with one row per candidate, sorted by `rank_by`,
+    with the `formula`, the number of parameters (`k`), the residual
+    sum of squares (`ssr`), `aic` and `bic` (as computed by
+    statsmodels), and the cross-validated mean squared prediction
+    error (`cv_mse`).
+    """
+    if rank_by not in CRITERIA:
+        raise ValueError("rank_by must be one of %s" % ", ".join(CRITERIA))
+    if rank_by == "cv" and cv is None:
+        raise ValueError("ranking by cv needs cv folds")
+    if formulas is None:
+        formulas = candidate_formulas(outcome, covariates, splines, spline_dfs,
+                                      max_interactions)
+
+    y, X, columns = _union_design(formulas, data)
+    A = np.column_stack([np.asarray(X, dtype=np.float64),
+                         np.asarray(y, dtype=np.float64).reshape(-1)])
+    nobs = A.shape[0]
+
+    # Every candidate has an intercept, so centering the other columns
+    # and scaling them to unit variance changes only the parameters,
+    # and keeps the cross products well conditioned.  y is centered
+    # but not scaled, so that the sums of squares are unchanged.
+    const = np.ptp(A[:, :-1], axis=0) == 0
+    center = np.where(np.append(const, False), 0., A.mean(0))
+    scale = np.append(np.where(const, 1., A[:, :-1].std(0)), 1.)
+    A = (A - center) / scale
+
+    nfold = 1 if cv is None else cv
+    folds = np.random.default_rng(seed).permutation(nobs) % nfold
+    G = np.empty((nfold, A.shape[1], A.shape[1]))
+    for f in range(nfold):
+        Af = A[folds == f]
+        G[f] = Af.T @ Af
+
+    blocks = [columns[i:i + chunksize] for i in range(0, len(columns), chunksize)]
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if n_workers == 1 or len(blocks) == 1:
+        scores = [_score(cols, G, nobs) for cols in columns]
+    else:
+        with ProcessPoolExecutor(n_workers, initializer=_init_worker,
+                                 initargs=(G, nobs)) as ex:
+            scores = [s for b in ex.map(_score_block, blocks) for s in b]
+
+    df = pd.DataFrame(scores, columns=["k", "ssr", "aic", "bic", "cv_mse"])
+    df.insert(0, "formula", formulas)
+    df.attrs["nobs"] = nobs
+    return df.sort_values(CRITERIA[rank_by], kind="stable").reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n", type=int, default=10000, help="rows of synthetic data")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--rank-by", default="cv", choices=list(CRITERIA))
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    from nhanes_data import NHANES_VARS, synthetic_nhanes
+
+    da = synthetic_nhanes(args.n)[NHANES_VARS].dropna()
+    da["RIAGENDRx"] = da.RIAGENDR.replace({1: "Male", 2: "Female"})
+    covariates = ["RIDAGEYR", "BMXBMI", "RIAGENDRx", "C(RIDRETH1)", "C(DMDEDUC2)"]
+
+    t0 = time.perf_counter()
+    res = search("BPXSY1", covariates, da, splines=["RIDAGEYR", "BMXBMI"],
+                 rank_by=args.rank_by, n_workers=args.workers)
+    t = time.perf_counter() - t0
+
+    print("%d specifications fit to %d rows in %.2f s" % (len(res), res.attrs["nobs"], t))
+    with pd.option_context("display.max_colwidth", 120, "display.width", 200):
+        print(res.head(args.top).to_string(float_format="%.4g"))
+
+
+if __name__ == "__main__":
+    main()
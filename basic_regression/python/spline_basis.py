@@ -0,0 +1,205 @@
+"""
+B-spline bases for discrete covariates, evaluated from a lookup table.
+
+In `BPXSY1 ~ bs(RIDAGEYR, 5) + BMXBMI + RIAGENDRx` the spline basis is
+evaluated by de Boor's algorithm at every row of the data, although
+age in years takes fewer than 100 distinct values.  A `SplineBasis`
+holds the knots of a basis, and when it is evaluated at integer
+values within the boundary knots it evaluates every integer in that
+range once, keeps the table, and then returns rows of the table.
+Other values are evaluated once per distinct value.
+
+Bases are cached by their knots and degree, so a fit, the predictions
+from the fit and a refit of a model with the same spline term share
+one table.  The cache keeps the `MAX_BASES` most recently used bases.
+
+In formulas use `bs_table` in place of `bs`:
+
+    model = sm.OLS.from_formula("BPXSY1 ~ bs_table(RIDAGEYR, 5) + BMXBMI + RIAGENDRx", da)
+
+It takes the same arguments as `bs`, places the knots in the same way
+and returns the same columns.  As with any function that is not
+built into patsy, `bs_table` must be in scope wherever the formula is
+evaluated, which includes unpickling the fitted model.
+
+`scan_spline_df` compares spline models for one covariate with several
+degrees of freedom.  The other covariates are factored once (see
+`nested_ols.NestedOLS`), and each candidate only adds its spline
+block to that factorization.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import patsy
+from patsy.splines import BS, _eval_bspline_basis
+
+from nested_ols import NestedOLS
+
+# The number of bases kept by `spline_basis`.
+MAX_BASES = 64
+
+# Tables spanning more integers than this are not built.
+MAX_TABLE = 10000
+
+
+def _flatten(x):
+    x = np.asarray(x, dtype=np.float64)
+    if x.ndim == 2 and x.shape[1] == 1:
+        x = x[:, 0]
+    if x.ndim != 1:
+        raise ValueError("input to a spline basis must be 1-d, or a 2-d column vector")
+    return x
+
+
+def bs_knots(x, df=None, knots=None, degree=3, include_intercept=False, lower_bound=None,
+             upper_bound=None):
+    """
+    Return all knots, including the repeated boundary knots, of `bs`.
+
+    The arguments are those of patsy's `bs`, and the knots are the ones
+    that `bs` would place for the data x.
+    """
+    bs = BS()
+    bs.memorize_chunk(_flatten(x), df=df, knots=knots, degree=degree,
+                      include_intercept=include_intercept, lower_bound=lower_bound,
+                      upper_bound=upper_bound)
+    bs.memorize_finish()
+    return bs._all_knots
+
+
+class SplineBasis:
+    """
+    A B-spline basis with fixed knots.
+
+    Use `spline_basis` to get a cached instance.
+
+    Parameters
+    ----------
+    knots : array_like
+        All knots, as returned by `bs_knots`.
+    degree : int
+        The degree of the spline.
+    include_intercept : bool
+        If False, the first basis function is dropped, as in `bs`.
+    """
+
+    def __init__(self, knots, degree=3, include_intercept=False):
+        self.knots = np.asarray(knots, dtype=np.float64)
+        self.degree = degree
+        self.include_intercept = include_intercept
+        self._lo = int(np.ceil(self.knots[0]))
+        self._hi = int(np.floor(self.knots[-1]))
+        self._table = None
+
+    @property
+    def df(self):
+        """
+        The number of columns of the basis.
+        """
+        return len(self.knots) - self.degree - 1 - (not self.include_intercept)
+
+    def _eval(self, x):
+        basis = _eval_bspline_basis(x, self.knots, self.degree)
+        if not self.include_intercept:
+            basis = basis[:, 1:]
+        return basis
+
+    def table(self):
+        """
+        Return the basis at the integers between the boundary knots.
+
+        Row j is the basis at the j-th integer, starting from the
+        smallest integer not below the lower boundary knot.
+        """
+        if self._table is None:
+            self._table = self._eval(np.arange(self._lo, self._hi + 1, dtype=np.float64))
+        return self._table
+
+    def __call__(self, x):
+        """
+        Evaluate the basis at x, returning an array with one row per value.
+        """
+        x = _flatten(x)
+        if len(x) == 0:
+            return np.empty((0, self.df))
+        xi = x.astype(np.int64)
+        if (self._hi - self._lo < MAX_TABLE and np.all(xi == x)
+                and xi.min() >= self._lo and xi.max() <= self._hi):
+            return self.table()[xi - self._lo]
+        u, inv = np.unique(x, return_inverse=True)
+        return self._eval(u)[inv.reshape(-1)]
+
+
+def spline_basis(knots, degree=3, include_intercept=False):
+    """
+    Return the cached `SplineBasis` with the given knots.
+    """
+    knots = np.asarray(knots, dtype=np.float64)
+    return _cached_basis(knots.tobytes(), int(degree), bool(include_intercept))
+
+
+@lru_cache(maxsize=MAX_BASES)
+def _cached_basis(knots, degree, include_intercept):
+    knots = np.frombuffer(knots, dtype=np.float64).copy()
+    return SplineBasis(knots, degree, include_intercept)
+
+
+class BSTable(BS):
+    """
+    patsy's `bs` stateful transform, evaluated by `spline_basis`.
+    """
+
+    def transform(self, x, df=None, knots=None, degree=3, include_intercept=False,
+                  lower_bound=None, upper_bound=None):
+        basis = spline_basis(self._all_knots, self._degree, include_intercept)(x)
+        if isinstance(x, (pd.Series, pd.DataFrame)):
+            basis = pd.DataFrame(basis, index=x.index)
+        return basis
+
+
+bs_table = patsy.stateful_transform(BSTable)
+
+
+def scan_spline_df(endog, x, dfs, exog=None, degree=3):
+    """
+    Compare OLS fits with spline bases of several degrees of freedom.
+
+    The models are endog ~ exog + bs(x, df) for each df in dfs.
+
+    Parameters
+    ----------
+    endog : array_like
+        The outcome.
+    x : array_like
+        The covariate that is modeled with a spline.
+    dfs : list of int
+        The degrees of freedom to compare.
+    exog : array_like, optional
+        The other covariates, including the intercept.  Defaults to
+        an intercept only.
+    degree : int
+        The degree of the splines.
+
+    Returns
+    -------
+    A DataFrame indexed by df with the number of parameters (`k`), the
+    residual sum of squares (`ssr`), and `aic` and `bic` as computed
+    by statsmodels.
+    """
+    x = _flatten(x)
+    if exog is None:
+        exog = np.ones((len(x), 1))
+    base = NestedOLS(np.asarray(endog, dtype=np.float64).reshape(-1), np.asarray(exog))
+    n, p = len(x), len(base.columns)
+
+    rows = []
+    for df in dfs:
+        basis = spline_basis(bs_knots(x, df, degree=degree), degree)
+        ssr = base.ssr_added(basis(x))
+        k = p + basis.df
+        llf = -n / 2 * (np.log(2 * np.pi) + np.log(ssr / n) + 1)
+        rows.append((df, k, ssr, -2 * llf + 2 * k, -2 * llf + np.log(n) * k))
+
+    return pd.DataFrame(rows, columns=["df", "k", "ssr", "aic", "bic"]).set_index("df")
@@ -0,0 +1,563 @@
+"""
+OLS fitted from sufficient statistics.
+
+Least squares estimates, standard errors, R^2, F tests and information
+criteria only depend on the data through the cross products X'X, X'y,
+y'y, the sum of y and the sample size.  These can be accumulated in a
+single pass over the data, possibly in chunks, using memory that
+scales with p^2 rather than with n.  `SuffStatOLS` fits a model from
+these quantities without ever forming the n-length fitted value or
+residual vectors.
+
+Fitted values and residuals (e.g. for a residuals versus fitted plot)
+are recomputed on request from the data and the coefficients.  The
+residual diagnostics in the summary table (omnibus, skew, kurtosis,
+Jarque-Bera) need a second pass over the data, which is done chunk by
+chunk when the data are available.  The Durbin-Watson statistic is
+obtained in the first pass from lag-one differences.
+
+    res = ols_from_formula("BPXSY1 ~ RIDAGEYR + RIAGENDRx", da)
+    res.rsquared       # no need for np.corrcoef(y, fittedvalues)**2
+    res.summary()
+"""
+
+import numpy as np
+import pandas as pd
+import patsy
+from scipy import stats
+
+
+class CrossProducts:
+    """
+    Accumulate the sufficient statistics for a linear regression.
+
+    Parameters
+    ----------
+    exog_names : list of str
+        Names of the columns of the design matrix.
+    endog_name : str
+        Name of the outcome.
+
+    Notes
+    -----
+    Besides X'X, X'y, y'y, sum(y) and n, the column sums, minima and
+    maxima of X are kept (to detect a constant), along with the
+    cross products of the lag-one differences of the rows, for the
+    Durbin-Watson statistic.  Accumulators for separate blocks of
+    rows can be combined with `merge`.
+    """
+
+    def __init__(self, exog_names, endog_name="y"):
+        p = len(exog_names)
+        self.exog_names = list(exog_names)
+        self.endog_name = endog_name
+        self.nobs = 0
+        self.xtx = np.zeros((p, p))
+        self.xty = np.zeros(p)
+        self.yty = 0.
+        self.ysum = 0.
+        self.xsum = np.zeros(p)
+        self.xmin = np.full(p, np.inf)
+        self.xmax = np.full(p, -np.inf)
+        self.dtd = np.zeros((p, p))
+        self.dtdy = np.zeros(p)
+        self.dyty = 0.
+        self._first = None
+        self._last = None
+
+    def update(self, endog, exog):
+        """
+        Add a block of rows.
+
+        Blocks must be added in row order for the Durbin-Watson
+        statistic to be correct.
+        """
+        y = np.asarray(endog, dtype=np.float64).reshape(-1)
+        X = np.asarray(exog, dtype=np.float64)
+        if X.shape[0] != y.shape[0]:
+            raise ValueError("endog and exog have different numbers of rows")
+        if y.shape[0] == 0:
+            return self
+
+        self.nobs += y.shape[0]
+        self.xtx += X.T @ X
+        self.xty += X.T @ y
+        self.yty += y @ y
+        self.ysum += y.sum()
+        self.xsum += X.sum(0)
+        self.xmin = np.minimum(self.xmin, X.min(0))
+        self.xmax = np.maximum(self.xmax, X.max(0))
+
+        # Lag-one differences, continuing from the previous block.
+        if self._last is not None:
+            X = np.vstack((self._last[1], X))
+            y = np.concatenate(([self._last[0]], y))
+        else:
+            self._first = (y[0], X[0, :].copy())
+        self._last = (y[-1], X[-1, :].copy())
+        self._add_diffs(np.diff(y), np.diff(X, axis=0))
+
+        return self
+
+    def _add_diffs(self, dy, dX):
+        self.dtd += dX.T @ dX
+        self.dtdy += dX.T @ dy
+        self.dyty += dy @ dy
+
+    def merge(self, other):
+        """
+        Add the statistics of `other`, whose rows follow those of self.
+        """
+        if other.exog_names != self.exog_names:
+            raise ValueError("cannot merge statistics for different design matrices")
+        if other.nobs == 0:
+            return self
+        for k in ("xtx", "xty", "yty", "ysum", "xsum", "dtd", "dtdy", "dyty"):
+            setattr(self, k, getattr(self, k) + getattr(other, k))
+        self.xmin = np.minimum(self.xmin, other.xmin)
+        self.xmax = np.maximum(self.xmax, other.xmax)
+        if self._last is not None:
+            self._add_diffs(np.atleast_1d(other._first[0] - self._last[0]),
+                            (other._first[1] - self._last[1])[None, :])
+        else:
+            self._first = other._first
+        self._last = other._last
+        self.nobs += other.nobs
+        return self
+
+
+def k_constant(xtx, xsum, nobs, xmin, xmax):
+    """
+    Return 1 if the design matrix has a constant and 0 otherwise.
+
+    As in statsmodels, the constant is either a constant nonzero
+    column, or implicit, e.g. a full set of dummy variables without an
+    intercept.  A column of ones is in the column space of X exactly
+    when regressing it on X leaves no residual sum of squares, which is
+    n - 1'X (X'X)^+ X'1 and only needs the cross products.
+
+    Parameters
+    ----------
+    xtx : ndarray
+        X'X.
+    xsum : ndarray
+        The column sums of X, X'1.
+    nobs : int
+        The number of rows of X.
+    xmin, xmax : ndarray
+        The column-wise minima and maxima of X.
+    """
+    if np.any((xmin == xmax) & (xmax != 0)):
+        return 1
+    if nobs == 0:
+        return 0
+    # Scale the columns to unit length so that the rank decision does
+    # not depend on the units of the variables.
+    d = np.sqrt(np.diag(xtx))
+    d[d == 0] = 1
+    evals, evecs = np.linalg.eigh(xtx / np.outer(d, d))
+    keep = evals > evals.max() * len(d) * np.finfo(np.float64).eps
+    u = evecs[:, keep].T @ (xsum / d)
+    ssr = nobs - (u**2 / evals[keep]).sum()
+    return int(ssr <= nobs * np.sqrt(np.finfo(np.float64).eps))
+
+
+def exog_k_constant(exog):
+    """
+    Return 1 if the design matrix `exog` has a constant, see `k_constant`.
+    """
+    X = np.asarray(exog, dtype=np.float64)
+    return k_constant(X.T @ X, X.sum(0), X.shape[0], X.min(0), X.max(0))
+
+
+class SuffStatOLS:
+    """
+    Ordinary least squares from accumulated cross products.
+
+    Parameters
+    ----------
+    cp : CrossProducts
+        The accumulated statistics.
+    data : callable, optional
+        A function with no arguments that returns an iterator over
+        (endog, exog) blocks of the data, in row order.  If provided,
+        fitted values, residuals and the residual diagnostics of the
+        summary can be computed on request.
+    """
+
+    def __init__(self, cp, data=None):
+        self.cp = cp
+        self.data = data
+
+    def fit(self):
+        """
+        Fit the model and return a `SuffStatOLSResults` instance.
+        """
+        return SuffStatOLSResults(self)
+
+
+def _skewtest(skew, n):
+    # D'Agostino's skewness test, as in scipy.stats.skewtest.
+    y = skew * np.sqrt(((n + 1) * (n + 3)) / (6.0 * (n - 2)))
+    beta2 = (3.0 * (n**2 + 27 * n - 70) * (n + 1) * (n + 3) /
+             ((n - 2.0) * (n + 5) * (n + 7) * (n + 9)))
+    w2 = -1 + np.sqrt(2 * (beta2 - 1))
+    delta = 1 / np.sqrt(0.5 * np.log(w2))
+    alpha = np.sqrt(2.0 / (w2 - 1))
+    y = np.where(y == 0, 1, y)
+    return delta * np.log(y / alpha + np.sqrt((y / alpha)**2 + 1))
+
+
+def _kurtosistest(kurt, n):
+    # Anscombe and Glynn's kurtosis test, as in scipy.stats.kurtosistest.
+    E = 3.0 * (n - 1) / (n + 1)
+    varb2 = 24.0 * n * (n - 2) * (n - 3) / ((n + 1) * (n + 1.) * (n + 3) * (n + 5))
+    x = (kurt - E) / np.sqrt(varb2)
+    sqrtbeta1 = (6.0 * (n * n - 5 * n + 2) / ((n + 7) * (n + 9)) *
+                 np.sqrt((6.0 * (n + 3) * (n + 5)) / (n * (n - 2) * (n - 3))))
+    A = 6.0 + 8.0 / sqrtbeta1 * (2.0 / sqrtbeta1 + np.sqrt(1 + 4.0 / (sqrtbeta1**2)))
+    term1 = 1 - 2 / (9.0 * A)
+    denom = 1 + x * np.sqrt(2 / (A - 4.0))
+    term2 = np.sign(denom) * np.where(denom == 0.0, np.nan,
+                                      np.power((1 - 2.0 / A) / np.abs(denom), 1 / 3.0))
+    return (term1 - term2) / np.sqrt(2 / (9.0 * A))
+
+
+class SuffStatOLSResults:
+    """
+    Results of an OLS fit from sufficient statistics.
+
+    The attribute names follow statsmodels' `RegressionResults`.
+    Quantities that need the residuals themselves are computed on
+    first access, with another pass over the data.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        cp = model.cp
+        self.nobs = float(cp.nobs)
+        self.exog_names = cp.exog_names
+        self.endog_name = cp.endog_name
+        self.use_t = True
+        self.cov_type = "nonrobust"
+
+        # The eigendecomposition of X'X gives the (pseudo-)inverse,
+        # the rank and the condition number of X.
+        evals, evecs = np.linalg.eigh(cp.xtx)
+        tol = evals.max() * max(cp.xtx.shape) * np.finfo(np.float64).eps
+        keep = evals > tol
+        self.rank = int(keep.sum())
+        self.normalized_cov_params = (evecs[:, keep] / evals[keep]) @ evecs[:, keep].T
+        self.eigenvals = np.sort(np.clip(evals, 0, None))[::-1]
+
+        params = self.normalized_cov_params @ cp.xty
+        self.params = pd.Series(params, index=self.exog_names)
+
+        self.k_constant = k_constant(cp.xtx, cp.xsum, cp.nobs, cp.xmin, cp.xmax)
+        self.df_model = float(self.rank - self.k_constant)
+        self.df_resid = self.nobs - self.rank
+
+        # ssr = y'y - 2b'X'y + b'X'Xb, which is y'y - b'X'y at the solution.
+        self.ssr = max(cp.yty - params @ cp.xty, 0.)
+        self.uncentered_tss = cp.yty
+        self.centered_tss = cp.yty - cp.ysum**2 / self.nobs
+        self.scale = self.ssr / self.df_resid
+        self._resid_moments = None
+
+    @property
+    def condition_number(self):
+        return np.sqrt(self.eigenvals[0] / self.eigenvals[-1])
+
+    @property
+    def ess(self):
+        if self.k_constant:
+            return self.centered_tss - self.ssr
+        return self.uncentered_tss - self.ssr
+
+    @property
+    def rsquared(self):
+        if self.k_constant:
+            return 1 - self.ssr / self.centered_tss
+        return 1 - self.ssr / self.uncentered_tss
+
+    @property
+    def rsquared_adj(self):
+        return 1 - (np.divide(self.nobs - self.k_constant, self.df_resid)
+                    * (1 - self.rsquared))
+
+    @property
+    def fvalue(self):
+        return (self.ess / self.df_model) / (self.ssr / self.df_resid)
+
+    @property
+    def f_pvalue(self):
+        return stats.f.sf(self.fvalue, self.df_model, self.df_resid)
+
+    @property
+    def llf(self):
+        nobs2 = self.nobs / 2.0
+        return -nobs2 * (np.log(2 * np.pi) + np.log(self.ssr / self.nobs) + 1)
+
+    @property
+    def aic(self):
+        return -2 * self.llf + 2 * (self.df_model + self.k_constant)
+
+    @property
+    def bic(self):
+        return -2 * self.llf + np.log(self.nobs) * (self.df_model + self.k_constant)
+
+    def cov_params(self):
+        c = self.scale * self.normalized_cov_params
+        return pd.DataFrame(c, index=self.exog_names, columns=self.exog_names)
+
+    @property
+    def bse(self):
+        return pd.Series(np.sqrt(self.scale * np.diag(self.normalized_cov_params)),
+                         index=self.exog_names)
+
+    @property
+    def tvalues(self):
+        return self.params / self.bse
+
+    @property
+    def pvalues(self):
+        return pd.Series(2 * stats.t.sf(np.abs(self.tvalues), self.df_resid),
+                         index=self.exog_names)
+
+    def conf_int(self, alpha=0.05):
+        q = stats.t.ppf(1 - alpha / 2, self.df_resid)
+        return pd.DataFrame({0: self.params - q * self.bse, 1: self.params + q * self.bse})
+
+    @property
+    def durbin_watson(self):
+        cp, b = self.model.cp, self.params.values
+        num = cp.dyty - 2 * b @ cp.dtdy + b @ cp.dtd @ b
+        return num / self.ssr
+
+    def _blocks(self):
+        if self.model.data is None:
+            raise ValueError("the data are needed, but were not provided to the model")
+        return self.model.data()
+
+    def predict(self, exog):
+        """
+        Return the fitted values for a design matrix.
+        """
+        return np.asarray(exog, dtype=np.float64) @ self.params.values
+
+    @property
+    def fittedvalues(self):
+        """
+        The fitted values, computed from the data on each access.
+        """
+        return np.concatenate([self.predict(X) for _, X in self._blocks()])
+
+    @property
+    def resid(self):
+        """
+        The residuals, computed from the data on each access.
+        """
+        return np.concatenate([np.asarray(y, dtype=np.float64).reshape(-1) - self.predict(X)
+                               for y, X in self._blocks()])
+
+    def resid_moments(self):
+        """
+        Return the skewness and (non-excess) kurtosis of the residuals.
+
+        The moments are accumulated blockwise, so the residual vector
+        is never held in memory.
+        """
+        if self._resid_moments is None:
+            # The residuals have mean zero only if there is an intercept.
+            s = np.zeros(5)
+            for y, X in self._blocks():
+                r = np.asarray(y, dtype=np.float64).reshape(-1) - self.predict(X)
+                s += [r.size, r.sum(), (r**2).sum(), (r**3).sum(), (r**4).sum()]
+            n, m = s[0], s[1] / s[0]
+            m2 = s[2] / n - m**2
+            m3 = s[3] / n - 3 * m * s[2] / n + 2 * m**3
+            m4 = s[4] / n - 4 * m * s[3] / n + 6 * m**2 * s[2] / n - 3 * m**4
+            self._resid_moments = (m3 / m2**1.5, m4 / m2**2)
+        return self._resid_moments
+
+    def jarque_bera(self):
+        """
+        Return the Jarque-Bera statistic, its p-value, skew and kurtosis.
+        """
+        skew, kurt = self.resid_moments()
+        jb = (self.nobs / 6.0) * (skew**2 + (1 / 4.0) * (kurt - 3)**2)
+        return jb, stats.chi2.sf(jb, 2), skew, kurt
+
+    def omni_normtest(self):
+        """
+        Return D'Agostino's omnibus normality test and its p-value.
+        """
+        skew, kurt = self.resid_moments()
+        k2 = _skewtest(skew, self.nobs)**2 + _kurtosistest(kurt, self.nobs)**2
+        return k2, stats.chi2.sf(k2, 2)
+
+    def summary(self, yname=None, xname=None, title=None, alpha=0.05, diagnostics=None):
+        """
+        Summarize the regression results, as `RegressionResults.summary`.
+
+        Parameters
+        ----------
+        diagnostics : bool, optional
+            Whether to include the residual normality diagnostics,
+            which need another pass over the data.  By default they
+            are included when the data are available.
+        """
+        from statsmodels.iolib.summary import Summary
+
+        if yname is None:
+            yname = self.endog_name
+        if xname is None:
+            xname = self.exog_names
+        if title is None:
+            title = "OLS Regression Results"
+        if diagnostics is None:
+            diagnostics = self.model.data is not None
+
+        rsquared_type = "" if self.k_constant else " (uncentered)"
+        top_left = [
+            ("Dep. Variable:", None),
+            ("Model:", ["OLS"]),
+            ("Method:", ["Least Squares"]),
+            ("Date:", None),
+            ("Time:", None),
+            ("No. Observations:", None),
+            ("Df Residuals:", None),
+            ("Df Model:", None),
+            ("Covariance Type:", [self.cov_type]),
+        ]
+        top_right = [
+            ("R-squared" + rsquared_type + ":", ["%#8.3f" % self.rsquared]),
+            ("Adj. R-squared" + rsquared_type + ":", ["%#8.3f" % self.rsquared_adj]),
+            ("F-statistic:", ["%#8.4g" % self.fvalue]),
+            ("Prob (F-statistic):", ["%#6.3g" % self.f_pvalue]),
+            ("Log-Likelihood:", None),
+            ("AIC:", ["%#8.4g" % self.aic]),
+            ("BIC:", ["%#8.4g" % self.bic]),
+        ]
+
+        diagn_left = []
+        diagn_right = [("Durbin-Watson:", ["%#8.3f" % self.durbin_watson])]
+        if diagnostics:
+            jb, jbpv, skew, kurt = self.jarque_bera()
+            omni, omnipv = self.omni_normtest()
+            diagn_left = [
+                ("Omnibus:", ["%#6.3f" % omni]),
+                ("Prob(Omnibus):", ["%#6.3f" % omnipv]),
+                ("Skew:", ["%#6.3f" % skew]),
+                ("Kurtosis:", ["%#6.3f" % kurt]),
+            ]
+            diagn_right += [
+                ("Jarque-Bera (JB):", ["%#8.3f" % jb]),
+                ("Prob(JB):", ["%#8.3g" % jbpv]),
+            ]
+        diagn_right.append(("Cond. No.", ["%#8.3g" % self.condition_number]))
+        diagn_left += [("", [""])] * (len(diagn_right) - len(diagn_left))
+
+        smry = Summary()
+        smry.add_table_2cols(self, gleft=top_left, gright=top_right,
+                             yname=yname, xname=xname, title=title)
+        smry.add_table_params(self, yname=yname, xname=xname, alpha=alpha,
+                              use_t=self.use_t)
+        smry.add_table_2cols(self, gleft=diagn_left, gright=diagn_right,
+                             yname=yname, xname=xname, title="")
+
+        etext = []
+        if not self.k_constant:
+            etext.append("R² is computed without centering (uncentered) since the "
+                         "model does not contain a constant.")
+        etext.append("Standard Errors assume that the covariance matrix of the "
+                     "errors is correctly specified.")
+        if self.eigenvals[-1] < 1e-10:
+            etext.append("The smallest eigenvalue is %6.3g. This might indicate that "
+                         "there are\nstrong multicollinearity problems or that the "
+                         "design matrix is singular." % self.eigenvals[-1])
+        elif self.condition_number > 1000:
+            etext.append("The condition number is large, %6.3g. This might indicate "
+                         "that there are\nstrong multicollinearity or other numerical "
+                         "problems." % self.condition_number)
+        if not diagnostics:
+            etext.append("Fitted from sufficient statistics; residual normality "
+                         "diagnostics were not computed.")
+        etext = ["[%d] %s" % (i + 1, t) for i, t in enumerate(etext)]
+        etext.insert(0, "Notes:")
+        smry.add_extra_txt(etext)
+        return smry
+
+
+def _slices(n, chunksize):
+    for i in range(0, n, chunksize):
+        yield slice(i, min(i + chunksize, n))
+
+
+def ols_from_chunks(formula, chunks, eval_env=0):
+    """
+    Fit an OLS model from a formula, reading the data in chunks.
+
+    Parameters
+    ----------
+    formula : str
+        A patsy formula.
+    chunks : callable
+        A function with no arguments that returns a new iterator over
+        the data, as DataFrames of consecutive rows.  It is called once
+        for each pass that stateful transforms need (e.g. to place the
+        knots of `bs`), once to accumulate the cross products, and once
+        more whenever residuals are requested from the results.
+    eval_env : int or patsy.EvalEnvironment
+        Where to look up names in the formula, as in `patsy.dmatrices`.
+
+    Returns
+    -------
+    A SuffStatOLSResults instance.
+    """
+    eval_env = patsy.EvalEnvironment.capture(eval_env, reference=1)
+    ydi, xdi = patsy.incr_dbuilders(formula, chunks, eval_env=eval_env)
+
+    def blocks():
+        for chunk in chunks():
+            yield patsy.build_design_matrices([ydi, xdi], chunk, NA_action="drop")
+
+    cp = CrossProducts(xdi.column_names, ydi.column_names[0])
+    for y, X in blocks():
+        cp.update(y, X)
+
+    return SuffStatOLS(cp, data=blocks).fit()
+
+
+def ols_from_formula(formula, data, chunksize=100000, eval_env=0):
+    """
+    Fit an OLS model from a formula using sufficient statistics.
+
+    The design matrix is built and reduced to cross products
+    `chunksize` rows at a time, so the full n x p design matrix is
+    never held in memory.  Stateful transforms such as `bs` or
+    `center` are fit on the full data first, as by `from_formula`.
+
+    Parameters
+    ----------
+    formula : str
+        A patsy formula.
+    data : DataFrame
+        The data.
+    chunksize : int
+        The number of rows processed at a time.
+
+    Returns
+    -------
+    A SuffStatOLSResults instance.  Its fitted values, residuals and
+    residual diagnostics are computed from `data` when requested, so
+    `data` should not be changed while the results are in use.
+    """
+    eval_env = patsy.EvalEnvironment.capture(eval_env, reference=1)
+    n = data.shape[0]
+
+    def chunks():
+        for s in _slices(n, chunksize):
+            yield data.iloc[s]
+
+    return ols_from_chunks(formula, chunks, eval_env)
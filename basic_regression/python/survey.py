@@ -0,0 +1,371 @@
+"""
+Survey-weighted regression with design-based standard errors.
+
+NHANES is a stratified multistage sample: in each stratum (SDMVSTRA)
+two primary sampling units (SDMVPSU) are drawn, and each person has a
+sampling weight (WTMEC2YR for the exam variables).  `nhanes_ols.py`
+ignores this.  Here the coefficients are estimated by weighted least
+squares with the sampling weights, and their variance is estimated in
+one of three ways:
+
+    'taylor'     linearization: the PSU totals of the estimating
+                 function w_i x_i e_i are compared within strata
+    'jackknife'  delete-one-PSU jackknife (JKn)
+    'brr'        balanced repeated replication, with Fay's adjustment
+                 if `fay` > 0; requires two PSUs per stratum
+
+A replicate changes the weights of whole PSUs by a factor, so its
+cross products are a combination of per-PSU cross products:
+
+    X' W_r X = sum_g f_rg (X_g' W X_g),
+
+where f_rg is the factor of replicate r for PSU g.  All replicate fits
+are therefore obtained with one product of the R x G factor matrix and
+the G x p(p+1)/2 matrix of per-PSU cross products, followed by a
+batched p x p solve, instead of R weighted `fit()` calls.  For
+replicate weights supplied with a data file, `replicate_wls` solves all
+replicates in blocks of rows in the same way.
+
+Inference uses the t distribution with (number of PSUs - number of
+strata) degrees of freedom.
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.linalg import hadamard
+
+from bootstrap import _products
+from design_cache import dmatrices_rows
+
+
+class SurveyDesign:
+    """
+    A stratified, clustered sample with weights.
+
+    Parameters
+    ----------
+    weights : array_like
+        The sampling weights.
+    strata : array_like, optional
+        The stratum of each observation; one stratum if not given.
+    psu : array_like, optional
+        The primary sampling unit of each observation, within its
+        stratum.  If not given, each observation is its own PSU.
+    """
+
+    def __init__(self, weights, strata=None, psu=None):
+        self.weights = np.asarray(weights, dtype=np.float64).reshape(-1)
+        n = len(self.weights)
+        if strata is None:
+            strata = np.zeros(n, dtype=np.int64)
+        if psu is None:
+            psu = np.arange(n)
+        strata, psu = np.asarray(strata), np.asarray(psu)
+        if len(strata) != n or len(psu) != n:
+            raise ValueError("weights, strata and psu have different lengths")
+
+        # Number the PSUs 0, ..., G-1 over all strata.
+        codes, first = np.unique(np.column_stack((pd.factorize(strata)[0],
+                                                  pd.factorize(psu)[0])),
+                                 axis=0, return_inverse=True)[0:2]
+        self.cluster = first.reshape(-1)
+        self.cluster_stratum = codes[:, 0]
+        self.n_psu = len(codes)
+        self.n_strata = len(np.unique(self.cluster_stratum))
+
+    @classmethod
+    def from_frame(cls, data, weights="WTMEC2YR", strata="SDMVSTRA", psu="SDMVPSU"):
+        """
+        Create a design from the columns of a data frame.
+        """
+        return cls(data[weights], None if strata is None else data[strata],
+                   None if psu is None else data[psu])
+
+    @property
+    def df(self):
+        """
+        The degrees of freedom for design-based inference.
+        """
+        return self.n_psu - self.n_strata
+
+    def replicate_factors(self, method="jackknife", fay=0.0):
+        """
+        Return the PSU weight factors of the replicates.
+
+        Returns
+        -------
+        F : ndarray
+            R x G; replicate r multiplies the weights in PSU g by F[r, g].
+        scale : ndarray
+            The variance is sum_r scale[r] (b_r - b)(b_r - b)'.
+        """
+        G, h = self.n_psu, self.cluster_stratum
+        nh = np.bincount(h)[h]
+        if method == "jackknife":
+            if np.any(nh < 2):
+                raise ValueError("the jackknife needs at least two PSUs per stratum")
+            F = np.ones((G, G))
+            same = h[:, None] == h[None, :]
+            F[same] = np.broadcast_to((nh / (nh - 1))[:, None], (G, G))[same]
+            F[np.arange(G), np.arange(G)] = 0
+            return F, (nh - 1) / nh
+        if method == "brr":
+            if np.any(nh != 2):
+                raise ValueError("BRR needs exactly two PSUs per stratum")
+            H = self.n_strata
+            R = 1 << int(np.ceil(np.log2(H + 1)))
+            # Column 0 of a Sylvester Hadamard matrix is constant and
+            # is not used.
+            had = hadamard(R)[:, 1:H + 1]
+            first = np.zeros(G, dtype=bool)
+            first[np.unique(h, return_index=True)[1]] = True
+            sign = np.where(first, 1, -1)[None, :] * had[:, h]
+            F = np.where(sign > 0, 2 - fay, fay)
+            return F, np.full(R, 1 / (R * (1 - fay)**2))
+        raise ValueError("unknown replication method '%s'" % method)
+
+    def replicate_weights(self, method="jackknife", fay=0.0):
+        """
+        Return the n x R matrix of replicate weights.
+        """
+        F, _ = self.replicate_factors(method, fay)
+        return self.weights[:, None] * F.T[self.cluster, :]
+
+
+def _unpack(S, p):
+    """
+    Split rows of summed products into X'WX (R x p x p) and X'Wy (R x p).
+    """
+    iu = np.triu_indices(p)
+    m = len(iu[0])
+    xtx = np.empty((S.shape[0], p, p))
+    xtx[:, iu[0], iu[1]] = S[:, 0:m]
+    xtx[:, iu[1], iu[0]] = S[:, 0:m]
+    return xtx, S[:, m:]
+
+
+def _solve(S, p):
+    xtx, xty = _unpack(S, p)
+    return np.linalg.solve(xtx, xty[:, :, None])[:, :, 0]
+
+
+def replicate_wls(endog, exog, repweights, block_size=50000):
+    """
+    Weighted least squares coefficients for many weight vectors.
+
+    Parameters
+    ----------
+    endog : array_like
+        The outcome.
+    exog : array_like
+        The design matrix.
+    repweights : array_like
+        n x R, one column of weights per replicate.
+    block_size : int
+        The number of rows processed at a time.
+
+    Returns
+    -------
+    An R x p array of coefficients.
+    """
+    y = np.asarray(endog, dtype=np.float64).reshape(-1)
+    X = np.asarray(exog, dtype=np.float64)
+    W = np.asarray(repweights, dtype=np.float64)
+    p = X.shape[1]
+    S = 0
+    for i in range(0, len(y), block_size):
+        s = slice(i, i + block_size)
+        S = S + W[s, :].T @ _products(y[s], X[s, :])
+    return _solve(np.atleast_2d(S), p)
+
+
+class SurveyResults:
+    """
+    Survey-weighted regression coefficients and their design-based variance.
+
+    Attributes
+    ----------
+    params : Series
+        The weighted least squares coefficients.
+    df_resid : int
+        The design degrees of freedom.
+    variance : str
+        How the variance was estimated.
+    replicates : DataFrame or None
+        The replicate coefficients, for replication methods.
+    """
+
+    def __init__(self, params, cov, df_resid, variance, replicates=None):
+        self.params = params
+        self._cov = cov
+        self.df_resid = df_resid
+        self.variance = variance
+        self.replicates = replicates
+
+    def cov_params(self):
+        return self._cov
+
+    @property
+    def bse(self):
+        return pd.Series(np.sqrt(np.diag(self._cov.values)), index=self.params.index)
+
+    @property
+    def tvalues(self):
+        return self.params / self.bse
+
+    @property
+    def pvalues(self):
+        return pd.Series(2 * stats.t.sf(np.abs(self.tvalues), self.df_resid),
+                         index=self.params.index)
+
+    def conf_int(self, alpha=0.05):
+        q = stats.t.ppf(1 - alpha / 2, self.df_resid)
+        return pd.DataFrame({0: self.params - q * self.bse, 1: self.params + q * self.bse})
+
+    def summary_frame(self, alpha=0.05):
+        """
+        Return a table of coefficients, standard errors, tests and intervals.
+        """
+        ci = self.conf_int(alpha)
+        return pd.DataFrame({"coef": self.params, "std err": self.bse, "t": self.tvalues,
+                             "P>|t|": self.pvalues, "[%g" % (alpha / 2): ci[0],
+                             "%g]" % (1 - alpha / 2): ci[1]})
+
+
+def survey_wls(endog, exog, design, variance="taylor", fay=0.0):
+    """
+    Fit a survey-weighted linear regression.
+
+    Parameters
+    ----------
+    endog : array_like
+        The outcome.
+    exog : array_like
+        The design matrix.  Pandas objects are recommended so that the
+        results carry variable names.
+    design : SurveyDesign
+        The sample design of the rows.
+    variance : str
+        'taylor', 'jackknife' or 'brr', see the module docstring.
+    fay : float
+        Fay's factor for BRR; 0 gives classical BRR.
+
+    Returns
+    -------
+    A SurveyResults instance.
+    """
+    names = getattr(exog, "columns", None)
+    y = np.asarray(endog, dtype=np.float64).reshape(-1)
+    X = np.asarray(exog, dtype=np.float64)
+    p = X.shape[1]
+    if names is None:
+        names = ["x%d" % j for j in range(p)]
+    if len(y) != len(design.weights):
+        raise ValueError("the design has %d rows, the data have %d"
+                         % (len(design.weights), len(y)))
+    w, g, G = design.weights, design.cluster, design.n_psu
+
+    # Weighted cross products summed within PSUs.
+    Z = _products(y, X) * w[:, None]
+    S = np.stack([np.bincount(g, Z[:, j], G) for j in range(Z.shape[1])], axis=1)
+    params = _solve(S.sum(0)[None, :], p)[0]
+
+    replicates = None
+    if variance == "taylor":
+        xtx, _ = _unpack(S.sum(0)[None, :], p)
+        ainv = np.linalg.inv(xtx[0])
+        u = X * (w * (y - X @ params))[:, None]
+        zt = np.stack([np.bincount(g, u[:, j], G) for j in range(p)], axis=1)
+        # Center the PSU totals within strata.
+        h = design.cluster_stratum
+        nh = np.bincount(h)
+        zbar = np.stack([np.bincount(h, zt[:, j]) for j in range(p)], axis=1) / nh[:, None]
+        d = zt - zbar[h]
+        f = (nh / np.maximum(nh - 1, 1))[h]
+        meat = (d * f[:, None]).T @ d
+        cov = ainv @ meat @ ainv
+    else:
+        F, scale = design.replicate_factors(variance, fay)
+        rep = _solve(F @ S, p)
+        e = rep - params
+        cov = (e * scale[:, None]).T @ e
+        replicates = pd.DataFrame(rep, columns=names)
+
+    return SurveyResults(pd.Series(params, index=names),
+                         pd.DataFrame(cov, index=names, columns=names),
+                         design.df, variance, replicates)
+
+
+def survey_formula(formula, data, weights="WTMEC2YR", strata="SDMVSTRA", psu="SDMVPSU",
+                   variance="taylor", fay=0.0, cache=None):
+    """
+    Fit a survey-weighted linear regression from a formula.
+
+    Rows with missing values in the formula variables are dropped from
+    the estimates, as in `from_formula`, but the design (strata and
+    PSUs) of the full sample is kept: the dropped rows stay in their
+    PSUs with zero weight, so that the complete cases are treated as a
+    domain of the sample rather than as the sample.  See `survey_wls`
+    for the other arguments; `cache` is an optional `DesignCache` for
+    `data`.
+    """
+    y, X, rows = dmatrices_rows(formula, data, cache, eval_env=1)
+    design = SurveyDesign.from_frame(data, weights, strata, psu)
+    n = len(design.weights)
+    yf = np.zeros(n)
+    yf[rows] = y.values[:, 0]
+    xf = np.zeros((n, X.shape[1]))
+    xf[rows, :] = X.values
+    w = np.zeros(n)
+    w[rows] = design.weights[rows]
+    design.weights = w
+    return survey_wls(yf, pd.DataFrame(xf, columns=X.columns), design, variance, fay)
+
+
+def simulate(nrep=500, n_strata=15, n_per_psu=200, seed=0):
+    """
+    Compare the variance estimates to the variance over repeated samples.
+
+    Each sample has `n_strata` strata of two PSUs, a PSU random effect
+    in both the covariate and the outcome (so that the sample is
+    clustered), and unequal weights.  Returns, for each method, the
+    average estimated standard error of the slope, together with the
+    standard deviation of the slope over the samples.
+    """
+    rng = np.random.default_rng(seed)
+    n = n_strata * 2 * n_per_psu
+    strata = np.repeat(np.arange(n_strata), 2 * n_per_psu)
+    psu = np.tile(np.repeat([0, 1], n_per_psu), n_strata)
+    cluster = 2 * strata + psu
+
+    slopes, se = [], {"taylor": [], "jackknife": [], "brr": []}
+    for _ in range(nrep):
+        a, b = rng.normal(size=2 * n_strata), rng.normal(size=2 * n_strata)
+        x = a[cluster] + rng.normal(size=n)
+        w = rng.uniform(0.5, 2, size=n)
+        y = 1 + x + 0.5 * x * b[cluster] + b[cluster] + rng.normal(size=n)
+        X = np.column_stack((np.ones(n), x))
+        design = SurveyDesign(w, strata, psu)
+        for method in se:
+            r = survey_wls(y, X, design, method)
+            se[method].append(r.bse.iloc[1])
+        slopes.append(r.params.iloc[1])
+
+    out = {m: np.mean(v) for m, v in se.items()}
+    out["empirical"] = np.std(slopes, ddof=1)
+    return pd.Series(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nrep", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(simulate(args.nrep, seed=args.seed).to_string())
+
+
+if __name__ == "__main__":
+    main()
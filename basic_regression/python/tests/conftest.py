@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+# The workshop modules are run from basic_regression/python and import
+# each other by module name.
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+# A small file with the columns of the merged NHANES file, generated
+# with `synthetic_nhanes(200, seed=1)`.
+SAMPLE_CSV = os.path.join(HERE, "data", "nhanes_sample.csv")
+
+
+@pytest.fixture
+def sample_csv():
+    return SAMPLE_CSV
+
+
+@pytest.fixture
+def sample():
+    """
+    The complete cases of the sample file, with RIAGENDRx as in the workshop.
+    """
+    import pandas as pd
+
+    from nhanes_data import NHANES_VARS
+
+    da = pd.read_csv(SAMPLE_CSV)[NHANES_VARS].dropna()
+    da["RIAGENDRx"] = da.RIAGENDR.replace({1: "Male", 2: "Female"})
+    return da
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from statsmodels.genmod.generalized_linear_model import GLM
+from statsmodels.graphics import regressionplots
+from statsmodels.regression.linear_model import OLS
+
+from added_variable import added_variable_resids, partial_resids
+
+FORMULA = "BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx"
+
+
+def _fits(sample):
+    offset = 0.1 * sample.RIDAGEYR.values
+    return [OLS.from_formula(FORMULA, sample).fit(),
+            GLM.from_formula(FORMULA, sample).fit(),
+            GLM.from_formula(FORMULA, sample, offset=offset).fit()]
+
+
+@pytest.mark.parametrize("which", [0, 1, 2])
+def test_matches_refits(sample, which):
+    res = _fits(sample)[which]
+    R, E = added_variable_resids(res)
+    for k in R.columns:
+        if isinstance(res.model, GLM):
+            r, e = regressionplots.added_variable_resids(res, k)
+        else:
+            # statsmodels refits OLS models by formula without the term.
+            j = res.model.exog_names.index(k)
+            others = np.delete(res.model.exog, j, axis=1)
+            r = OLS(res.model.endog, others).fit().resid
+            e = OLS(res.model.exog[:, j], others).fit().resid
+        np.testing.assert_allclose(R[k], r, atol=1e-8)
+        np.testing.assert_allclose(E[k], e, atol=1e-8)
+
+
+def test_partial_resids_with_offset(sample):
+    res = _fits(sample)[2]
+    P = partial_resids(res)
+    b = res.params["BMXBMI"]
+    expected = res.resid_response + b * sample.BMXBMI.values
+    np.testing.assert_allclose(P["BMXBMI"], expected)
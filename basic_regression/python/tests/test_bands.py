@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from statsmodels.regression.linear_model import OLS
+from statsmodels.sandbox.predict_functional import predict_functional
+
+from bands import predict_functional_batch
+
+
+@pytest.fixture
+def centered(sample):
+    # RIDAGEYR has no missing values and an integer dtype, as in the
+    # real NHANES file.
+    da = sample.copy()
+    da["RIDAGEYR"] = da.RIDAGEYR.astype(np.int64)
+    da["RIDAGEYR_cen"] = da.RIDAGEYR - da.RIDAGEYR.mean()
+    return da
+
+
+@pytest.mark.parametrize("ci_method", ["pointwise", "simultaneous"])
+def test_matches_predict_functional(centered, ci_method):
+    result = OLS.from_formula("BPXSY1 ~ RIDAGEYR_cen*RIAGENDRx + BMXBMI", centered).fit()
+    values = {"BMXBMI": 25, "RIDRETH1": 1}
+    scenarios = [dict(values, RIAGENDRx=g) for g in ("Female", "Male")]
+    pred, cb, fvals = predict_functional_batch(result, "RIDAGEYR_cen", scenarios,
+                                               ci_method=ci_method)
+    for j, v in enumerate(scenarios):
+        p1, cb1, fv1 = predict_functional(result, "RIDAGEYR_cen", values=v,
+                                          ci_method=ci_method)
+        np.testing.assert_allclose(fvals, fv1)
+        np.testing.assert_allclose(pred[j], p1)
+        np.testing.assert_allclose(cb[j], cb1)
+
+
+def test_int_column_set_to_nan(centered):
+    # As in bands_interaction of nhanes_workflow.py.
+    result = OLS.from_formula("BPXSY1 ~ RIDAGEYR_cen*RIAGENDRx + BMXBMI", centered).fit()
+    values = {"BMXBMI": 25, "RIDAGEYR": np.nan}
+    scenarios = [dict(values, RIAGENDRx=g) for g in ("Female", "Male")]
+    pred, cb, _ = predict_functional_batch(result, "RIDAGEYR_cen", scenarios,
+                                           ci_method="simultaneous")
+    for j, v in enumerate(scenarios):
+        p1, cb1, _ = predict_functional(result, "RIDAGEYR_cen", values=v,
+                                        ci_method="simultaneous")
+        np.testing.assert_allclose(pred[j], p1)
+        np.testing.assert_allclose(cb[j], cb1)
+
+
+def test_int_column_in_formula(centered):
+    result = OLS.from_formula("BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx", centered).fit()
+    pred, _, _ = predict_functional_batch(result, "BMXBMI",
+                                          [{"RIDAGEYR": 50, "RIAGENDRx": "Female"}])
+    p1, _, _ = predict_functional(result, "BMXBMI",
+                                  values={"RIDAGEYR": 50, "RIAGENDRx": "Female"})
+    np.testing.assert_allclose(pred[0], p1)
+
+
+def test_unset_variable(centered):
+    result = OLS.from_formula("BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx", centered).fit()
+    with pytest.raises(ValueError, match="BMXBMI"):
+        predict_functional_batch(result, "RIDAGEYR",
+                                 [{"BMXBMI": 25, "RIAGENDRx": "Female"},
+                                  {"RIAGENDRx": "Male"}])
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+from statsmodels.regression.linear_model import OLS
+
+from batch_regression import fit_outcomes
+from nhanes_data import categorize
+
+RHS = "RIDAGEYR + BMXBMI + RIAGENDRx"
+
+
+def _check(df, da, outcome):
+    res = OLS.from_formula("%s ~ %s" % (outcome, RHS), da).fit()
+    sub = df[df.outcome == outcome].set_index("term")
+    np.testing.assert_allclose(sub.coef, res.params[sub.index])
+    np.testing.assert_allclose(sub.bse, res.bse[sub.index])
+    np.testing.assert_allclose(sub.rsquared, res.rsquared)
+    assert (sub.nobs == res.nobs).all()
+
+
+def test_matches_ols(sample):
+    da = sample.copy()
+    # A second outcome with a different pattern of missing values.
+    da["BPX2"] = da.BPXSY1 + da.BMXBMI
+    da.loc[da.index[0:10], "BPX2"] = np.nan
+    df = fit_outcomes(RHS, ["BPXSY1", "BPX2"], da)
+    _check(df, da, "BPXSY1")
+    _check(df, da, "BPX2")
+
+
+def test_strata(sample):
+    df = fit_outcomes(RHS, ["BPXSY1"], sample, by="RIDRETH1")
+    for key, g in sample.groupby("RIDRETH1"):
+        _check(df[df.RIDRETH1 == key], g, "BPXSY1")
+
+
+def test_categorical_strata_with_unobserved_levels(sample):
+    # DMDEDUC2 has levels 7 and 9 (refused, don't know) with no rows.
+    da = categorize(sample)
+    df = fit_outcomes(RHS, ["BPXSY1"], da, by="DMDEDUC2")
+    assert set(df.DMDEDUC2) == set(da.DMDEDUC2.unique())
+    assert np.isfinite(df.bse).all()
+
+
+def test_small_strata_skipped(sample):
+    da = sample.copy()
+    da["stratum"] = 0
+    da.loc[da.index[0:3], "stratum"] = 1
+    df = fit_outcomes(RHS, ["BPXSY1"], da, by="stratum")
+    assert list(df.stratum.unique()) == [0]
+    assert np.isfinite(df.bse).all()
+    assert isinstance(df, pd.DataFrame)
+
+
+def test_duplicate_index(sample):
+    # Stacked cycles have duplicate index labels.
+    da = pd.concat([sample, sample])
+    df = fit_outcomes(RHS, ["BPXSY1"], da, by="RIDRETH1")
+    for key, g in da.groupby("RIDRETH1"):
+        _check(df[df.RIDRETH1 == key], g.reset_index(drop=True), "BPXSY1")
+
+
+def test_implicit_constant(sample):
+    rhs = "C(RIDRETH1) + RIDAGEYR - 1"
+    df = fit_outcomes(rhs, ["BPXSY1"], sample)
+    res = OLS.from_formula("BPXSY1 ~ " + rhs, sample).fit()
+    np.testing.assert_allclose(df.rsquared, res.rsquared)
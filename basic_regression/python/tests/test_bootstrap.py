@@ -0,0 +1,37 @@
+import numpy as np
+import patsy
+
+import bootstrap
+from bootstrap import bootstrap_formula, bootstrap_ols
+
+FORMULA = "BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx"
+
+
+def test_replicates_are_weighted_fits(sample):
+    y, X = patsy.dmatrices(FORMULA, sample, return_type="dataframe")
+    res = bootstrap_ols(y, X, nrep=7, seed=3, block_size=7)
+
+    # Redraw the counts of the single block.
+    n = len(y)
+    rng = np.random.default_rng(np.random.SeedSequence(3).spawn(1)[0])
+    Xa, ya = X.values, y.values[:, 0]
+    for r in range(7):
+        w = np.bincount(rng.integers(0, n, n), minlength=n)
+        b = np.linalg.solve(Xa.T @ (w[:, None] * Xa), Xa.T @ (w * ya))
+        np.testing.assert_allclose(res.replicates.iloc[r], b, rtol=1e-8)
+
+
+def test_count_buffer_does_not_change_results(sample, monkeypatch):
+    y, X = patsy.dmatrices(FORMULA, sample, return_type="dataframe")
+    r1 = bootstrap_ols(y, X, nrep=50, seed=1, block_size=20)
+    # Room for three count vectors at a time.
+    monkeypatch.setattr(bootstrap, "COUNT_BUFFER_BYTES", 3 * 8 * len(y))
+    r2 = bootstrap_ols(y, X, nrep=50, seed=1, block_size=20)
+    np.testing.assert_allclose(r1.replicates.values, r2.replicates.values, rtol=1e-10)
+
+
+def test_workers_do_not_change_results(sample):
+    r1 = bootstrap_formula(FORMULA, sample, nrep=60, seed=2, block_size=25)
+    r2 = bootstrap_formula(FORMULA, sample, nrep=60, seed=2, block_size=25, n_workers=2)
+    np.testing.assert_allclose(r1.replicates.values, r2.replicates.values)
+    assert r1.replicates.shape == (60, 4)
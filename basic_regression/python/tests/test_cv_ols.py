@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from statsmodels.regression.linear_model import OLS
+
+from cv_ols import kfold, kfold_formula, loocv, loocv_formula
+
+FORMULA = "BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx"
+
+
+@pytest.fixture
+def design(sample):
+    model = OLS.from_formula(FORMULA, sample)
+    return model.endog, model.exog
+
+
+def _refit_resid(y, X, folds):
+    resid = np.empty_like(y)
+    for f in np.unique(folds):
+        out = folds == f
+        b = OLS(y[~out], X[~out]).fit().params
+        resid[out] = y[out] - X[out] @ b
+    return resid
+
+
+def test_loocv_matches_refits(design):
+    y, X = design
+    cv = loocv(y, X)
+    np.testing.assert_allclose(cv.resid, _refit_resid(y, X, np.arange(len(y))))
+    np.testing.assert_allclose(cv.press, (cv.resid**2).sum())
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_kfold_matches_refits(design, n_workers):
+    y, X = design
+    cv = kfold(y, X, k=5, seed=3, n_workers=n_workers)
+    assert len(np.unique(cv.folds)) == 5
+    np.testing.assert_allclose(cv.resid, _refit_resid(y, X, cv.folds))
+
+
+def test_kfold_labels(sample, design):
+    y, X = design
+    cv = kfold(y, X, folds=sample.RIDRETH1.values)
+    np.testing.assert_allclose(cv.resid, _refit_resid(y, X, sample.RIDRETH1.values))
+    assert len(cv.fold_mse()) == sample.RIDRETH1.nunique()
+
+
+def test_formula(sample, design):
+    y, X = design
+    np.testing.assert_allclose(loocv_formula(FORMULA, sample).resid, loocv(y, X).resid)
+    np.testing.assert_allclose(kfold_formula(FORMULA, sample, k=4).resid,
+                               kfold(y, X, k=4).resid)
+
+
+def test_rsquared_implicit_constant(sample):
+    # A full set of dummies is an implicit constant, so the total sum
+    # of squares is centered in both cases.
+    a = loocv_formula("BPXSY1 ~ C(RIDRETH1) + RIDAGEYR", sample)
+    b = loocv_formula("BPXSY1 ~ C(RIDRETH1) + RIDAGEYR - 1", sample)
+    np.testing.assert_allclose(a.rsquared, b.rsquared)
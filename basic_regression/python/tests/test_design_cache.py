@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import patsy
+import pytest
+
+from design_cache import DesignCache
+
+FORMULAS = [
+    "BPXSY1 ~ RIDAGEYR + RIAGENDRx",
+    "BPXSY1 ~ C(RIDRETH1) + C(DMDEDUC2, Sum)",
+    "BPXSY1 ~ bs(RIDAGEYR, 5) + BMXBMI",
+    "BPXSY1 ~ RIDAGEYR * RIAGENDRx + C(RIDRETH1):BMXBMI",
+    "BPXSY1 ~ RIAGENDRx:C(RIDRETH1) - 1",
+    "BPXSY1 ~ np.log(BMXBMI) + I(RIDAGEYR * scale)",
+]
+
+
+def _check(cache, formula, data, eval_env):
+    y, X = cache.dmatrices(formula, eval_env)
+    ey, eX = patsy.dmatrices(formula, data, eval_env=eval_env, return_type="dataframe")
+    pd.testing.assert_frame_equal(y, ey)
+    pd.testing.assert_frame_equal(X, eX)
+
+
+@pytest.mark.parametrize("formula", FORMULAS)
+def test_matches_patsy(sample, formula):
+    cache = DesignCache(sample)
+    env = patsy.EvalEnvironment([{"np": np, "scale": 2.0}])
+    for _ in range(2):
+        _check(cache, formula, sample, env)
+    assert cache.hits > 0
+
+
+def test_missing_values(sample):
+    da = sample.copy()
+    da.loc[da.index[::7], "BMXBMI"] = np.nan
+    _check(DesignCache(da), "BPXSY1 ~ RIDAGEYR + BMXBMI", da, 0)
+
+
+def test_changed_column(sample):
+    da = sample.copy()
+    cache = DesignCache(da)
+    formula = "BPXSY1 ~ bs(RIDAGEYR, 4) + RIDAGEYR:RIAGENDRx"
+    _check(cache, formula, da, 0)
+    da["RIDAGEYR"] = da.RIDAGEYR + 10
+    _check(cache, formula, da, 0)
+
+
+def test_changed_variable(sample):
+    cache = DesignCache(sample)
+    formula = "BPXSY1 ~ I(RIDAGEYR * scale) + C(RIDRETH1, Treatment(ref))"
+    for scale, ref in (1.0, 1), (2.0, 1), (2.0, 3):
+        env = patsy.EvalEnvironment.capture()
+        _check(cache, formula, sample, env)
+    # A variable changed in place is found by its contents.
+    shift = np.zeros(len(sample))
+    formula = "BPXSY1 ~ I(RIDAGEYR + shift)"
+    env = patsy.EvalEnvironment.capture()
+    _check(cache, formula, sample, env)
+    shift += 1
+    _check(cache, formula, sample, env)
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+matplotlib = pytest.importorskip("matplotlib")
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+
+from statsmodels.nonparametric.smoothers_lowess import lowess  # noqa: E402
+
+from diagnostics import (add_lowess, binned_lowess, scatter, smooth,  # noqa: E402
+                         stratified_subsample)
+
+
+@pytest.fixture
+def xy():
+    rng = np.random.default_rng(0)
+    x = rng.uniform(0, 10, 3000)
+    return x, np.sin(x) + rng.normal(scale=0.3, size=len(x))
+
+
+def test_lowess_on_points(xy):
+    x, y = xy
+    fig, ax = plt.subplots()
+    scatter(ax, x, y, kind="points")
+    add_lowess(ax, frac=0.3)
+    line = ax.get_lines()[-1]
+    fit = smooth(y, x, frac=0.3)
+    np.testing.assert_allclose(line.get_ydata(), fit[:, 1])
+    plt.close(fig)
+
+
+def test_lowess_on_hexbin(xy):
+    x, y = xy
+    fig, ax = plt.subplots()
+    scatter(ax, x, y, kind="hexbin")
+    assert len(ax.get_lines()) == 0
+    add_lowess(ax, frac=0.3, x=x, y=y)
+    line = ax.get_lines()[-1]
+    np.testing.assert_allclose(line.get_ydata(), smooth(y, x, frac=0.3)[:, 1])
+
+    with pytest.raises(ValueError, match="pass x and y"):
+        add_lowess(plt.subplots()[1])
+    with pytest.raises(ValueError, match="together"):
+        add_lowess(ax, x=x)
+    plt.close("all")
+
+
+@pytest.mark.parametrize("frac", [0.1, 0.3, 2.0 / 3, 1.0])
+def test_binned_lowess_close_to_exact(xy, frac):
+    x, y = xy
+    exact = lowess(y, x, frac=frac)
+    fit = binned_lowess(y, x, frac=frac)
+    diff = np.interp(exact[:, 0], fit[:, 0], fit[:, 1]) - exact[:, 1]
+    # Within 5% of the residual standard deviation (0.3).
+    assert np.abs(diff).max() < 0.05 * 0.3
+
+
+def test_binned_lowess_frac(xy):
+    x, y = xy
+    with pytest.raises(ValueError, match="frac"):
+        binned_lowess(y, x, frac=1.5)
+    fit = binned_lowess(y[0:5], x[0:5], frac=1.0, gridsize=16)
+    assert np.isfinite(fit).all()
+
+
+@pytest.mark.parametrize("max_points", [10, 49, 50, 51, 333, 1000, 2999, 3000, 5000])
+def test_subsample_size(max_points):
+    rng = np.random.default_rng(1)
+    # Bins of very different sizes.
+    x = np.concatenate((rng.normal(size=2900), rng.uniform(-10, 10, 100)))
+    ii = stratified_subsample(x, max_points)
+    assert len(ii) == min(max_points, len(x))
+    assert len(np.unique(ii)) == len(ii)
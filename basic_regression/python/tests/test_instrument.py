@@ -0,0 +1,32 @@
+import importlib
+import sys
+
+import patsy
+
+import instrument
+
+
+def test_restores_names_bound_during_recording(sample, tmp_path, monkeypatch):
+    # A module imported while recording binds the wrapper by name.
+    (tmp_path / "uses_dmatrix.py").write_text("from patsy import dmatrix\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    raw = patsy.dmatrix
+
+    with instrument.recording() as rec:
+        mod = importlib.import_module("uses_dmatrix")
+        assert mod.dmatrix is not raw
+        mod.dmatrix("RIDAGEYR", sample)
+    assert [s["name"] for s in rec.spans] == ["patsy.dmatrix"]
+
+    assert patsy.dmatrix is raw
+    assert mod.dmatrix is raw
+    mod.dmatrix("RIDAGEYR", sample)
+    assert len(rec.spans) == 1
+    del sys.modules["uses_dmatrix"]
+
+
+def test_stale_wrapper_is_inert(sample):
+    with instrument.recording() as rec:
+        wrapped = patsy.dmatrix
+    wrapped("RIDAGEYR", sample)
+    assert rec.spans == []
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from statsmodels.regression.linear_model import OLS
+
+from design_cache import DesignCache
+from lazy_results import ols_lazy, ols_params
+
+
+@pytest.mark.parametrize("formula", [
+    "BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx",
+    # An implicit constant: a full set of dummy variables.
+    "BPXSY1 ~ C(RIDRETH1) + RIDAGEYR - 1",
+    "BPXSY1 ~ RIDAGEYR + BMXBMI - 1",
+])
+def test_matches_ols(sample, formula):
+    r = ols_lazy(formula, sample)
+    s = OLS.from_formula(formula, sample).fit()
+    assert r.k_constant == s.model.k_constant
+    np.testing.assert_allclose(r.params, s.params)
+    np.testing.assert_allclose(r.bse, s.bse)
+    for k in "rsquared", "rsquared_adj", "fvalue", "aic", "bic":
+        np.testing.assert_allclose(getattr(r, k), getattr(s, k), rtol=1e-8)
+
+
+@pytest.mark.parametrize("use_cache", [False, True])
+def test_caller_variables(sample, use_cache):
+    cache = DesignCache(sample) if use_cache else None
+    formula = "BPXSY1 ~ I(RIDAGEYR * scale) + BMXBMI"
+    for scale in 2.0, 3.0:
+        r = ols_lazy(formula, sample, cache=cache)
+        p = ols_params(formula, sample, cache=cache)
+        s = OLS.from_formula(formula, sample).fit()
+        np.testing.assert_allclose(r.params, s.params)
+        np.testing.assert_allclose(p, s.params)
+        np.testing.assert_allclose(r.bse, s.bse)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from statsmodels.regression.linear_model import OLS
+
+from design_cache import DesignCache
+from nested_ols import NestedOLS, fit_nested
+
+FORMULAS = ["BPXSY1 ~ RIDAGEYR",
+            "BPXSY1 ~ RIDAGEYR + RIAGENDRx",
+            "BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx",
+            "BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx + C(RIDRETH1)"]
+
+
+def _check(r, s):
+    assert list(r.params.index) == list(s.params.index)
+    np.testing.assert_allclose(r.params, s.params)
+    np.testing.assert_allclose(r.bse, s.bse)
+    for k in "rsquared", "rsquared_adj", "ssr", "fvalue", "f_pvalue", "llf":
+        np.testing.assert_allclose(getattr(r, k), getattr(s, k), rtol=1e-8)
+
+
+def test_fit_nested(sample):
+    results = fit_nested(FORMULAS, sample)
+    refits = [OLS.from_formula(f, sample).fit() for f in FORMULAS]
+    for r, s in zip(results, refits):
+        _check(r, s)
+    # F tests between consecutive models.
+    for j in range(1, len(FORMULAS)):
+        np.testing.assert_allclose(results[j].compare_f_test(results[j - 1])[0:2],
+                                   refits[j].compare_f_test(refits[j - 1])[0:2])
+    results[-1].summary()
+
+
+def test_earlier_model(sample):
+    cache = DesignCache(sample)
+    y, X = cache.dmatrices(FORMULAS[-1])
+    nest = NestedOLS(y, X[["Intercept", "RIDAGEYR"]]).add(X)
+    s = OLS.from_formula(FORMULAS[0], sample).fit()
+    _check(nest.fit(["Intercept", "RIDAGEYR"]), s)
+    with pytest.raises(ValueError):
+        nest.fit(["Intercept", "BMXBMI"])
+
+
+def test_ssr_added(sample):
+    # As in spline_basis.scan_spline_df.
+    cache = DesignCache(sample)
+    y, X = cache.dmatrices("BPXSY1 ~ BMXBMI + RIAGENDRx")
+    nest = NestedOLS(y, X)
+    ssr0 = OLS(y, X).fit().ssr
+    np.testing.assert_allclose(nest.ssr(), ssr0)
+    for df in 4, 5, 6:
+        Z = cache.dmatrix("bs(RIDAGEYR, %d) - 1" % df)
+        ssr = OLS(y, np.hstack((X, Z))).fit().ssr
+        np.testing.assert_allclose(ssr0 - nest.ssr_added(Z), ssr0 - ssr)
+    # The model is unchanged, and collinear blocks give nan.
+    np.testing.assert_allclose(nest.ssr(), ssr0)
+    assert np.isnan(nest.ssr_added(X[["BMXBMI"]] * 2))
+
+
+def test_scan(sample):
+    cache = DesignCache(sample)
+    y, X = cache.dmatrices("BPXSY1 ~ RIDAGEYR + RIAGENDRx")
+    nest = NestedOLS(y, X)
+    base = OLS(y, X).fit()
+    cands = sample[["BMXBMI", "DMDEDUC2"]]
+    scan = nest.scan(cands)
+    for c in cands.columns:
+        fit = OLS(y, X.assign(**{c: cands[c]})).fit()
+        np.testing.assert_allclose(scan.loc[c, "ssr"], fit.ssr)
+        F, pvalue, _ = fit.compare_f_test(base)
+        np.testing.assert_allclose([scan.loc[c, "F"], scan.loc[c, "pvalue"]], [F, pvalue])
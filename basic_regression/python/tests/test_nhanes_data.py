@@ -0,0 +1,121 @@
+import io
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import nhanes_data
+from nhanes_data import NHANES_VARS, file_digest, load_nhanes
+
+
+@pytest.fixture(params=["parquet", "npy"])
+def store_format(request, monkeypatch):
+    if request.param == "parquet":
+        pytest.importorskip("pyarrow")
+    else:
+        monkeypatch.setattr(nhanes_data, "_have_parquet", lambda: False)
+    return request.param
+
+
+def _stores(cache_dir):
+    return sorted(f for f in os.listdir(cache_dir) if f.endswith((".parquet", ".npy.d")))
+
+
+def test_load_matches_read_csv(sample_csv, tmp_path, store_format):
+    df = load_nhanes(NHANES_VARS, source=sample_csv, cache_dir=str(tmp_path))
+    expected = pd.read_csv(sample_csv)[NHANES_VARS]
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+
+def test_cache_hit_does_not_rebuild(sample_csv, tmp_path, store_format, monkeypatch):
+    load_nhanes(NHANES_VARS, source=sample_csv, cache_dir=str(tmp_path))
+    assert len(_stores(tmp_path)) == 1
+
+    def fail(*args):
+        raise AssertionError("the column store was rebuilt")
+
+    monkeypatch.setattr(nhanes_data, "_build_store", fail)
+    df = load_nhanes(["BPXSY1"], source=sample_csv, cache_dir=str(tmp_path))
+    assert list(df.columns) == ["BPXSY1"]
+
+
+def test_changed_file_invalidates(sample_csv, tmp_path, store_format):
+    csv = str(tmp_path / "nhanes.csv")
+    shutil.copy(sample_csv, csv)
+    cache = str(tmp_path / "cache")
+    df1 = load_nhanes(["BPXSY1"], source=csv, cache_dir=cache)
+
+    da = pd.read_csv(csv)
+    da["BPXSY1"] += 1
+    da.to_csv(csv, index=False)
+    df2 = load_nhanes(["BPXSY1"], source=csv, cache_dir=cache)
+
+    assert len(_stores(cache)) == 2
+    np.testing.assert_allclose(df2.BPXSY1, df1.BPXSY1 + 1)
+
+
+def test_digest_manifest(sample_csv, tmp_path, monkeypatch):
+    digest = file_digest(sample_csv, str(tmp_path))
+    assert os.path.exists(tmp_path / "manifest.json")
+
+    # An unchanged file is not read again.
+    def fail(*args):
+        raise AssertionError("the file was hashed again")
+
+    monkeypatch.setattr(nhanes_data.hashlib, "sha256", fail)
+    assert file_digest(sample_csv, str(tmp_path)) == digest
+
+
+def test_url_downloaded_once(sample_csv, tmp_path, monkeypatch):
+    with open(sample_csv, "rb") as f:
+        contents = f.read()
+    calls = []
+
+    def urlopen(url):
+        calls.append(url)
+        return io.BytesIO(contents)
+
+    monkeypatch.setattr(nhanes_data.urllib.request, "urlopen", urlopen)
+    url = "https://example.org/data/nhanes_sample.csv"
+    df1 = load_nhanes(NHANES_VARS, source=url, cache_dir=str(tmp_path))
+    df2 = load_nhanes(NHANES_VARS, source=url, cache_dir=str(tmp_path))
+    assert calls == [url]
+    pd.testing.assert_frame_equal(df1, df2)
+
+    load_nhanes(NHANES_VARS, source=url, cache_dir=str(tmp_path), refresh=True)
+    assert len(calls) == 2
+    # The contents are unchanged, so the store is reused.
+    assert len(_stores(tmp_path)) == 1
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".part")]
+
+
+def test_missing_column(sample_csv, tmp_path, store_format):
+    with pytest.raises(KeyError, match="NOTAVAR"):
+        load_nhanes(["BPXSY1", "NOTAVAR"], source=sample_csv, cache_dir=str(tmp_path))
+
+
+def test_categorical(sample_csv, tmp_path):
+    df = load_nhanes(NHANES_VARS, source=sample_csv, cache_dir=str(tmp_path),
+                     categorical=True)
+    raw = pd.read_csv(sample_csv)
+    assert isinstance(df.RIAGENDR.dtype, pd.CategoricalDtype)
+    assert list(df.RIAGENDR.cat.categories) == ["Female", "Male"]
+    assert (df.RIAGENDR.isna() == raw.RIAGENDR.isna()).all()
+    assert (df.RIAGENDR[raw.RIAGENDR == 1] == "Male").all()
+
+
+def test_chunked_matches_full(sample_csv):
+    df = nhanes_data.load_nhanes_chunked([sample_csv, sample_csv], chunksize=37)
+    full = pd.read_csv(sample_csv)[NHANES_VARS].dropna()
+    pd.testing.assert_frame_equal(df, pd.concat([full, full]))
+
+
+def test_missing_strings(tmp_path, store_format):
+    csv = str(tmp_path / "strings.csv")
+    pd.DataFrame({"BPXSY1": [120.0, 130.0, 140.0],
+                  "RIAGENDRx": ["Male", np.nan, "Female"]}).to_csv(csv, index=False)
+    df = load_nhanes(source=csv, cache_dir=str(tmp_path / "cache"))
+    pd.testing.assert_frame_equal(df, pd.read_csv(csv))
+    assert df.dropna().shape[0] == 2
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+from statsmodels.genmod.generalized_linear_model import GLM
+from statsmodels.regression.linear_model import OLS
+
+from out_of_core import _add_gender_labels, chunk_source, glm_from_chunks
+from suffstats import ols_from_chunks
+
+
+@pytest.fixture
+def chunks(sample_csv, tmp_path):
+    # Two cycles, read in chunks that do not line up with the files.
+    sources = []
+    for j in range(2):
+        da = pd.read_csv(sample_csv)
+        da["BPXSY1"] += 5 * j
+        fname = str(tmp_path / ("cycle%d.csv" % j))
+        da.to_csv(fname, index=False)
+        sources.append(fname)
+    return chunk_source(sources, transform=_add_gender_labels, chunksize=37)
+
+
+def _body(smry):
+    return [line for line in str(smry).splitlines()
+            if not line.startswith(("Date:", "Time:"))]
+
+
+@pytest.mark.parametrize("formula", [
+    "BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx",
+    "BPXSY1 ~ bs(RIDAGEYR, 5) + BMXBMI + RIAGENDRx",
+    "BPXSY1 ~ C(RIDRETH1) + RIDAGEYR - 1",
+])
+def test_matches_in_memory(chunks, formula):
+    da = pd.concat(list(chunks()))
+    fits = [(OLS.from_formula(formula, da).fit(), ols_from_chunks(formula, chunks)),
+            (GLM.from_formula(formula, da).fit(), glm_from_chunks(formula, chunks))]
+    for ref, res in fits:
+        np.testing.assert_allclose(res.params, ref.params, rtol=1e-8)
+        np.testing.assert_allclose(res.bse, ref.bse, rtol=1e-8)
+        np.testing.assert_allclose(res.llf, ref.llf, rtol=1e-10)
+        np.testing.assert_allclose(res.aic, ref.aic, rtol=1e-10)
+        assert _body(res.summary()) == _body(ref.summary())
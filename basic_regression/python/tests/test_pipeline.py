@@ -0,0 +1,51 @@
+import numpy as np
+
+from pipeline import Pipeline
+
+
+def _build(cache_dir, source):
+    pipe = Pipeline(str(cache_dir), source=source)
+
+    @pipe.stage
+    def raw(source):
+        with open(source) as f:
+            return f.read()
+
+    @pipe.stage
+    def length(raw):
+        return len(raw)
+
+    return pipe
+
+
+def test_changed_file_invalidates(tmp_path):
+    src = tmp_path / "data.csv"
+    src.write_text("a\n1\n")
+    pipe = _build(tmp_path / "cache", str(src)).run()
+    assert pipe["length"] == 4
+
+    pipe = _build(tmp_path / "cache", str(src)).run()
+    assert list(pipe.report().status) == ["hit", "hit"]
+
+    src.write_text("a\n1\n2\n")
+    pipe = _build(tmp_path / "cache", str(src)).run()
+    assert list(pipe.report().status) == ["run", "run"]
+    assert pipe["length"] == 6
+
+
+def test_workflow_reloads_fits(tmp_path, sample_csv):
+    import nhanes_workflow
+
+    def build():
+        return nhanes_workflow.build(str(tmp_path / "cache"), source=sample_csv,
+                                     data_cache=str(tmp_path / "data"))
+
+    first = build().run(["bands_spline"])
+    # A new run loads fit_spline from the cache (which evaluates its
+    # formula again) and computes the bands from it.
+    pipe = build().run(["bands_spline"], force=["bands_spline"])
+    status = pipe.report().set_index("stage").status
+    assert status["fit_spline"] == "hit"
+    assert status["bands_spline"] == "run"
+    for a, b in zip(pipe["bands_spline"], first["bands_spline"]):
+        np.testing.assert_allclose(a, b)
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+from statsmodels.regression.linear_model import OLS
+
+from robust_cov import robust_formula
+
+FORMULA = "BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx"
+
+
+def test_matches_statsmodels(sample):
+    rob = robust_formula(FORMULA, sample, groups="RIDRETH1")
+    model = OLS.from_formula(FORMULA, sample)
+    for c in "HC0", "HC1", "HC2", "HC3":
+        np.testing.assert_allclose(rob.bse[c], model.fit(cov_type=c).bse)
+    res = model.fit(cov_type="cluster", cov_kwds={"groups": sample.RIDRETH1})
+    np.testing.assert_allclose(rob.bse["cluster"], res.bse)
+
+
+def test_duplicate_index(sample):
+    # Stacked cycles, with a missing value so that rows are dropped.
+    da = pd.concat([sample, sample])
+    da.iloc[3, da.columns.get_loc("BMXBMI")] = np.nan
+    rob = robust_formula(FORMULA, da, groups=da.RIDRETH1.values)
+    ok = da.BMXBMI.notna().values
+    res = OLS.from_formula(FORMULA, da[ok]).fit(
+        cov_type="cluster", cov_kwds={"groups": da.RIDRETH1.values[ok]})
+    np.testing.assert_allclose(rob.bse["cluster"], res.bse)
+
+
+def test_cache_follows_caller_variables(sample):
+    from design_cache import DesignCache
+
+    cache = DesignCache(sample)
+    formula = "BPXSY1 ~ I(RIDAGEYR * scale) + BMXBMI"
+    for scale in 2.0, 3.0:
+        rob = robust_formula(formula, sample, groups="RIDRETH1", cache=cache)
+        res = OLS.from_formula(formula, sample).fit(cov_type="HC1")
+        np.testing.assert_allclose(rob.params, res.params)
+        np.testing.assert_allclose(rob.bse["HC1"], res.bse)
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import threading
+
+import numpy as np
+import pytest
+import statsmodels.api as sm
+
+from model_export import export_model, load_model, save_model
+from scoring_service import ScoringService, serve_http
+
+FORMULA = "BPXSY1 ~ bs(RIDAGEYR, 5) + BMXBMI + RIAGENDRx"
+VARS = ["RIDAGEYR", "BMXBMI", "RIAGENDRx"]
+
+
+def _roundtrip(spec, tmp_path):
+    path = str(tmp_path / "model.json")
+    save_model(spec, path)
+    return load_model(path)
+
+
+@pytest.fixture
+def fit(sample):
+    return sm.OLS.from_formula(FORMULA, sample).fit()
+
+
+@pytest.fixture
+def model(fit, tmp_path):
+    return _roundtrip(export_model(fit), tmp_path)
+
+
+def test_predict_matches_statsmodels(sample, fit, model):
+    np.testing.assert_allclose(model.predict(sample), fit.predict(sample))
+    records = sample[VARS].to_dict("records")
+    np.testing.assert_allclose(model.predict_records(records), fit.predict(sample))
+
+
+def test_derived_variable(sample, tmp_path):
+    da = sample.copy()
+    age_mean = da.RIDAGEYR.mean()
+    da["RIDAGEYR_cen"] = da.RIDAGEYR - age_mean
+    fit = sm.OLS.from_formula("BPXSY1 ~ RIDAGEYR_cen*RIAGENDRx + BMXBMI", da).fit()
+    model = _roundtrip(export_model(fit, {"RIDAGEYR_cen": ("RIDAGEYR", age_mean)}), tmp_path)
+    np.testing.assert_allclose(model.predict(sample), fit.predict(da))
+
+
+async def _post(port, path, body):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = json.dumps(body).encode()
+    writer.write(b"POST %s HTTP/1.1\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+                 % (path.encode(), len(data)) + data)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line == b"\r\n":
+            break
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    out = json.loads(await reader.readexactly(length))
+    writer.close()
+    return status, out
+
+
+def test_http(sample, fit, model):
+    records = sample[VARS].iloc[0:20].to_dict("records")
+    expected = fit.predict(sample.iloc[0:20]).values
+
+    async def run():
+        async with ScoringService({"spline": model}) as service:
+            server = await serve_http(service, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            single = await asyncio.gather(*[_post(port, "/predict/spline", r) for r in records])
+            batch = await _post(port, "/predict/spline", {"records": records})
+            bad = await _post(port, "/predict/spline", {"RIDAGEYR": 50})
+            missing = await _post(port, "/predict/other", records[0])
+            server.close()
+            await server.wait_closed()
+        return single, batch, bad, missing
+
+    single, batch, bad, missing = asyncio.run(run())
+    assert all(s == 200 for s, _ in single)
+    np.testing.assert_allclose([b["prediction"] for _, b in single], expected)
+    assert batch[0] == 200
+    np.testing.assert_allclose(batch[1]["predictions"], expected)
+    assert bad[0] == 400
+    assert missing[0] == 404
+
+
+class _Failing:
+
+    def predict_records(self, records):
+        raise RuntimeError("scoring failed")
+
+
+class _Blocking:
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def predict_records(self, records):
+        self.started.set()
+        self.release.wait(10)
+        return [0.0] * len(records)
+
+
+def test_unexpected_error_reaches_callers():
+    async def run():
+        async with ScoringService({"m": _Failing()}) as service:
+            calls = [service.score("m", {}) for _ in range(3)]
+            return await asyncio.wait_for(asyncio.gather(*calls, return_exceptions=True), 5)
+
+    out = asyncio.run(run())
+    assert all(isinstance(e, RuntimeError) and "scoring failed" in str(e) for e in out)
+
+
+def test_stop_fails_waiting_callers():
+    model = _Blocking()
+
+    async def run():
+        service = ScoringService({"m": model}, max_batch=1, n_threads=1)
+        await service.start()
+        # The first record is being scored and the second is queued.
+        calls = [asyncio.ensure_future(service.score("m", {})) for _ in range(2)]
+        await asyncio.get_running_loop().run_in_executor(None, model.started.wait, 5)
+        await service.stop()
+        return await asyncio.wait_for(asyncio.gather(*calls, return_exceptions=True), 5)
+
+    try:
+        out = asyncio.run(run())
+    finally:
+        model.release.set()
+    assert all(isinstance(e, RuntimeError) and "stopped" in str(e) for e in out)
@@ -0,0 +1,71 @@
+import multiprocessing
+import pickle
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from shared_frame import SharedFrame
+
+
+def _frame():
+    df = pd.DataFrame({
+        "x": np.linspace(0, 1, 7),
+        "n": np.arange(7, dtype=np.int32),
+        "b": [True, False] * 3 + [True],
+        "c": pd.Categorical(["a", "b", None, "a", "c", "b", "a"], categories=["c", "b", "a"]),
+        "s": ["Male", "Female", np.nan, "Female", "Male", "Male", np.nan],
+    })
+    df.index = pd.Index(np.arange(7) * 3 + 100, name="SEQN")
+    return df
+
+
+def _expected(df):
+    # Strings come back as categoricals.
+    return df.assign(s=df.s.astype("category"))
+
+
+def _sum(shared):
+    return float(shared.frame().x.sum()), shared.frame().s.isna().sum()
+
+
+@pytest.mark.parametrize("range_index", [False, True])
+def test_frame(range_index):
+    df = _frame()
+    if range_index:
+        df = df.reset_index(drop=True)
+    with SharedFrame.from_frame(df) as shared:
+        out = shared.frame()
+        pd.testing.assert_frame_equal(out, _expected(df))
+        pd.testing.assert_frame_equal(out.astype({"s": object}), df)
+        assert not out.x.values.flags.writeable
+
+
+def test_pickle():
+    df = _frame()
+    with SharedFrame.from_frame(df) as shared:
+        # Within a process the handle is reused.
+        assert pickle.loads(pickle.dumps(shared)) is shared
+        # A new process attaches to the same block.
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            total, nmissing = pool.apply(_sum, (shared,))
+        assert total == df.x.sum()
+        assert nmissing == 2
+
+
+def test_unlink():
+    shared = SharedFrame.from_frame(_frame())
+    name = shared._layout["name"]
+    shared.unlink()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name)
+
+
+def test_unsupported():
+    df = pd.DataFrame({"t": pd.date_range("2020-01-01", periods=3)})
+    with pytest.raises(ValueError, match="unsupported dtype"):
+        SharedFrame.from_frame(df)
+    df = pd.DataFrame({"x": [1.0, 2.0, 3.0]}, index=["a", "b", "c"])
+    with pytest.raises(ValueError, match="index"):
+        SharedFrame.from_frame(df)
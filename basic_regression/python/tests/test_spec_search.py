@@ -0,0 +1,28 @@
+import numpy as np
+import statsmodels.formula.api as smf
+
+from spec_search import search
+
+
+def test_scores_match_statsmodels(sample):
+    res = search("BPXSY1", ["RIDAGEYR", "BMXBMI", "RIAGENDRx", "C(RIDRETH1)"], sample,
+                 splines=["RIDAGEYR", "BMXBMI"], cv=None)
+    for r in res.itertuples():
+        fit = smf.ols(r.formula, sample).fit()
+        np.testing.assert_allclose([r.ssr, r.aic, r.bic], [fit.ssr, fit.aic, fit.bic],
+                                   rtol=1e-11, err_msg=r.formula)
+        assert r.k == fit.df_model + 1
+
+
+def test_cv_matches_refits(sample):
+    formulas = ["BPXSY1 ~ RIDAGEYR + BMXBMI + RIDAGEYR:BMXBMI",
+                "BPXSY1 ~ RIDAGEYR + RIAGENDRx + C(RIDRETH1)"]
+    res = search(None, None, sample, formulas=formulas, cv=4, seed=1).set_index("formula")
+    folds = np.random.default_rng(1).permutation(len(sample)) % 4
+    for f in formulas:
+        sse = 0.
+        for k in range(4):
+            fit = smf.ols(f, sample[folds != k]).fit()
+            test = sample[folds == k]
+            sse += ((test.BPXSY1 - fit.predict(test))**2).sum()
+        np.testing.assert_allclose(res.loc[f, "cv_mse"], sse / len(sample), rtol=1e-10)
@@ -0,0 +1,22 @@
+import numpy as np
+from statsmodels.regression.linear_model import OLS
+
+import spline_basis
+# bs_table is used in formulas.
+from spline_basis import bs_table  # noqa: F401
+
+
+def test_matches_bs(sample):
+    a = OLS.from_formula("BPXSY1 ~ bs(RIDAGEYR, 5) + BMXBMI", sample).fit()
+    b = OLS.from_formula("BPXSY1 ~ bs_table(RIDAGEYR, 5) + BMXBMI", sample).fit()
+    np.testing.assert_allclose(b.params.values, a.params.values)
+    new = sample.iloc[0:10].assign(RIDAGEYR=np.linspace(20, 70.5, 10))
+    np.testing.assert_allclose(b.predict(new), a.predict(new))
+
+
+def test_cache_is_bounded():
+    for j in range(spline_basis.MAX_BASES + 10):
+        spline_basis.spline_basis([0, 0, 0, 0, 50 + j, 100, 100, 100, 100])
+    assert spline_basis._cached_basis.cache_info().currsize == spline_basis.MAX_BASES
+    basis = spline_basis.spline_basis([0, 0, 0, 0, 50, 100, 100, 100, 100])
+    assert basis is spline_basis.spline_basis(np.array([0, 0, 0, 0, 50, 100, 100, 100, 100.]))
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from statsmodels.regression.linear_model import OLS
+
+from suffstats import ols_from_formula
+
+
+@pytest.mark.parametrize("formula", [
+    "BPXSY1 ~ RIDAGEYR + BMXBMI + RIAGENDRx",
+    # An implicit constant: a full set of dummy variables.
+    "BPXSY1 ~ C(RIDRETH1) + RIDAGEYR - 1",
+    "BPXSY1 ~ RIDAGEYR + BMXBMI - 1",
+])
+def test_matches_ols(sample, formula):
+    r = ols_from_formula(formula, sample, chunksize=37)
+    s = OLS.from_formula(formula, sample).fit()
+    assert r.k_constant == s.model.k_constant
+    assert r.df_model == s.df_model
+    np.testing.assert_allclose(r.params, s.params)
+    np.testing.assert_allclose(r.bse, s.bse)
+    for k in "rsquared", "rsquared_adj", "fvalue", "aic", "bic":
+        np.testing.assert_allclose(getattr(r, k), getattr(s, k), rtol=1e-8)
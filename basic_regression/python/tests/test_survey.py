@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+from statsmodels.regression.linear_model import WLS
+
+from design_cache import DesignCache
+from survey import survey_formula
+
+FORMULA = "BPXSY1 ~ RIDAGEYR + BMXBMI + C(RIAGENDR)"
+
+
+def _taylor(data):
+    """
+    The linearization variance, from per-stratum sums over PSU totals.
+    """
+    ok = data[["BPXSY1", "RIDAGEYR", "BMXBMI", "RIAGENDR"]].notna().all(1)
+    dom = data[ok]
+    res = WLS.from_formula(FORMULA, dom, weights=dom.WTMEC2YR).fit()
+    X = res.model.exog
+    w = dom.WTMEC2YR.values
+    ainv = np.linalg.inv(X.T @ (X * w[:, None]))
+
+    # Rows outside the domain contribute zero to their PSU's total.
+    u = pd.DataFrame(0.0, index=range(data.shape[0]), columns=res.params.index)
+    u.loc[np.flatnonzero(ok)] = X * (w * res.resid.values)[:, None]
+    u["stratum"] = data.SDMVSTRA.values
+    u["psu"] = data.SDMVPSU.values
+    meat = 0
+    for _, g in u.groupby("stratum"):
+        z = g.groupby("psu").sum().drop(columns="stratum").values
+        d = z - z.mean(0)
+        meat = meat + len(z) / (len(z) - 1) * d.T @ d
+    return res.params, ainv @ meat @ ainv
+
+
+@pytest.fixture
+def design_data(sample_csv):
+    return pd.read_csv(sample_csv)
+
+
+def test_taylor_matches_reference(design_data):
+    params, cov = _taylor(design_data)
+    r = survey_formula(FORMULA, design_data)
+    np.testing.assert_allclose(r.params, params)
+    np.testing.assert_allclose(r.cov_params(), cov)
+
+    r = survey_formula(FORMULA, design_data, cache=DesignCache(design_data))
+    np.testing.assert_allclose(r.cov_params(), cov)
+
+
+def test_jackknife_close_to_taylor(design_data):
+    t = survey_formula(FORMULA, design_data)
+    j = survey_formula(FORMULA, design_data, variance="jackknife")
+    np.testing.assert_allclose(j.params, t.params)
+    np.testing.assert_allclose(j.bse, t.bse, rtol=0.05)
+
+
+def test_duplicate_index(design_data):
+    da = pd.concat([design_data, design_data])
+    r = survey_formula(FORMULA, da)
+    np.testing.assert_allclose(r.params, survey_formula(FORMULA, design_data).params)
+
+
+@pytest.mark.parametrize("fay", [0.0, 0.5])
+def test_brr_matches_replicate_fits(design_data, fay):
+    # Three strata of two PSUs, balanced by the columns 1-3 of the
+    # Hadamard matrix of order 4.
+    strata = np.sort(design_data.SDMVSTRA.unique())[0:3]
+    da = design_data[design_data.SDMVSTRA.isin(strata)]
+    da = da.sort_values(["SDMVSTRA", "SDMVPSU"], kind="stable").reset_index(drop=True)
+    had = np.array([[1, 1, 1, 1], [1, -1, 1, -1], [1, 1, -1, -1], [1, -1, -1, 1]])
+
+    dom = da.dropna(subset=["BPXSY1", "RIDAGEYR", "BMXBMI", "RIAGENDR"])
+    b = WLS.from_formula(FORMULA, dom, weights=dom.WTMEC2YR).fit().params
+    h = np.searchsorted(strata, dom.SDMVSTRA.values)
+    first = (dom.SDMVPSU.values == dom.groupby("SDMVSTRA").SDMVPSU.transform("min").values)
+    reps = []
+    for r in range(4):
+        half = np.where(first, 1, -1) * had[r, h + 1] > 0
+        w = dom.WTMEC2YR * np.where(half, 2 - fay, fay)
+        reps.append(WLS.from_formula(FORMULA, dom, weights=w).fit().params)
+    e = np.asarray(reps) - b.values
+    se = np.sqrt((e**2).sum(0) / (4 * (1 - fay)**2))
+
+    r = survey_formula(FORMULA, da, variance="brr", fay=fay)
+    np.testing.assert_allclose(r.params, b)
+    np.testing.assert_allclose(r.replicates, np.asarray(reps))
+    np.testing.assert_allclose(r.bse, se)